@@ -4,10 +4,21 @@ import os
 import re
 import json
 import time
-import copy
 import math
 import base64
-from io import BytesIO
+import cProfile
+import csv
+import gc
+import hashlib
+import mmap
+import multiprocessing
+import pstats
+import struct
+import threading
+import zlib
+from collections import OrderedDict, defaultdict, deque
+from itertools import compress
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
 
 # --- CONFIGURATION INITIALE ---
 WINDOW_WIDTH = 1280
@@ -23,8 +34,86 @@ UI_MARGIN = 10
 UI_GAP_X = 5
 UI_GAP_Y = 10
 
-# Configuration Historique
-MAX_HISTORY = 30
+# Configuration Historique (par étage : budget mémoire des différences, pas un nombre d'états)
+HISTORY_MAX_BYTES = 2 * 1024 * 1024
+HISTORY_COALESCE_MS = 400  # Deux éditions identiques plus rapprochées ne forment qu'une étape
+
+# Configuration Grille creuse (blocs de CHUNK_SIZE x CHUNK_SIZE cases, alloués à la demande)
+CHUNK_SIZE = 32
+
+# Configuration Index des murs (seaux carrés de WALL_BUCKET_SIZE pixels)
+WALL_BUCKET_SIZE = 4 * TILE_SIZE
+WALL_PICK_DISTANCE = 10
+WALL_WELD_DISTANCE = 2  # Deux extrémités à moins de 2 pixels sont soudées en un même sommet
+
+# Configuration Cache de rotation (variantes pivotées des assets)
+ROTATION_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Configuration Cache des assets pleine taille (les moins récemment dessinés sont libérés, puis relus)
+FULL_ASSET_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Assets opaques stockés en 24 bits (-25 % de mémoire) : désactivé, les blits 24 -> 32 bits rendent
+# le dessin et l'export plus lents que des surfaces au format du display
+OPAQUE_ASSETS_24BIT = False
+
+# Configuration Caméra (TILE_SIZE * zoom doit rester un nombre entier de pixels)
+CAMERA_ZOOM_LEVELS = (0.25, 0.5, 0.75, 1.0, 1.5, 2.0)
+
+# Configuration Pyramide des assets (TILE_SIZE, /2, /4, /8) et mini-carte
+MIP_LEVELS = 4
+MINIMAP_SIZE = 200      # Côté du cadre de la mini-carte à l'écran
+MINIMAP_MAX_PX = 1024   # Côté max du rendu hors-écran (au-delà, un pixel regroupe plusieurs cases)
+MINIMAP_MARGIN = 4      # Cases ajoutées autour de la carte (doublées à chaque agrandissement de la zone)
+
+# Configuration Palette (icônes des assets, prérendues par catégorie dans une planche)
+PALETTE_ICON_SIZE = 64
+PALETTE_ROW_HEIGHT = 74
+
+# Configuration Interface retenue (rendus de boutons mis en cache par texte / couleurs / survol / taille)
+BUTTON_CACHE_MAX_ENTRIES = 256
+
+# Configuration Profileur de frame (F3 : affichage, F4 : CSV, F5 : capture cProfile)
+PROFILER_WINDOW = 120   # Frames prises en compte pour moyenne / p95 / max
+PROFILER_PHASES = ("layout", "events", "map", "walls", "ui", "overlays", "display", "idle")
+
+# Configuration Cadence (60 FPS pendant une interaction continue, sinon attente des événements)
+IDLE_MAX_WAIT_MS = 1000  # Réveil de sécurité même sans événement ni échéance
+
+# Configuration Export (rendu par bandes horizontales, PNG encodé au fil de l'eau)
+EXPORT_STRIP_MAX_BYTES = 64 * 1024 * 1024  # Plafond d'une bande : surface (4 o/pixel) + copie RVB (3 o/pixel)
+EXPORT_PNG_COMPRESSION = 6
+
+# Configuration Export de tous les étages (un .dd2vtt par étage, rendus par un pool de processus)
+EXPORT_WORKERS = min(4, os.cpu_count() or 1)
+
+# Configuration Chargement des assets (décodage des images en parallèle)
+ASSET_LOADER_WORKERS = min(8, os.cpu_count() or 1)
+
+# Configuration Atlas de textures (miniatures regroupées dans quelques grandes surfaces)
+# Désactivé : avec le pack fourni, les pages occupent plus de mémoire et se blittent plus lentement que
+# des surfaces séparées (voir benchmark.py, section atlas)
+ATLAS_ENABLED = False
+ATLAS_PAGE_SIZE = 1024  # Côté d'une page ; un asset plus grand garde sa propre surface
+
+# Configuration Cache disque des assets (pixels déjà mis à l'échelle, lus par mmap sans décodage)
+ASSET_CACHE_DIR = ".asset_cache"
+ASSET_CACHE_MAGIC = b"MDAC"
+ASSET_CACHE_VERSION = 1
+# magic, version, TILE_SIZE, mtime_ns et taille du fichier source, côté miniature, côté pleine taille
+ASSET_CACHE_HEADER = struct.Struct("<4sHHqqHH")
+
+# Configuration Format projet binaire (.mdmap : table des assets, index des étages, un bloc par étage)
+PROJECT_BINARY_EXT = ".mdmap"
+PROJECT_BINARY_MAGIC = b"MDMP"
+PROJECT_BINARY_VERSION = 3       # Les versions 1 (un seul bloc) et 2 (éléments non groupés par bloc) restent lisibles
+PROJECT_BINARY_COMPRESS = True   # zlib sur la table des assets et sur chaque bloc d'étage
+PROJECT_HEADER = struct.Struct("<4sHB")     # magic, version, drapeaux (bit 0 : zlib)
+PROJECT_LEVEL_ENTRY = struct.Struct("<iBIIQI")  # étage, présence (bit 0 : éléments, bit 1 : murs), nb éléments, nb murs, position, longueur
+PROJECT_CHUNK = struct.Struct("<iiI")       # bloc de grille (cx, cy), nb éléments (répertoire d'un étage, version 3)
+PROJECT_ITEM = struct.Struct("<iiIhB")      # x, y, id d'asset, angle, couche
+PROJECT_WALL = struct.Struct("<iiii")       # x1, y1, x2, y2
+
+# Configuration Chargement paresseux des étages (seuls l'étage courant et ses voisins sont construits)
+LEVEL_STREAM_MAX_ITEMS = 400000  # Au-delà, les étages inactifs et non modifiés sont déchargés
 
 # --- CONSTANTES DES COUCHES ---
 LAYER_GROUND = 0
@@ -56,8 +145,38 @@ COLOR_BORDER_GOLD = (160, 120, 40)
 COLOR_BORDER_ACTIVE = (255, 215, 0)
 
 # --- VARIABLES GLOBALES ---
-undo_stack = []
-redo_stack = []
+# Cache LRU des surfaces pivotées : (clé asset, angle, échelle) -> Surface
+rotation_cache = OrderedDict()
+rotation_cache_lock = threading.Lock()  # L'export en arrière-plan partage le cache avec la vue
+rotation_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+
+# Fichiers source des assets, pour matérialiser la pleine taille au premier usage : clé -> (chemin, taille)
+asset_sources = {}
+asset_load_stats = {}
+
+# Compteurs de rendu remis à zéro à chaque frame par le profileur
+render_stats = {"map_blits": 0}
+
+# Pyramides des assets pleine taille : clé -> [niveau 0, 1, ...], chaque niveau moitié du précédent.
+# Les niveaux 1+ comptent dans l'entrée LRU de l'asset et sont libérés avec lui
+asset_mips = {}
+
+# Couleur moyenne de chaque asset (pixels transparents ignorés) pour la mini-carte réduite : clé -> couleur
+minimap_colors = {}
+
+# Pages d'atlas des miniatures, voir ATLAS DE TEXTURES. Les pleines tailles, gérées par le LRU, restent
+# des surfaces séparées : le budget compte ainsi la mémoire réellement libérée à l'éviction
+asset_atlases = {"thumb": []}
+
+# LRU des pleines tailles chargées : clé -> octets, pyramide comprise (ordre = du moins au plus récemment dessiné)
+full_asset_lru = OrderedDict()
+full_asset_lock = threading.Lock()  # L'export en arrière-plan touche le LRU en dessinant
+full_asset_stats = {"hits": 0, "misses": 0, "evictions": 0, "reloads": 0, "bytes": 0, "opaque": 0,
+                    "opaque_saved": 0}  # Octets économisés par le stockage 24 bits (OPAQUE_ASSETS_24BIT)
+full_asset_evicted = set()  # Clés déjà libérées une fois (un nouveau chargement est un rechargement)
+
+# Cache LRU des boutons rendus : (texte, police, couleurs, survol, taille) -> (Surface, décalage)
+button_cache = OrderedDict()
 
 
 # --- FONCTIONS UTILITAIRES ---
@@ -69,7 +188,57 @@ def draw_text_centered(surface, text, font, color, container_rect):
 
 
 def draw_fantasy_button(surface, rect, text, font, text_color, base_color, border_color, is_hovered=False):
-    """Dessine un bouton style RPG."""
+    """Dessine un bouton style RPG (rendu mis en cache) ; renvoie la zone de `surface` modifiée."""
+    button_surf, offset = get_button_surface(text, font, text_color, base_color, border_color, is_hovered,
+                                             rect.size)
+    return surface.blit(button_surf, (rect.x + offset[0], rect.y + offset[1]))
+
+
+def get_button_surface(text, font, text_color, base_color, border_color, is_hovered, size):
+    """Rendu (Surface transparente, décalage par rapport au coin du bouton) d'un bouton, mis en cache.
+
+    Le décalage est négatif si le texte déborde du bouton.
+    """
+    cache_key = (text, font, text_color, base_color, border_color, is_hovered, size)
+    cached = button_cache.get(cache_key)
+    if cached:
+        button_cache.move_to_end(cache_key)
+        return cached
+
+    # Le contour va jusqu'à (w, h) inclus ; le texte et son ombre peuvent dépasser
+    w, h = size
+    text_rect = pygame.Rect((0, 0), font.size(text))
+    text_rect.center = (w // 2, h // 2)
+    bounds = pygame.Rect(0, 0, w + 1, h + 1).union(text_rect).union(text_rect.move(1, 1))
+    button_surf = pygame.Surface(bounds.size, pygame.SRCALPHA)
+    render_fantasy_button(button_surf, pygame.Rect(-bounds.x, -bounds.y, w, h), text, font, text_color,
+                          base_color, border_color, is_hovered)
+
+    cached = (button_surf, bounds.topleft)
+    button_cache[cache_key] = cached
+    if len(button_cache) > BUTTON_CACHE_MAX_ENTRIES:
+        button_cache.popitem(last=False)
+    return cached
+
+
+def draw_retained_button(surface, drawn_states, name, rect, text, font, text_color, base_color, border_color,
+                         is_hovered, bg_color):
+    """Redessine le bouton `name` seulement si son état diffère de celui déjà à l'écran.
+
+    `drawn_states` mémorise l'état affiché de chaque widget ; renvoie la zone modifiée (ou None).
+    """
+    state = (tuple(rect), text, font, text_color, base_color, border_color, is_hovered)
+    if drawn_states.get(name) == state: return None
+    drawn_states[name] = state
+    button_surf, offset = get_button_surface(text, font, text_color, base_color, border_color, is_hovered,
+                                             rect.size)
+    area = button_surf.get_rect(topleft=(rect.x + offset[0], rect.y + offset[1]))
+    surface.fill(bg_color, area)
+    return surface.blit(button_surf, area)
+
+
+def render_fantasy_button(surface, rect, text, font, text_color, base_color, border_color, is_hovered=False):
+    """Dessin effectif d'un bouton style RPG (polygone, contour, texte ombré)."""
     x, y, w, h = rect.x, rect.y, rect.width, rect.height
     cut = 8
 
@@ -107,11 +276,176 @@ def parse_size_from_filename(filename):
     return 1
 
 
-def load_all_assets_from_folder(root_folder):
+def get_asset_cache_dir():
+    """Dossier du cache disque : à côté de l'EXE en version gelée (_MEIPASS est temporaire)."""
+    if getattr(sys, 'frozen', False):
+        base_dir = os.path.dirname(os.path.abspath(sys.executable))
+    else:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_dir, ASSET_CACHE_DIR)
+
+
+def get_asset_cache_path(cache_dir, rel_path):
+    """Fichier de cache d'un asset, nommé d'après son chemin relatif au dossier d'assets."""
+    digest = hashlib.sha1(f"{rel_path}|{TILE_SIZE}".encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, digest + ".raw")
+
+
+def read_asset_cache_header(cache_path, source_stat):
+    """En-tête d'une entrée valide (même source, même TILE_SIZE), sinon None."""
+    try:
+        with open(cache_path, "rb") as f:
+            raw = f.read(ASSET_CACHE_HEADER.size)
+    except OSError:
+        return None
+    if len(raw) != ASSET_CACHE_HEADER.size: return None
+    magic, version, tile_size, mtime_ns, file_size, thumb_dim, full_dim = ASSET_CACHE_HEADER.unpack(raw)
+    if (magic, version, tile_size) != (ASSET_CACHE_MAGIC, ASSET_CACHE_VERSION, TILE_SIZE): return None
+    if (mtime_ns, file_size) != (source_stat.st_mtime_ns, source_stat.st_size): return None
+    return thumb_dim, full_dim
+
+
+def read_asset_cache_surface(cache_path, full):
+    """Surface RGBA (non convertie) lue par mmap : la miniature, ou la pleine taille si `full`."""
+    with open(cache_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            thumb_dim, full_dim = ASSET_CACHE_HEADER.unpack_from(mm)[5:]
+            start = ASSET_CACHE_HEADER.size
+            dim = thumb_dim
+            if full:
+                start += thumb_dim * thumb_dim * 4
+                dim = full_dim
+            end = start + dim * dim * 4
+            if end > len(mm): raise ValueError("entrée de cache tronquée")
+            # frombytes copie : le mmap peut être refermé aussitôt
+            return pygame.image.frombytes(mm[start:end], (dim, dim), "RGBA")
+
+
+def write_asset_cache(cache_path, source_stat, thumb, full):
+    """Écrit une entrée (écriture atomique ; un dossier en lecture seule désactive simplement le cache)."""
+    header = ASSET_CACHE_HEADER.pack(ASSET_CACHE_MAGIC, ASSET_CACHE_VERSION, TILE_SIZE, source_stat.st_mtime_ns,
+                                     source_stat.st_size, thumb.get_width(), full.get_width())
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"  # Plusieurs processus peuvent remplir le cache (export en lot)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.write(pygame.image.tobytes(thumb, "RGBA"))
+            f.write(pygame.image.tobytes(full, "RGBA"))
+        os.replace(tmp_path, cache_path)
+        return True
+    except OSError:
+        return False
+
+
+def convert_asset_surface(surf):
+    """Surface prête à blitter : sans canal alpha si l'image est entièrement opaque (blit sans mélange),
+    en 24 bits si OPAQUE_ASSETS_24BIT ; les autres au format alpha du display."""
+    w, h = surf.get_size()
+    if pygame.mask.from_surface(surf, 254).count() == w * h:
+        if not OPAQUE_ASSETS_24BIT: return surf.convert()
+        opaque = pygame.Surface((w, h), 0, 24)
+        opaque.blit(surf, (0, 0))
+        return opaque
+    return surf.convert_alpha()
+
+
+# --- ATLAS DE TEXTURES ---
+# Seules les miniatures y vont : elles restent chargées toute la session, alors que les pleines tailles,
+# libérées par le LRU, gardent chacune leur surface. Un emplacement n'est donc jamais rendu.
+# Une page est un dict {"surface", "shelves": [[y, hauteur, x libre], ...], "bottom", "assets", "used_px"} :
+# les miniatures y sont rangées par étagères de même hauteur. Une page est opaque ou avec alpha, comme
+# les assets qu'elle contient.
+# Chaque miniature est une sous-surface de sa page (poignée page + rect) : la palette la blitte ou la
+# pivote comme une surface ordinaire, sans copie de ses pixels.
+
+def atlas_page_alloc(page, w, h):
+    """Rect libre de `w` x `h` dans la page, ou None si elle est pleine."""
+    for shelf in page["shelves"]:
+        shelf_y, shelf_h, free_x = shelf
+        if shelf_h == h and free_x + w <= ATLAS_PAGE_SIZE:
+            shelf[2] += w
+            return pygame.Rect(free_x, shelf_y, w, h)
+    if page["bottom"] + h > ATLAS_PAGE_SIZE: return None
+    page["shelves"].append([page["bottom"], h, w])
+    page["bottom"] += h
+    return pygame.Rect(0, page["bottom"] - h, w, h)
+
+
+def atlas_pack(kind, surface):
+    """Copie `surface` (format du display) dans une page d'atlas `kind` et renvoie sa sous-surface
+    (ou `surface` elle-même si l'atlas est désactivé)."""
+    w, h = surface.get_size()
+    if not ATLAS_ENABLED or w > ATLAS_PAGE_SIZE or h > ATLAS_PAGE_SIZE: return surface
+
+    pages = asset_atlases[kind]
+    alpha = surface.get_flags() & pygame.SRCALPHA
+    for page in pages:
+        if page["surface"].get_flags() & pygame.SRCALPHA != alpha: continue
+        rect = atlas_page_alloc(page, w, h)
+        if rect: break
+    else:
+        # Nouvelle page au format de l'asset, entièrement à zéro
+        page_surface = pygame.Surface((ATLAS_PAGE_SIZE, ATLAS_PAGE_SIZE), alpha, surface)
+        page_surface.fill((0, 0, 0, 0))
+        page = {"surface": page_surface, "shelves": [], "bottom": 0, "assets": 0, "used_px": 0}
+        pages.append(page)
+        rect = atlas_page_alloc(page, w, h)
+
+    # La page est à zéro : MAX recopie les pixels (alpha compris) au lieu de les mélanger
+    page["surface"].blit(surface, rect, special_flags=pygame.BLEND_RGBA_MAX)
+    page["assets"] += 1
+    page["used_px"] += w * h
+    return page["surface"].subsurface(rect)
+
+
+def get_atlas_stats():
+    """Pages, assets et octets (alloués / réellement utilisés) de chaque type d'atlas."""
+    stats = {}
+    for kind, pages in asset_atlases.items():
+        stats[kind] = {"pages": len(pages), "assets": sum(page["assets"] for page in pages),
+                       "bytes": sum(page["surface"].get_bytesize() * ATLAS_PAGE_SIZE ** 2 for page in pages),
+                       "used_bytes": sum(page["surface"].get_bytesize() * page["used_px"] for page in pages)}
+    return stats
+
+
+def decode_thumbnail(full_path, cache_path, size_multiplier):
+    """Miniature d'un asset (exécuté dans le pool : pas de convert ici).
+
+    Renvoie (miniature, chemin de cache valide ou None, succès du cache). Sur un succès, aucune
+    image n'est décodée ; sinon l'image est décodée une fois et les deux tailles sont mises en cache.
+    """
+    source_stat = os.stat(full_path)
+    if read_asset_cache_header(cache_path, source_stat):
+        try:
+            return read_asset_cache_surface(cache_path, False), cache_path, True
+        except (OSError, ValueError):
+            pass
+
+    img = pygame.image.load(full_path)
+    try:
+        thumb = pygame.transform.smoothscale(img, (TILE_SIZE, TILE_SIZE))
+    except ValueError:
+        # smoothscale refuse les images à palette
+        thumb = pygame.transform.scale(img, (TILE_SIZE, TILE_SIZE))
+    real_dim = size_multiplier * TILE_SIZE
+    full = pygame.transform.scale(img, (real_dim, real_dim))
+    if not write_asset_cache(cache_path, source_stat, thumb, full): cache_path = None
+    return thumb, cache_path, False
+
+
+def load_all_assets_from_folder(root_folder, first_category=None, progress_callback=None):
+    """Charge les miniatures de tous les assets ; la pleine taille est décodée au premier usage.
+
+    Les miniatures de `first_category` (par défaut la catégorie affichée au démarrage) sont décodées
+    en premier par le pool ; `progress_callback(fait, total)` est appelé au fil des résultats.
+    Les pixels déjà mis à l'échelle sont relus depuis le cache disque quand la source n'a pas changé.
+    """
     loaded_assets_full = {}
     loaded_assets_thumb = {}
     loaded_sizes = {}
     loaded_libraries = {}
+    start_time = time.perf_counter()
 
     # --- MODIFICATION POUR PYINSTALLER ---
     # On vérifie si on est dans un EXE "gelé"
@@ -130,6 +464,8 @@ def load_all_assets_from_folder(root_folder):
         print(f"ATTENTION : Dossier d'assets introuvable : {full_root_path}")
         return {}, {}, {}, {}
 
+    # 1. Inventaire des fichiers (rapide, sans décodage)
+    entries = []
     for current_root, dirs, files in os.walk(full_root_path):
         folder_name = os.path.relpath(current_root, full_root_path)
         category = "Base Tiles" if folder_name == "." else folder_name
@@ -141,63 +477,514 @@ def load_all_assets_from_folder(root_folder):
             if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
                 full_path = os.path.join(current_root, filename)
                 key = os.path.splitext(filename)[0]
-                try:
-                    size_multiplier = parse_size_from_filename(filename)
-                    img_original = pygame.image.load(full_path).convert_alpha()
+                entries.append((category, key, filename, full_path))
+
+    # Clé de cache relative au dossier d'assets : le chemin _MEIPASS change à chaque lancement
+    cache_dir = get_asset_cache_dir()
+    cache_paths = {entry[3]: get_asset_cache_path(cache_dir, os.path.relpath(entry[3], full_root_path))
+                   for entry in entries}
+
+    if first_category is None:
+        categories = sorted({entry[0] for entry in entries})
+        first_category = categories[0] if categories else None
+    # Le pool traite les tâches dans l'ordre de soumission : la catégorie visible d'abord
+    ordered = sorted(entries, key=lambda entry: entry[0] != first_category)
+
+    # 2. Décodage + miniatures en parallèle
+    thumbs = {}
+    cached = {}
+    cache_hits = 0
+    total = len(ordered)
+    first_ready_ms = None
+    with ThreadPoolExecutor(max_workers=ASSET_LOADER_WORKERS) as pool:
+        futures = {pool.submit(decode_thumbnail, entry[3], cache_paths[entry[3]],
+                               parse_size_from_filename(entry[2])): entry for entry in ordered}
+        pending_first = sum(1 for entry in ordered if entry[0] == first_category)
+        for done, future in enumerate(as_completed(futures), 1):
+            category, key, filename, full_path = futures[future]
+            try:
+                thumb, cached[key], hit = future.result()
+                # convert dépend du display : uniquement dans le thread principal
+                thumbs[key] = convert_asset_surface(thumb)
+                cache_hits += hit
+            except Exception as e:
+                print(f"Erreur chargement {filename}: {e}")
+            if category == first_category:
+                pending_first -= 1
+                if pending_first == 0: first_ready_ms = (time.perf_counter() - start_time) * 1000
+            if progress_callback: progress_callback(done, total)
+
+    # 3. Bibliothèques dans l'ordre des dossiers (les fichiers en erreur sont écartés)
+    for category, key, filename, full_path in entries:
+        if key not in thumbs: continue
+        size_multiplier = parse_size_from_filename(filename)
+        loaded_assets_full[key] = None
+        loaded_assets_thumb[key] = atlas_pack("thumb", thumbs[key])
+        loaded_sizes[key] = size_multiplier
+        asset_sources[key] = (full_path, size_multiplier, cached[key])
+        loaded_libraries[category].append(key)
 
-                    real_dim = size_multiplier * TILE_SIZE
-                    img_full = pygame.transform.scale(img_original, (real_dim, real_dim))
-                    img_thumb = pygame.transform.smoothscale(img_original, (TILE_SIZE, TILE_SIZE))
+    loaded_libraries = {k: v for k, v in loaded_libraries.items() if v}
 
-                    loaded_assets_full[key] = img_full
-                    loaded_assets_thumb[key] = img_thumb
-                    loaded_sizes[key] = size_multiplier
+    total_ms = (time.perf_counter() - start_time) * 1000
+    asset_load_stats.update({"files": total, "workers": ASSET_LOADER_WORKERS, "total_ms": total_ms,
+                             "first_category": first_category, "first_category_ms": first_ready_ms,
+                             "cache_hits": cache_hits})
+    print(f"Assets : {len(thumbs)}/{total} miniatures en {total_ms:.0f} ms ({ASSET_LOADER_WORKERS} threads), "
+          f"'{first_category}' prête en {first_ready_ms or 0:.0f} ms, {cache_hits} depuis le cache")
+    return loaded_assets_full, loaded_assets_thumb, loaded_sizes, loaded_libraries
 
-                    loaded_libraries[category].append(key)
-                except Exception as e:
-                    print(f"Erreur chargement {filename}: {e}")
 
-    loaded_libraries = {k: v for k, v in loaded_libraries.items() if v}
-    return loaded_assets_full, loaded_assets_thumb, loaded_sizes, loaded_libraries
+def get_full_asset(assets_full, key):
+    """Surface pleine taille de l'asset `key`, lue du cache disque (ou décodée) au premier usage.
+
+    Les pleines tailles chargées forment un LRU plafonné à FULL_ASSET_CACHE_MAX_BYTES : chaque appel
+    (un dessin) rafraîchit l'asset, et les moins récemment dessinés sont libérés puis relus au besoin.
+    """
+    surf = assets_full.get(key)
+    if surf is not None:
+        with full_asset_lock:
+            if key in full_asset_lru:
+                full_asset_lru.move_to_end(key)
+                full_asset_stats["hits"] += 1
+        return surf
+
+    source = asset_sources.get(key)
+    if source is None: return None
+    full_path, size_multiplier, cache_path = source
+    try:
+        surf = None
+        if cache_path:
+            try:
+                surf = convert_asset_surface(read_asset_cache_surface(cache_path, True))
+            except (OSError, ValueError):
+                asset_sources[key] = (full_path, size_multiplier, None)
+        if surf is None:
+            img_original = convert_asset_surface(pygame.image.load(full_path))
+            real_dim = size_multiplier * TILE_SIZE
+            surf = pygame.transform.scale(img_original, (real_dim, real_dim))
+    except Exception as e:
+        print(f"Erreur chargement {full_path}: {e}")
+        del asset_sources[key]
+        return None
+    assets_full[key] = surf
+
+    with full_asset_lock:
+        full_asset_stats["misses"] += 1
+        if key in full_asset_evicted: full_asset_stats["reloads"] += 1
+        if not surf.get_flags() & pygame.SRCALPHA:
+            full_asset_stats["opaque"] += 1
+            full_asset_stats["opaque_saved"] += surf.get_width() * surf.get_height() * (4 - surf.get_bytesize())
+        full_asset_lru[key] = surf.get_width() * surf.get_height() * surf.get_bytesize()
+        full_asset_stats["bytes"] += full_asset_lru[key]
+        evict_full_assets(assets_full)
+    return surf
+
+
+def evict_full_assets(assets_full):
+    """Libère les pleines tailles les moins récemment dessinées, pyramides comprises, tant que le budget
+    est dépassé (jamais la plus récente). A appeler sous full_asset_lock."""
+    while full_asset_stats["bytes"] > FULL_ASSET_CACHE_MAX_BYTES and len(full_asset_lru) > 1:
+        old_key, old_bytes = full_asset_lru.popitem(last=False)
+        old = assets_full.get(old_key)
+        assets_full[old_key] = None
+        if old is not None and not old.get_flags() & pygame.SRCALPHA:
+            full_asset_stats["opaque"] -= 1
+            full_asset_stats["opaque_saved"] -= old.get_width() * old.get_height() * (4 - old.get_bytesize())
+        asset_mips.pop(old_key, None)
+        full_asset_evicted.add(old_key)
+        full_asset_stats["bytes"] -= old_bytes
+        full_asset_stats["evictions"] += 1
+
+
+def get_full_asset_stats():
+    """Occupation du cache des pleines tailles (entrées, octets, budget, hits, misses, évictions, ...)."""
+    with full_asset_lock:
+        stats = dict(full_asset_stats)
+        stats["entries"] = len(full_asset_lru)
+    stats["budget"] = FULL_ASSET_CACHE_MAX_BYTES
+    stats["atlas"] = get_atlas_stats()
+    return stats
+
+
+def draw_loading_screen(surface, font, done, total):
+    """Barre de progression du chargement des assets (avant l'ouverture de l'éditeur)."""
+    surface.fill(COLOR_BG)
+    w, h = surface.get_size()
+    bar = pygame.Rect(w // 4, h // 2 - 10, w // 2, 20)
+    pygame.draw.rect(surface, COLOR_PANEL_DARK, bar, border_radius=5)
+    fill = bar.copy()
+    fill.width = int(bar.width * done / total) if total else bar.width
+    pygame.draw.rect(surface, COLOR_BORDER_GOLD, fill, border_radius=5)
+    pygame.draw.rect(surface, COLOR_UI_BORDER, bar, 1, border_radius=5)
+    draw_text_centered(surface, f"Chargement des assets... {done}/{total}", font, COLOR_TEXT, bar.move(0, -30))
+    pygame.display.flip()
+    pygame.event.pump()
+
+
+# --- CACHE DE ROTATION ---
+def get_rotated_surface(key, source, angle, scale=1.0):
+    """Renvoie `source` (variante de l'asset `key` à l'échelle `scale`) pivotée de `angle`.
+
+    Le résultat est partagé entre la vue, la palette et l'export : il ne doit pas être modifié.
+    """
+    angle = angle % 360
+    if angle == 0:
+        return source
+
+    cache_key = (key, angle, scale)
+    surf = rotation_cache_lookup(cache_key)
+    if surf is None:
+        surf = rotation_cache_store(cache_key, pygame.transform.rotate(source, angle))
+    return surf
+
+
+def get_mip_surface(assets_full, key, source, level):
+    """Niveau `level` de la pyramide de l'asset `key` (0 = `source`), construite à la demande.
+
+    Les niveaux ajoutés sont comptés dans l'entrée LRU de l'asset, ce qui peut libérer d'autres assets.
+    """
+    chain = asset_mips.get(key)
+    if chain is None or chain[0] is not source:
+        chain = [source]
+        asset_mips[key] = chain
+    if len(chain) > level: return chain[level]
+
+    added = 0
+    while len(chain) <= level:
+        prev = chain[-1]
+        # Réduction par 2 depuis le niveau précédent : filtrage propre, sans crénelage
+        size = (max(1, prev.get_width() // 2), max(1, prev.get_height() // 2))
+        try:
+            chain.append(pygame.transform.smoothscale(prev, size))
+        except ValueError:
+            chain.append(pygame.transform.scale(prev, size))
+        added += size[0] * size[1] * chain[-1].get_bytesize()
+
+    with full_asset_lock:
+        if key in full_asset_lru:
+            full_asset_lru[key] += added
+            full_asset_stats["bytes"] += added
+            full_asset_lru.move_to_end(key)
+            evict_full_assets(assets_full)
+        elif key in full_asset_evicted and asset_mips.get(key) is chain:
+            del asset_mips[key]  # Asset libéré pendant la construction : la pyramide part avec lui
+    return chain[level]
+
+
+def clear_asset_mips():
+    """Libère toutes les pyramides (et retire leurs octets du budget des pleines tailles)."""
+    with full_asset_lock:
+        for key, chain in asset_mips.items():
+            if key in full_asset_lru:
+                mip_bytes = sum(s.get_width() * s.get_height() * s.get_bytesize() for s in chain[1:])
+                full_asset_lru[key] -= mip_bytes
+                full_asset_stats["bytes"] -= mip_bytes
+        asset_mips.clear()
+
+
+def get_scaled_surface(assets_full, key, source, scale):
+    """Renvoie l'asset `key` (surface `source` à l'échelle 1) mis à l'échelle `scale` (zoom de la vue).
+
+    Part du niveau de pyramide le plus proche (au moins aussi grand que demandé) ; les échelles
+    intermédiaires partagent le cache des rotations sous la clé (key, 0, scale) : get_rotated_surface
+    n'y stocke jamais d'angle nul, et ses variantes pivotées à l'échelle `scale` partent de cette surface.
+    """
+    if scale == 1:
+        return source
+
+    level = 0
+    while level + 1 < MIP_LEVELS and scale <= 0.5 ** (level + 1):
+        level += 1
+    base = get_mip_surface(assets_full, key, source, level)
+    if scale == 0.5 ** level:
+        return base
+
+    cache_key = (key, 0, scale)
+    surf = rotation_cache_lookup(cache_key)
+    if surf is None:
+        size = (max(1, round(source.get_width() * scale)), max(1, round(source.get_height() * scale)))
+        try:
+            scaled = pygame.transform.smoothscale(base, size)
+        except ValueError:
+            scaled = pygame.transform.scale(base, size)
+        surf = rotation_cache_store(cache_key, scaled)
+    return surf
+
+
+def rotation_cache_lookup(cache_key):
+    with rotation_cache_lock:
+        surf = rotation_cache.get(cache_key)
+        if surf is not None:
+            rotation_cache.move_to_end(cache_key)
+            rotation_cache_stats["hits"] += 1
+        else:
+            rotation_cache_stats["misses"] += 1
+        return surf
+
+
+def rotation_cache_store(cache_key, surf):
+    """Range `surf` dans le cache (ou renvoie l'entrée qu'un autre thread y a mise entre-temps)."""
+    with rotation_cache_lock:
+        if cache_key in rotation_cache: return rotation_cache[cache_key]
+        rotation_cache[cache_key] = surf
+        rotation_cache_stats["bytes"] += surf.get_width() * surf.get_height() * surf.get_bytesize()
+
+        # Eviction LRU tant qu'on dépasse le plafond mémoire
+        while rotation_cache_stats["bytes"] > ROTATION_CACHE_MAX_BYTES and len(rotation_cache) > 1:
+            _, old = rotation_cache.popitem(last=False)
+            rotation_cache_stats["bytes"] -= old.get_width() * old.get_height() * old.get_bytesize()
+            rotation_cache_stats["evictions"] += 1
+    return surf
+
+
+def get_rotation_cache_stats():
+    """Compteurs du cache de rotation (hits, misses, evictions, octets, entrées)."""
+    stats = dict(rotation_cache_stats)
+    stats["entries"] = len(rotation_cache)
+    total = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / total if total else 0.0
+    return stats
+
+
+# --- GRILLE CREUSE ---
+# Une grille est un dict {"chunks": {(cx, cy): bloc}, "pending": {...}, "coverage": {...}, "history": {...}}.
+# Un bloc est une liste de CHUNK_SIZE * CHUNK_SIZE piles (None si vide). Seuls les blocs contenant
+# des tuiles existent : la carte n'a pas de bornes.
+# "pending" contient les blocs lus d'un .mdmap mais pas encore construits : {(cx, cy): (octets, clés d'asset)},
+# éléments au format PROJECT_ITEM. Un bloc n'est construit qu'à sa première lecture (grid_chunk).
+# "coverage" est l'index spatial des empreintes, construit lui aussi bloc par bloc à la première sélection :
+# {(cx, cy): {(x, y): [...]}} donne pour chaque case les éléments (de n'importe quelle cellule d'ancrage)
+# dont l'image la recouvre, sous forme (couche, ax, ay, item), du plus haut au plus bas.
+# "history" contient l'historique Undo/Redo propre à l'étage (voir HISTORIQUE).
+
+def create_grid():
+    return {"chunks": {}, "pending": {}, "coverage": {}, "history": {"undo": [], "redo": [], "bytes": 0}}
+
+
+def grid_chunk(grid, chunk_key):
+    """Bloc `chunk_key` (None s'il n'existe pas), construit depuis "pending" à sa première lecture."""
+    chunk = grid["chunks"].get(chunk_key)
+    if chunk is None:
+        pending = grid["pending"].pop(chunk_key, None)
+        if pending is None: return None
+        packed, asset_keys = pending
+        chunk = [None] * (CHUNK_SIZE * CHUNK_SIZE)
+        for x, y, asset_id, angle, layer in PROJECT_ITEM.iter_unpack(packed):
+            idx = (y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE
+            if chunk[idx] is None: chunk[idx] = []
+            chunk[idx].append({'key': asset_keys[asset_id], 'angle': angle, 'layer': layer})
+        grid["chunks"][chunk_key] = chunk
+    return chunk
+
+
+def grid_get_stack(grid, x, y):
+    """Pile de la cellule (x, y) en lecture seule (tuple vide si la cellule est vide)."""
+    chunk = grid_chunk(grid, (x // CHUNK_SIZE, y // CHUNK_SIZE))
+    if chunk is None: return ()
+    return chunk[(y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE] or ()
+
+
+def grid_add_item(grid, x, y, item, asset_sizes, stack_idx=None):
+    """Empile `item` en (x, y) (au sommet, ou à `stack_idx`) et l'enregistre dans l'index des empreintes."""
+    chunk_key = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+    chunk = grid_chunk(grid, chunk_key)
+    if chunk is None:
+        chunk = [None] * (CHUNK_SIZE * CHUNK_SIZE)
+        grid["chunks"][chunk_key] = chunk
+    idx = (y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE
+    if chunk[idx] is None: chunk[idx] = []
+    stack = chunk[idx]
+    if stack_idx is None: stack_idx = len(stack)
+    stack.insert(stack_idx, item)
+
+    # Ordre de dessin : couche, puis ligne, colonne et position dans la pile d'ancrage.
+    # Les blocs dont l'index n'est pas encore construit le seront depuis la grille à jour.
+    z = (item.get('layer', 0), y, x)
+    x0, y0, x1, y1 = get_item_footprint(x, y, asset_sizes.get(item['key'], 1))
+    coverage = grid["coverage"]
+    for cy in range(y0, y1 + 1):
+        for cx in range(x0, x1 + 1):
+            chunk_coverage = coverage.get((cx // CHUNK_SIZE, cy // CHUNK_SIZE))
+            if chunk_coverage is None: continue
+            entries = chunk_coverage.setdefault((cx, cy), [])
+            pos = 0
+            while pos < len(entries):
+                layer, ex, ey, other = entries[pos]
+                entry_z = (layer, ey, ex)
+                if entry_z < z: break
+                if entry_z == z and not any(s is other for s in stack[stack_idx + 1:]): break
+                pos += 1
+            entries.insert(pos, (z[0], x, y, item))
+
+
+def grid_from_records(records):
+    """Construit une grille d'un bloc à partir de (x, y, clé, angle, couche), dans l'ordre des piles.
+
+    L'index des empreintes n'est pas construit ici : il le sera bloc par bloc à la première sélection.
+    """
+    grid = create_grid()
+    chunks = grid["chunks"]
+    for x, y, key, angle, layer in records:
+        chunk_key = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+        chunk = chunks.get(chunk_key)
+        if chunk is None:
+            chunk = [None] * (CHUNK_SIZE * CHUNK_SIZE)
+            chunks[chunk_key] = chunk
+        idx = (y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE
+        if chunk[idx] is None: chunk[idx] = []
+        chunk[idx].append({'key': key, 'angle': angle, 'layer': layer})
+    return grid
+
+
+def grid_coverage_chunk(grid, chunk_key, asset_sizes):
+    """Index des empreintes du bloc `chunk_key` ({(x, y): [...]}), construit à la première demande.
+
+    Seuls les éléments ancrés à moins d'une demi-taille d'asset du bloc peuvent le recouvrir : ils sont triés
+    une seule fois (couche, ligne, colonne, tri stable pour la position dans la pile).
+    """
+    chunk_coverage = grid["coverage"].get(chunk_key)
+    if chunk_coverage is not None: return chunk_coverage
+
+    bx0, by0 = chunk_key[0] * CHUNK_SIZE, chunk_key[1] * CHUNK_SIZE
+    bx1, by1 = bx0 + CHUNK_SIZE - 1, by0 + CHUNK_SIZE - 1
+    reach = max(asset_sizes.values(), default=1) // 2
+    placed = []
+    for x, y, stack in grid_iter_cells(grid, (bx0 - reach, by0 - reach, bx1 + reach, by1 + reach)):
+        for item in stack:
+            placed.append((item.get('layer', 0), y, x, item))
+    placed.sort(key=lambda entry: entry[:3])
+
+    chunk_coverage = defaultdict(list)
+    for layer, y, x, item in placed:
+        x0, y0, x1, y1 = get_item_footprint(x, y, asset_sizes.get(item['key'], 1))
+        if x1 < bx0 or x0 > bx1 or y1 < by0 or y0 > by1: continue
+        entry = (layer, x, y, item)
+        for cy in range(max(y0, by0), min(y1, by1) + 1):
+            for cx in range(max(x0, bx0), min(x1, bx1) + 1):
+                chunk_coverage[(cx, cy)].append(entry)
+    for entries in chunk_coverage.values():
+        entries.reverse()  # Du plus haut au plus bas
+    chunk_coverage = grid["coverage"][chunk_key] = dict(chunk_coverage)
+    return chunk_coverage
+
+
+def grid_remove_item(grid, x, y, stack_idx, asset_sizes):
+    """Retire et renvoie l'élément `stack_idx` de la pile (x, y) ; libère le bloc s'il devient vide."""
+    chunk_key = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+    chunk = grid_chunk(grid, chunk_key)
+    idx = (y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE
+    item = chunk[idx].pop(stack_idx)
+    if not chunk[idx]:
+        chunk[idx] = None
+        if not any(chunk): del grid["chunks"][chunk_key]
+
+    x0, y0, x1, y1 = get_item_footprint(x, y, asset_sizes.get(item['key'], 1))
+    coverage = grid["coverage"]
+    for cy in range(y0, y1 + 1):
+        for cx in range(x0, x1 + 1):
+            chunk_coverage = coverage.get((cx // CHUNK_SIZE, cy // CHUNK_SIZE))
+            if chunk_coverage is None: continue
+            entries = chunk_coverage[(cx, cy)]
+            for pos, entry in enumerate(entries):
+                if entry[3] is item:
+                    del entries[pos]
+                    break
+            if not entries: del chunk_coverage[(cx, cy)]
+    return item
+
+
+def grid_chunk_keys(grid, cell_rect=None):
+    """Clés des blocs alloués qui recoupent `cell_rect` (x0, y0, x1, y1 inclus), ou de tous les blocs.
+
+    Les blocs en attente en font partie : ils sont construits quand on les lit.
+    """
+    chunks, pending = grid["chunks"], grid["pending"]
+    keys = chunks.keys() | pending.keys() if pending else chunks.keys()
+    if not cell_rect: return keys
+    ccx0, ccy0 = cell_rect[0] // CHUNK_SIZE, cell_rect[1] // CHUNK_SIZE
+    ccx1, ccy1 = cell_rect[2] // CHUNK_SIZE, cell_rect[3] // CHUNK_SIZE
+    # Petite zone sur une grande carte : on sonde les blocs de la zone au lieu de tous les parcourir
+    if (ccx1 - ccx0 + 1) * (ccy1 - ccy0 + 1) < len(keys):
+        return [(cx, cy) for cy in range(ccy0, ccy1 + 1) for cx in range(ccx0, ccx1 + 1)
+                if (cx, cy) in chunks or (cx, cy) in pending]
+    return [(cx, cy) for cx, cy in keys if ccx0 <= cx <= ccx1 and ccy0 <= cy <= ccy1]
+
+
+def grid_iter_cells(grid, cell_rect=None):
+    """Parcourt (x, y, pile) des cellules non vides, ligne par ligne, en ne visitant que les blocs alloués.
+
+    `cell_rect` (x0, y0, x1, y1 inclus) restreint le parcours à une zone.
+    """
+    chunk_rows = {}
+    for cx, cy in grid_chunk_keys(grid, cell_rect):
+        chunk_rows.setdefault(cy, []).append(cx)
+
+    for cy in sorted(chunk_rows):
+        ly0, ly1 = 0, CHUNK_SIZE - 1
+        if cell_rect:
+            ly0 = max(ly0, cell_rect[1] - cy * CHUNK_SIZE)
+            ly1 = min(ly1, cell_rect[3] - cy * CHUNK_SIZE)
+            if ly0 > ly1: continue
+        row_chunks = []
+        for cx in sorted(chunk_rows[cy]):
+            lx0, lx1 = 0, CHUNK_SIZE - 1
+            if cell_rect:
+                lx0 = max(lx0, cell_rect[0] - cx * CHUNK_SIZE)
+                lx1 = min(lx1, cell_rect[2] - cx * CHUNK_SIZE)
+                if lx0 > lx1: continue
+            row_chunks.append((cx * CHUNK_SIZE, grid_chunk(grid, (cx, cy)), lx0, lx1))
+
+        for ly in range(ly0, ly1 + 1):
+            y = cy * CHUNK_SIZE + ly
+            base = ly * CHUNK_SIZE
+            for chunk_x, chunk, lx0, lx1 in row_chunks:
+                # Les cases vides (None) sont sautées sans boucle Python : les cartes creuses en sont pleines
+                for lx in compress(range(lx0, lx1 + 1), chunk[base + lx0:base + lx1 + 1]):
+                    yield chunk_x + lx, y, chunk[base + lx]
+
+
+def grid_iter_sparse(grid, cell_rect=None):
+    """Comme grid_iter_cells, mais bloc par bloc (sans ordre de lignes) : chaque bloc est balayé d'un seul
+    compress, sans boucle Python par ligne. Plus rapide sur les cartes creuses, où les blocs sont presque vides."""
+    slots = range(CHUNK_SIZE * CHUNK_SIZE)
+    for cx, cy in list(grid_chunk_keys(grid, cell_rect)):
+        chunk = grid_chunk(grid, (cx, cy))
+        for idx in compress(slots, chunk):
+            x, y = cx * CHUNK_SIZE + idx % CHUNK_SIZE, cy * CHUNK_SIZE + idx // CHUNK_SIZE
+            if cell_rect and not (cell_rect[0] <= x <= cell_rect[2] and cell_rect[1] <= y <= cell_rect[3]):
+                continue
+            yield x, y, chunk[idx]
 
 
 def get_map_bounds(grid):
+    """Cellules (x0, y0, x1, y1 inclus) occupées, ou None. Seuls les blocs du bord sont parcourus."""
     if not grid: return None
-    rows = len(grid)
-    if rows == 0: return None
-    cols = len(grid[0])
-    min_x, min_y = cols, rows
-    max_x, max_y = -1, -1
-    found_any = False
-    for y in range(rows):
-        for x in range(cols):
-            if y < len(grid) and x < len(grid[0]) and len(grid[y][x]) > 0:
-                if x < min_x: min_x = x
-                if x > max_x: max_x = x
-                if y < min_y: min_y = y
-                if y > max_y: max_y = y
-                found_any = True
-    if not found_any: return None
+    keys = grid_chunk_keys(grid)
+    if not keys: return None
+    ccx0, ccx1 = min(key[0] for key in keys), max(key[0] for key in keys)
+    ccy0, ccy1 = min(key[1] for key in keys), max(key[1] for key in keys)
+    slots = range(CHUNK_SIZE * CHUNK_SIZE)
+    # Un bloc n'existe que s'il contient au moins une pile : chaque bord a une cellule occupée
+    edges = {(cx, cy): list(compress(slots, grid_chunk(grid, (cx, cy)))) for cx, cy in list(keys)
+             if cx in (ccx0, ccx1) or cy in (ccy0, ccy1)}
+    min_x = min(cx * CHUNK_SIZE + min(idx % CHUNK_SIZE for idx in occupied)
+                for (cx, cy), occupied in edges.items() if cx == ccx0)
+    max_x = max(cx * CHUNK_SIZE + max(idx % CHUNK_SIZE for idx in occupied)
+                for (cx, cy), occupied in edges.items() if cx == ccx1)
+    min_y = min(cy * CHUNK_SIZE + occupied[0] // CHUNK_SIZE for (cx, cy), occupied in edges.items() if cy == ccy0)
+    max_y = max(cy * CHUNK_SIZE + occupied[-1] // CHUNK_SIZE for (cx, cy), occupied in edges.items() if cy == ccy1)
     return min_x, min_y, max_x, max_y
 
 
-def resize_grid(old_grid, new_w_pixels, new_h_pixels):
-    if new_w_pixels < TILE_SIZE: new_w_pixels = TILE_SIZE
-    if new_h_pixels < TILE_SIZE: new_h_pixels = TILE_SIZE
-    new_cols = new_w_pixels // TILE_SIZE
-    new_rows = new_h_pixels // TILE_SIZE
-    new_grid = [[[] for _ in range(new_cols)] for _ in range(new_rows)]
-    if not old_grid: return new_grid
-    old_rows = len(old_grid)
-    if old_rows == 0: return new_grid
-    old_cols = len(old_grid[0])
-    for y in range(min(old_rows, new_rows)):
-        for x in range(min(old_cols, new_cols)):
-            if old_grid[y][x]:
-                new_grid[y][x] = list(old_grid[y][x])
-            else:
-                new_grid[y][x] = []
-    return new_grid
+def get_walls_bounds(walls):
+    """Cellules (x0, y0, x1, y1 inclus) couvertes par des murs, ou None s'il n'y en a pas."""
+    if not walls: return None
+    xs = [w['x1'] for w in walls] + [w['x2'] for w in walls]
+    ys = [w['y1'] for w in walls] + [w['y2'] for w in walls]
+    x0, y0 = min(xs) // TILE_SIZE, min(ys) // TILE_SIZE
+    # Un mur posé sur le bord droit / bas d'une case n'en ouvre pas une nouvelle
+    return x0, y0, max(x0, (max(xs) - 1) // TILE_SIZE), max(y0, (max(ys) - 1) // TILE_SIZE)
 
 
 def get_draw_offset(size):
@@ -207,34 +994,427 @@ def get_draw_offset(size):
         return TILE_SIZE // 2
 
 
+def get_item_footprint(x, y, size):
+    """Cellules (x0, y0, x1, y1 inclus) recouvertes par un asset de `size` cases ancré en (x, y)."""
+    x0 = x - (size - 1) // 2
+    y0 = y - (size - 1) // 2
+    return x0, y0, x0 + size - 1, y0 + size - 1
+
+
+def get_wall_cells(wall):
+    """Cellules (x0, y0, x1, y1 inclus) touchées par le dessin d'un mur (trait + extrémités)."""
+    margin = 5
+    x0 = (min(wall['x1'], wall['x2']) - margin) // TILE_SIZE
+    y0 = (min(wall['y1'], wall['y2']) - margin) // TILE_SIZE
+    x1 = (max(wall['x1'], wall['x2']) + margin) // TILE_SIZE
+    y1 = (max(wall['y1'], wall['y2']) + margin) // TILE_SIZE
+    return x0, y0, x1, y1
+
+
+# --- CAMERA ---
+# La caméra est un dict {"x", "y", "zoom"} : (x, y) est la position, en pixels écran au zoom courant,
+# du coin haut-gauche de la vue dans la carte. Les coordonnées "carte" (murs, pixels cliqués) restent
+# en unités TILE_SIZE, quel que soit le zoom. `view_origin` est la position de la vue dans la fenêtre.
+
+def create_camera():
+    return {"x": 0, "y": 0, "zoom": 1.0}
+
+
+def camera_tile_px(camera):
+    """Taille écran d'une cellule au zoom courant."""
+    return int(TILE_SIZE * camera["zoom"])
+
+
+def camera_screen_to_world(camera, sx, sy, view_origin):
+    """Pixel de la fenêtre -> pixel carte (flottants)."""
+    zoom = camera["zoom"]
+    return (sx - view_origin[0] + camera["x"]) / zoom, (sy - view_origin[1] + camera["y"]) / zoom
+
+
+def camera_world_to_screen(camera, wx, wy, view_origin):
+    """Pixel carte -> pixel de la fenêtre."""
+    zoom = camera["zoom"]
+    return (round(wx * zoom) - camera["x"] + view_origin[0], round(wy * zoom) - camera["y"] + view_origin[1])
+
+
+def camera_screen_to_cell(camera, sx, sy, view_origin):
+    wx, wy = camera_screen_to_world(camera, sx, sy, view_origin)
+    return math.floor(wx / TILE_SIZE), math.floor(wy / TILE_SIZE)
+
+
+def camera_cells_in_rect(camera, rect):
+    """Cellules (x0, y0, x1, y1 inclus) visibles dans `rect` (pygame.Rect en pixels de la vue)."""
+    tile_px = camera_tile_px(camera)
+    return ((camera["x"] + rect.left) // tile_px, (camera["y"] + rect.top) // tile_px,
+            (camera["x"] + rect.right - 1) // tile_px, (camera["y"] + rect.bottom - 1) // tile_px)
+
+
+def camera_world_rect(camera, view_w, view_h):
+    """Zone de la carte visible (pygame.Rect en pixels carte)."""
+    zoom = camera["zoom"]
+    return pygame.Rect(math.floor(camera["x"] / zoom), math.floor(camera["y"] / zoom),
+                       math.ceil(view_w / zoom) + 1, math.ceil(view_h / zoom) + 1)
+
+
+def camera_center_on(camera, wx, wy, view_w, view_h):
+    """Centre la vue sur le pixel carte (wx, wy)."""
+    zoom = camera["zoom"]
+    camera["x"] = round(wx * zoom) - view_w // 2
+    camera["y"] = round(wy * zoom) - view_h // 2
+
+
+def camera_pan(camera, dx, dy):
+    """Déplace la carte de (dx, dy) pixels écran (glisser de la souris)."""
+    camera["x"] -= dx
+    camera["y"] -= dy
+
+
+def camera_zoom_at(camera, step, sx, sy, view_origin):
+    """Zoom d'un cran (`step` = +1 / -1) en gardant fixe le point de la carte sous (sx, sy).
+
+    Renvoie True si le zoom a changé.
+    """
+    idx = CAMERA_ZOOM_LEVELS.index(camera["zoom"])
+    new_idx = max(0, min(len(CAMERA_ZOOM_LEVELS) - 1, idx + step))
+    if new_idx == idx: return False
+    wx, wy = camera_screen_to_world(camera, sx, sy, view_origin)
+    zoom = CAMERA_ZOOM_LEVELS[new_idx]
+    camera["zoom"] = zoom
+    camera["x"] = round(wx * zoom) - (sx - view_origin[0])
+    camera["y"] = round(wy * zoom) - (sy - view_origin[1])
+    return True
+
+
+def draw_map_region(surface, grid, assets_full, asset_sizes, cell_rect, origin=(0, 0), show_grid=False,
+                    bg_color=COLOR_VIEW_BG, zoom=1.0):
+    """Redessine les cellules `cell_rect` (x0, y0, x1, y1 inclus) de la grille sur `surface`.
+
+    Les assets multi-cases ancrés dans les cellules voisines et qui débordent sur la zone sont
+    redessinés (clippés), dans l'ordre du rendu complet : couche, ligne, colonne, pile.
+    `origin` est la position de la cellule (0, 0) sur `surface`, `zoom` l'échelle de la vue.
+    Renvoie le Rect de `surface` effectivement redessiné (ou None si hors surface).
+    """
+    x0, y0, x1, y1 = cell_rect
+    ox, oy = origin
+    tile_px = int(TILE_SIZE * zoom)
+    area = pygame.Rect(ox + x0 * tile_px, oy + y0 * tile_px,
+                       (x1 - x0 + 1) * tile_px, (y1 - y0 + 1) * tile_px).clip(surface.get_rect())
+    if area.width == 0 or area.height == 0: return None
+
+    old_clip = surface.get_clip()
+    surface.set_clip(area)
+    surface.fill(bg_color, area)
+
+    # Grille sous les tuiles
+    if show_grid:
+        cx0, cy0 = (area.left - ox) // tile_px, (area.top - oy) // tile_px
+        cx1, cy1 = (area.right - 1 - ox) // tile_px, (area.bottom - 1 - oy) // tile_px
+        for y in range(cy0, cy1 + 1):
+            for x in range(cx0, cx1 + 1):
+                pygame.draw.rect(surface, COLOR_GRID, (ox + x * tile_px, oy + y * tile_px, tile_px, tile_px), 1)
+
+    # Portée max d'un asset : un 6x6 ancré 3 cases plus loin déborde encore sur la zone
+    reach = max(asset_sizes.values(), default=1)
+    anchors_rect = (x0 - reach, y0 - reach, x1 + reach, y1 + reach)
+
+    layer_items = {LAYER_GROUND: [], LAYER_OBJECTS: [], LAYER_TOKENS: []}
+    for x, y, stack in grid_iter_cells(grid, anchors_rect):
+        for item in stack:
+            layer_items.setdefault(item.get('layer', 0), []).append((x, y, item))
+
+    for layer_pass in [LAYER_GROUND, LAYER_OBJECTS, LAYER_TOKENS]:
+        for x, y, item in layer_items[layer_pass]:
+            key = item['key']
+            original = get_full_asset(assets_full, key)
+            if original:
+                px, py = ox + x * tile_px, oy + y * tile_px
+                size = asset_sizes.get(key, 1)
+                offset_draw = get_draw_offset(size) * tile_px // TILE_SIZE
+                scaled = get_scaled_surface(assets_full, key, original, zoom)
+                img = get_rotated_surface(key, scaled, item['angle'], zoom)
+                rect = img.get_rect(center=(px + offset_draw, py + offset_draw))
+                surface.blit(img, rect)
+                render_stats["map_blits"] += 1
+
+    surface.set_clip(old_clip)
+    return area
+
+
 def get_tile_at_pixel(grid, mx, my, assets_full, asset_sizes, offset_y_ui=0, offset_x_ui=0, target_layer=None):
-    grid_mouse_x = mx - offset_x_ui
-    grid_mouse_y = my - offset_y_ui
-    rows = len(grid)
-    cols = len(grid[0]) if rows > 0 else 0
-    for y in range(rows - 1, -1, -1):
-        for x in range(cols - 1, -1, -1):
-            cell_stack = grid[y][x]
-            if cell_stack:
-                for idx in range(len(cell_stack) - 1, -1, -1):
-                    item = cell_stack[idx]
-                    item_layer = item.get('layer', LAYER_GROUND)
-                    if target_layer is not None and item_layer != target_layer:
-                        continue
-                    key = item['key']
-                    original = assets_full.get(key)
-                    if original:
-                        px, py = x * TILE_SIZE, y * TILE_SIZE
-                        size = asset_sizes.get(key, 1)
-                        offset_draw = get_draw_offset(size)
-                        center_x = px + offset_draw
-                        center_y = py + offset_draw
-                        rect = original.get_rect(center=(center_x, center_y))
-                        if rect.collidepoint(grid_mouse_x, grid_mouse_y):
-                            return x, y, item, idx
+    """Elément visible le plus haut sous le pixel (mx, my) : (x, y, item, index dans la pile) ou None.
+
+    Passe par l'index des empreintes : le coût dépend de la profondeur de pile, pas de la taille de la carte.
+    """
+    cell = ((mx - offset_x_ui) // TILE_SIZE, (my - offset_y_ui) // TILE_SIZE)
+    chunk_coverage = grid_coverage_chunk(grid, (cell[0] // CHUNK_SIZE, cell[1] // CHUNK_SIZE), asset_sizes)
+    for layer, x, y, item in chunk_coverage.get(cell, ()):
+        if target_layer is not None and layer != target_layer:
+            continue
+        if item['key'] in asset_sizes:
+            stack = grid_get_stack(grid, x, y)
+            for idx in range(len(stack) - 1, -1, -1):
+                if stack[idx] is item:
+                    return x, y, item, idx
     return None
 
 
+# --- MINI-CARTE ---
+# Dict {"cells": (x0, y0, x1, y1), "tile_px", "step", "margin", "surface", "view", "screen_rect", "stale"} :
+# "surface" est la carte rendue au plus petit niveau de pyramide (tile_px pixels par case) sur la zone "cells".
+# Si la zone dépasse MINIMAP_MAX_PX cases de côté, un pixel regroupe "step" x "step" cases (zone alignée
+# sur ce pas). "view" est la réduction de "surface" à la taille du cadre, mise à jour zone par zone.
+# "margin" est la marge ajoutée autour de la carte, doublée à chaque agrandissement de la zone.
+
+def create_minimap():
+    return {"cells": None, "tile_px": 0, "step": 1, "margin": MINIMAP_MARGIN, "surface": None, "view": None,
+            "screen_rect": None, "stale": True}
+
+
+def get_minimap_color(assets_full, key):
+    """Couleur moyenne de l'asset `key` (calculée une fois), None s'il ne peut pas être chargé."""
+    color = minimap_colors.get(key)
+    if color is None:
+        original = get_full_asset(assets_full, key)
+        if original is None: return None
+        color = minimap_colors[key] = pygame.transform.average_color(original, original.get_rect(), True)[:3]
+    return color
+
+
+def draw_map_sampled(surface, grid, assets_full, asset_sizes, cell_rect, origin_cell, step):
+    """Rendu réduit de `cell_rect` : un pixel de `surface` couvre `step` x `step` cases et prend la couleur
+    moyenne du dernier élément dessiné sur elles (même ordre que draw_map_region, empreintes comprises).
+
+    `origin_cell` est la case du pixel (0, 0), multiple de `step`. Renvoie le Rect redessiné (ou None)."""
+    bx0, by0 = origin_cell[0] // step, origin_cell[1] // step
+    px0, py0 = cell_rect[0] // step, cell_rect[1] // step
+    px1, py1 = cell_rect[2] // step, cell_rect[3] // step
+    area = pygame.Rect(px0 - bx0, py0 - by0, px1 - px0 + 1, py1 - py0 + 1).clip(surface.get_rect())
+    if area.width == 0 or area.height == 0: return None
+
+    old_clip = surface.get_clip()
+    surface.set_clip(area)
+    surface.fill(COLOR_PANEL_DARK, area)
+
+    reach = max(asset_sizes.values(), default=1)
+    anchors_rect = (px0 * step - reach, py0 * step - reach, (px1 + 1) * step - 1 + reach, (py1 + 1) * step - 1 + reach)
+    # Carte creuse (c'est ce qui la rend si grande) : parcours bloc par bloc, puis tri stable dans l'ordre de dessin
+    placed = [(item.get('layer', 0), y, x, item) for x, y, stack in grid_iter_sparse(grid, anchors_rect)
+              for item in stack]
+    placed.sort(key=lambda entry: entry[:3])
+
+    for layer, y, x, item in placed:
+        if layer not in (LAYER_GROUND, LAYER_OBJECTS, LAYER_TOKENS): continue
+        color = get_minimap_color(assets_full, item['key'])
+        if color is None: continue
+        fx0, fy0, fx1, fy1 = get_item_footprint(x, y, asset_sizes.get(item['key'], 1))
+        surface.fill(color, (fx0 // step - bx0, fy0 // step - by0,
+                             fx1 // step - fx0 // step + 1, fy1 // step - fy0 // step + 1))
+        render_stats["map_blits"] += 1
+
+    surface.set_clip(old_clip)
+    return area
+
+
+def minimap_draw_cells(minimap, grid, assets_full, asset_sizes, cell_rect):
+    """Redessine `cell_rect` sur la surface de la mini-carte ; renvoie la zone modifiée (ou None)."""
+    x0, y0 = minimap["cells"][:2]
+    tile_px, step = minimap["tile_px"], minimap["step"]
+    if step > 1:
+        return draw_map_sampled(minimap["surface"], grid, assets_full, asset_sizes, cell_rect, (x0, y0), step)
+    return draw_map_region(minimap["surface"], grid, assets_full, asset_sizes, cell_rect,
+                           (-x0 * tile_px, -y0 * tile_px), bg_color=COLOR_PANEL_DARK, zoom=tile_px / TILE_SIZE)
+
+
+def minimap_layout(minimap, cells):
+    """Echelle et surface (vide) de la mini-carte pour la zone `cells`."""
+    x0, y0, x1, y1 = cells
+    span = max(x1 - x0 + 1, y1 - y0 + 1)
+    # Echelles en puissances de 2 : elles ne changent (rendu complet) que quand la zone double de côté.
+    # L'alignement sur le pas peut ajouter un pixel : MINIMAP_MAX_PX - 1 pour rester dans le plafond.
+    step = 1
+    while span > step * (MINIMAP_MAX_PX - 1): step *= 2
+    if step > 1:
+        x0, y0 = x0 - x0 % step, y0 - y0 % step
+        x1, y1 = x1 + (-x1 - 1) % step, y1 + (-y1 - 1) % step
+    tile_px = TILE_SIZE >> (MIP_LEVELS - 1)
+    while tile_px > 1 and tile_px * span > MINIMAP_MAX_PX: tile_px //= 2
+    minimap["cells"] = (x0, y0, x1, y1)
+    minimap["tile_px"] = tile_px
+    minimap["step"] = step
+    minimap["surface"] = pygame.Surface(((x1 - x0 + 1) * tile_px // step, (y1 - y0 + 1) * tile_px // step))
+    minimap["view"] = None
+
+
+def minimap_rebuild(minimap, grid, assets_full, asset_sizes, cells):
+    minimap_layout(minimap, cells)
+    minimap_draw_cells(minimap, grid, assets_full, asset_sizes, minimap["cells"])
+
+
+def minimap_grow(minimap, grid, assets_full, asset_sizes, cells):
+    """Agrandit la zone couverte jusqu'à `cells` (qui contient l'ancienne). A échelle égale, l'ancien rendu
+    est recopié et seules les bandes ajoutées sont dessinées."""
+    old_surface, (ox0, oy0, ox1, oy1) = minimap["surface"], minimap["cells"]
+    old_scale = (minimap["tile_px"], minimap["step"])
+    minimap_layout(minimap, cells)
+    x0, y0, x1, y1 = minimap["cells"]
+    tile_px, step = minimap["tile_px"], minimap["step"]
+    if (tile_px, step) != old_scale:
+        minimap_draw_cells(minimap, grid, assets_full, asset_sizes, minimap["cells"])
+        return
+
+    minimap["surface"].blit(old_surface, ((ox0 - x0) * tile_px // step, (oy0 - y0) * tile_px // step))
+    for band in ((x0, y0, x1, oy0 - 1), (x0, oy1 + 1, x1, y1), (x0, oy0, ox0 - 1, oy1), (ox1 + 1, oy0, x1, oy1)):
+        if band[0] <= band[2] and band[1] <= band[3]:
+            minimap_draw_cells(minimap, grid, assets_full, asset_sizes, band)
+
+
+def minimap_refresh_view(minimap, areas):
+    """Réduit à nouveau dans "view" les seules zones `areas` de la surface (Rects en pixels de surface)."""
+    view = minimap["view"]
+    if view is None: return
+    surface = minimap["surface"]
+    src_w, src_h = surface.get_size()
+    view_w, view_h = view.get_size()
+    scale_x, scale_y = view_w / src_w, view_h / src_h
+    for area in areas:
+        # Pixels de la vue touchés (en agrandissement, ceux qui interpolent aussi le pixel source voisin),
+        # puis la zone source qui leur correspond (arrondie vers l'extérieur)
+        area = area.inflate(2, 2).clip(surface.get_rect())
+        vx0, vy0 = int(area.left * scale_x), int(area.top * scale_y)
+        vx1, vy1 = min(view_w, math.ceil(area.right * scale_x)), min(view_h, math.ceil(area.bottom * scale_y))
+        if vx0 >= vx1 or vy0 >= vy1: continue
+        # Réduction avec 2 pixels de marge, non recopiés : les bords d'un smoothscale partiel sont faussés
+        ex0, ey0, ex1, ey1 = max(0, vx0 - 2), max(0, vy0 - 2), min(view_w, vx1 + 2), min(view_h, vy1 + 2)
+        sx0, sy0 = int(ex0 / scale_x), int(ey0 / scale_y)
+        sx1, sy1 = min(src_w, math.ceil(ex1 / scale_x)), min(src_h, math.ceil(ey1 / scale_y))
+        source = surface.subsurface((sx0, sy0, max(1, sx1 - sx0), max(1, sy1 - sy0)))
+        view.blit(pygame.transform.smoothscale(source, (ex1 - ex0, ey1 - ey0)), (vx0, vy0),
+                  (vx0 - ex0, vy0 - ey0, vx1 - vx0, vy1 - vy0))
+
+
+def minimap_update(minimap, grid, assets_full, asset_sizes, dirty_cells):
+    """Répercute les cellules modifiées (surface et vue, zone par zone). Si la carte sort de la zone
+    couverte, celle-ci grandit d'une marge doublée à chaque fois, sans tout redessiner."""
+    if minimap["stale"]:
+        minimap["stale"] = False
+        margin = minimap["margin"] = MINIMAP_MARGIN
+        x0, y0, x1, y1 = get_map_bounds(grid) or (0, 0, 0, 0)
+        minimap_rebuild(minimap, grid, assets_full, asset_sizes, (x0 - margin, y0 - margin, x1 + margin, y1 + margin))
+        return
+    if not dirty_cells: return
+
+    x0, y0, x1, y1 = minimap["cells"]
+    ux0 = min(rect[0] for rect in dirty_cells)
+    uy0 = min(rect[1] for rect in dirty_cells)
+    ux1 = max(rect[2] for rect in dirty_cells)
+    uy1 = max(rect[3] for rect in dirty_cells)
+    if ux0 < x0 or uy0 < y0 or ux1 > x1 or uy1 > y1:
+        margin = minimap["margin"] = minimap["margin"] * 2
+        minimap_grow(minimap, grid, assets_full, asset_sizes,
+                     (min(x0, ux0 - margin), min(y0, uy0 - margin), max(x1, ux1 + margin), max(y1, uy1 + margin)))
+
+    areas = [minimap_draw_cells(minimap, grid, assets_full, asset_sizes, cell_rect) for cell_rect in dirty_cells]
+    minimap_refresh_view(minimap, [area for area in areas if area])
+
+
+def draw_minimap(surface, minimap, box, camera, view_w, view_h):
+    """Dessine la mini-carte en bas à gauche de `box`, avec le cadre de la vue courante ; renvoie son Rect."""
+    if minimap["view"] is None:
+        src_w, src_h = minimap["surface"].get_size()
+        scale = min(box.width / src_w, box.height / src_h, 2.0)
+        size = (max(1, int(src_w * scale)), max(1, int(src_h * scale)))
+        minimap["view"] = pygame.transform.smoothscale(minimap["surface"], size)
+    view = minimap["view"]
+    rect = view.get_rect(bottomleft=box.bottomleft)
+    surface.blit(view, rect)
+
+    # Cadre de la vue : pixels carte -> pixels de la mini-carte
+    factor = view.get_width() / (minimap["surface"].get_width() * TILE_SIZE * minimap["step"] / minimap["tile_px"])
+    world = camera_world_rect(camera, view_w, view_h)
+    cells = minimap["cells"]
+    frame = pygame.Rect(rect.x + (world.x - cells[0] * TILE_SIZE) * factor,
+                        rect.y + (world.y - cells[1] * TILE_SIZE) * factor,
+                        max(2, world.width * factor), max(2, world.height * factor)).clip(rect)
+    if frame.width and frame.height: pygame.draw.rect(surface, COLOR_WALL_PREVIEW, frame, 1)
+    pygame.draw.rect(surface, COLOR_BORDER_GOLD, rect, 1)
+    minimap["screen_rect"] = rect
+    return rect
+
+
+def minimap_to_world(minimap, sx, sy):
+    """Pixel écran dans la mini-carte -> pixel carte."""
+    rect = minimap["screen_rect"]
+    factor = minimap["view"].get_width() / (minimap["surface"].get_width() * TILE_SIZE * minimap["step"]
+                                            / minimap["tile_px"])
+    cells = minimap["cells"]
+    return (sx - rect.x) / factor + cells[0] * TILE_SIZE, (sy - rect.y) / factor + cells[1] * TILE_SIZE
+
+
+# --- PALETTE ---
+# Chaque catégorie est prérendue dans une planche {"keys", "index", "surface", "cols", "col_step", "dirty",
+# "version"} de la largeur du panneau : l'affichage ne blitte que la tranche visible, un clic est converti
+# en indice par calcul, et seules les icônes dont l'angle d'outil a changé ("dirty") sont redessinées.
+
+def create_palette_sheet(keys, cols, col_step):
+    rows = (len(keys) + cols - 1) // cols
+    surf = pygame.Surface((UI_WIDTH, max(1, rows * PALETTE_ROW_HEIGHT)))
+    surf.fill(COLOR_UI_BG)
+    return {"keys": keys, "index": {key: i for i, key in enumerate(keys)}, "surface": surf, "cols": cols,
+            "col_step": col_step, "dirty": set(range(len(keys))), "version": 0}
+
+
+def get_palette_sheet(sheets, lib_name, keys, cols, col_step):
+    sheet = sheets.get(lib_name)
+    if sheet is None:
+        sheet = sheets[lib_name] = create_palette_sheet(keys, cols, col_step)
+    return sheet
+
+
+def palette_icon_pos(sheet, index):
+    """Coin haut-gauche de l'icône `index` dans la planche."""
+    row, col = divmod(index, sheet["cols"])
+    return 10 + col * sheet["col_step"] + (sheet["col_step"] - PALETTE_ICON_SIZE) // 2, row * PALETTE_ROW_HEIGHT
+
+
+def palette_index_at(sheet, lx, ly):
+    """Indice de l'icône sous le point (lx, ly) de la planche, ou None."""
+    col, rx = divmod(lx - 10 - (sheet["col_step"] - PALETTE_ICON_SIZE) // 2, sheet["col_step"])
+    row, ry = divmod(ly, PALETTE_ROW_HEIGHT)
+    if not 0 <= col < sheet["cols"] or row < 0 or rx >= PALETTE_ICON_SIZE or ry >= PALETTE_ICON_SIZE: return None
+    index = row * sheet["cols"] + col
+    return index if index < len(sheet["keys"]) else None
+
+
+def draw_palette_icon(surface, x, y, key, assets_thumb, asset_sizes, angle):
+    thumb = assets_thumb.get(key)
+    if not thumb: return
+    if angle != 0:
+        # Miniature = variante lissée à l'échelle 1/taille (clé distincte de la taille réelle)
+        img = get_rotated_surface(("thumb", key), thumb, angle, 1 / asset_sizes.get(key, 1))
+        surface.blit(img, img.get_rect(center=(x + PALETTE_ICON_SIZE // 2, y + PALETTE_ICON_SIZE // 2)))
+    else:
+        surface.blit(thumb, (x, y))
+
+
+def palette_sheet_refresh(sheet, assets_thumb, asset_sizes, tool_angles):
+    """Redessine les icônes marquées dans la planche ; "version" change si la planche a changé."""
+    if not sheet["dirty"]: return
+    for index in sorted(sheet["dirty"]):
+        x, y = palette_icon_pos(sheet, index)
+        key = sheet["keys"][index]
+        sheet["surface"].fill(COLOR_UI_BG, (x, y, PALETTE_ICON_SIZE, PALETTE_ICON_SIZE))
+        draw_palette_icon(sheet["surface"], x, y, key, assets_thumb, asset_sizes, tool_angles.get(key, 0))
+    sheet["dirty"].clear()
+    sheet["version"] += 1
+
+
+def palette_sheets_invalidate(sheets, key):
+    """L'angle d'outil de `key` a changé : son icône est à redessiner dans chaque planche qui la contient."""
+    for sheet in sheets.values():
+        index = sheet["index"].get(key)
+        if index is not None: sheet["dirty"].add(index)
+
+
 def distance_point_to_segment(px, py, x1, y1, x2, y2):
     dx = x2 - x1
     dy = y2 - y1
@@ -246,36 +1426,281 @@ def distance_point_to_segment(px, py, x1, y1, x2, y2):
     return math.hypot(px - closest_x, py - closest_y)
 
 
+# --- MURS (GRAPHE ET INDEX SPATIAL) ---
+# Les murs d'un étage sont un dict {"segments": [mur, ...], "buckets": {(bx, by): [mur, ...]},
+# "vertices": {(x, y): nb d'extrémités}} : un graphe dont les murs sont les arêtes.
+# "segments" garde l'ordre de tracé (sauvegarde, export) ; "buckets" range chaque mur dans les seaux
+# de WALL_BUCKET_SIZE pixels que son segment traverse, pour les requêtes de proximité et de zone ;
+# "vertices" sert à souder les extrémités des nouveaux murs sur les sommets existants.
+
+def get_wall_buckets(wall):
+    x1, y1, x2, y2 = wall['x1'], wall['y1'], wall['x2'], wall['y2']
+    by0, by1 = min(y1, y2) // WALL_BUCKET_SIZE, max(y1, y2) // WALL_BUCKET_SIZE
+    buckets = []
+    for by in range(by0, by1 + 1):
+        # Portion du segment comprise dans la bande horizontale du seau
+        if by0 == by1:
+            sx0, sx1 = min(x1, x2), max(x1, x2)
+        else:
+            t0 = (by * WALL_BUCKET_SIZE - y1) / (y2 - y1)
+            t1 = ((by + 1) * WALL_BUCKET_SIZE - y1) / (y2 - y1)
+            t0, t1 = max(0.0, min(1.0, t0)), max(0.0, min(1.0, t1))
+            xa, xb = x1 + t0 * (x2 - x1), x1 + t1 * (x2 - x1)
+            sx0, sx1 = min(xa, xb), max(xa, xb)
+        for bx in range(int(sx0 // WALL_BUCKET_SIZE), int(sx1 // WALL_BUCKET_SIZE) + 1):
+            buckets.append((bx, by))
+    return buckets
+
+
+def create_wall_set(segments=None):
+    wall_set = {"segments": [], "buckets": {}, "vertices": {}}
+    for wall in segments or []:
+        wall_set_insert(wall_set, len(wall_set["segments"]), wall)
+    return wall_set
+
+
+def wall_set_insert(wall_set, idx, wall):
+    wall_set["segments"].insert(idx, wall)
+    for bucket in get_wall_buckets(wall):
+        wall_set["buckets"].setdefault(bucket, []).append(wall)
+    vertices = wall_set["vertices"]
+    for point in ((wall['x1'], wall['y1']), (wall['x2'], wall['y2'])):
+        vertices[point] = vertices.get(point, 0) + 1
+
+
+def wall_set_pop(wall_set, idx):
+    wall = wall_set["segments"].pop(idx)
+    for bucket in get_wall_buckets(wall):
+        entries = wall_set["buckets"][bucket]
+        for pos, other in enumerate(entries):
+            if other is wall:
+                del entries[pos]
+                break
+        if not entries: del wall_set["buckets"][bucket]
+    vertices = wall_set["vertices"]
+    for point in ((wall['x1'], wall['y1']), (wall['x2'], wall['y2'])):
+        vertices[point] -= 1
+        if not vertices[point]: del vertices[point]
+    return wall
+
+
+def wall_set_indices(wall_set, walls):
+    """[(index, mur), ...] des murs `walls` dans l'ordre de tracé : un seul parcours de la liste, quel
+    que soit le nombre de murs cherchés (sélection à l'élastique, fusion)."""
+    wanted = {id(wall) for wall in walls}
+    return [(idx, wall) for idx, wall in enumerate(wall_set["segments"]) if id(wall) in wanted]
+
+
+def walls_in_rect(wall_set, rect):
+    """Murs dont un seau touche `rect` (pygame.Rect en coordonnées carte) : candidats, sans doublon."""
+    found = {}
+    buckets = wall_set["buckets"]
+    for by in range(rect.top // WALL_BUCKET_SIZE, (rect.bottom - 1) // WALL_BUCKET_SIZE + 1):
+        for bx in range(rect.left // WALL_BUCKET_SIZE, (rect.right - 1) // WALL_BUCKET_SIZE + 1):
+            for wall in buckets.get((bx, by), ()):
+                found[id(wall)] = wall
+    return list(found.values())
+
+
+def find_nearest_wall(wall_set, px, py, max_dist=WALL_PICK_DISTANCE):
+    """Mur le plus proche de (px, py) à moins de `max_dist` pixels, ou None."""
+    best, best_dist = None, max_dist
+    search = pygame.Rect(px - max_dist, py - max_dist, 2 * max_dist + 1, 2 * max_dist + 1)
+    for wall in walls_in_rect(wall_set, search):
+        dist = distance_point_to_segment(px, py, wall['x1'], wall['y1'], wall['x2'], wall['y2'])
+        if dist < best_dist:
+            best, best_dist = wall, dist
+    return best
+
+
+def walls_inside_rect(wall_set, rect):
+    """Murs entièrement contenus dans `rect` (sélection à l'élastique)."""
+    inside = []
+    for wall in walls_in_rect(wall_set, rect):
+        if rect.left <= min(wall['x1'], wall['x2']) and max(wall['x1'], wall['x2']) <= rect.right \
+                and rect.top <= min(wall['y1'], wall['y2']) and max(wall['y1'], wall['y2']) <= rect.bottom:
+            inside.append(wall)
+    return inside
+
+
+# --- MURS (NORMALISATION) ---
+# Deux murs sur une même droite qui se touchent ou se chevauchent n'en font qu'un pour la ligne de vue.
+# Une droite est repérée par sa direction réduite (dx, dy) et sa constante dy * x - dx * y (entiers
+# exacts) ; la position d'un point le long de la droite est x * dx + y * dy.
+
+def weld_wall_point(vertices, x, y):
+    """Sommet existant à moins de WALL_WELD_DISTANCE pixels de (x, y), sinon (x, y) lui-même."""
+    if (x, y) in vertices: return x, y
+    best, best_dist = (x, y), None
+    for vy in range(round(y) - WALL_WELD_DISTANCE, round(y) + WALL_WELD_DISTANCE + 1):
+        for vx in range(round(x) - WALL_WELD_DISTANCE, round(x) + WALL_WELD_DISTANCE + 1):
+            if (vx, vy) in vertices:
+                dist = max(abs(vx - x), abs(vy - y))
+                if dist <= WALL_WELD_DISTANCE and (best_dist is None or dist < best_dist):
+                    best, best_dist = (vx, vy), dist
+    return best
+
+
+def get_wall_line(p1, p2):
+    """(clé de la droite, position de p1, position de p2) d'un segment non nul."""
+    dx, dy = p2[0] - p1[0], p2[1] - p1[1]
+    g = math.gcd(dx, dy)
+    dx, dy = dx // g, dy // g
+    if dx < 0 or (dx == 0 and dy < 0): dx, dy = -dx, -dy
+    return (dx, dy, dy * p1[0] - dx * p1[1]), p1[0] * dx + p1[1] * dy, p2[0] * dx + p2[1] * dy
+
+
+def wall_set_add_normalized(wall_set, wall):
+    """Ajoute un mur tracé en gardant l'étage normalisé : extrémités soudées, segment nul ou déjà couvert
+    ignoré, murs colinéaires qui le touchent ou le chevauchent fusionnés avec lui.
+
+    Renvoie les opérations d'historique appliquées (vide si rien n'a changé).
+    """
+    p1 = weld_wall_point(wall_set["vertices"], wall['x1'], wall['y1'])
+    p2 = weld_wall_point(wall_set["vertices"], wall['x2'], wall['y2'])
+    if p1 == p2: return []
+    line, t1, t2 = get_wall_line(p1, p2)
+    lo, hi = ((t1, p1), (t2, p2)) if t1 < t2 else ((t2, p2), (t1, p1))
+
+    # Les fusions allongent le segment : on recherche jusqu'à ce qu'il ne bouge plus
+    merged = {}
+    grown = True
+    while grown:
+        grown = False
+        area = pygame.Rect(min(lo[1][0], hi[1][0]), min(lo[1][1], hi[1][1]),
+                           abs(hi[1][0] - lo[1][0]) + 1, abs(hi[1][1] - lo[1][1]) + 1)
+        for other in walls_in_rect(wall_set, area):
+            if id(other) in merged: continue
+            q1, q2 = (other['x1'], other['y1']), (other['x2'], other['y2'])
+            if q1 == q2: continue
+            other_line, u1, u2 = get_wall_line(q1, q2)
+            if other_line != line or max(u1, u2) < lo[0] or min(u1, u2) > hi[0]: continue
+            merged[id(other)] = other
+            if min(u1, u2) < lo[0]: lo = (u1, q1) if u1 < u2 else (u2, q2)
+            if max(u1, u2) > hi[0]: hi = (u1, q1) if u1 > u2 else (u2, q2)
+            grown = True
+
+    # Déjà couvert par un seul mur existant (doublon, ou tracé par-dessus)
+    if len(merged) == 1:
+        (other,) = merged.values()
+        if {(other['x1'], other['y1']), (other['x2'], other['y2'])} == {lo[1], hi[1]}: return []
+
+    ops = []
+    for i, other in reversed(wall_set_indices(wall_set, merged.values())):
+        wall_set_pop(wall_set, i)
+        ops.append(("remove_wall", i, other))
+    # Le mur fusionné garde le sens du tracé
+    start, end = (lo[1], hi[1]) if t1 < t2 else (hi[1], lo[1])
+    new_wall = {'x1': start[0], 'y1': start[1], 'x2': end[0], 'y2': end[1]}
+    ops.append(("add_wall", len(wall_set["segments"]), new_wall))
+    wall_set_insert(wall_set, len(wall_set["segments"]), new_wall)
+    return ops
+
+
+def normalize_wall_segments(segments):
+    """Copie normalisée d'une liste de murs (export) : extrémités soudées, segments nuls et doublons retirés,
+    murs colinéaires qui se touchent ou se chevauchent fusionnés. Chaque droite garde la place de son
+    premier mur dans l'ordre de tracé."""
+    vertices = {}
+    lines = {}
+    for wall in segments:
+        p1 = weld_wall_point(vertices, wall['x1'], wall['y1'])
+        vertices[p1] = True
+        p2 = weld_wall_point(vertices, wall['x2'], wall['y2'])
+        vertices[p2] = True
+        if p1 == p2: continue
+        line, t1, t2 = get_wall_line(p1, p2)
+        lines.setdefault(line, []).append(((t1, p1), (t2, p2)) if t1 < t2 else ((t2, p2), (t1, p1)))
+
+    normalized = []
+    for intervals in lines.values():
+        intervals.sort()
+        lo, hi = intervals[0]
+        for start, end in intervals[1:]:
+            if start[0] <= hi[0]:
+                if end[0] > hi[0]: hi = end
+            else:
+                normalized.append({'x1': lo[1][0], 'y1': lo[1][1], 'x2': hi[1][0], 'y2': hi[1][1]})
+                lo, hi = start, end
+        normalized.append({'x1': lo[1][0], 'y1': lo[1][1], 'x2': hi[1][0], 'y2': hi[1][1]})
+    return normalized
+
+
 # --- HISTORIQUE ---
-def save_history(grid, walls):
-    global undo_stack, redo_stack
-    state = {
-        "grid": copy.deepcopy(grid),
-        "walls": copy.deepcopy(walls)
-    }
-    undo_stack.append(state)
-    if len(undo_stack) > MAX_HISTORY: undo_stack.pop(0)
-    redo_stack.clear()
+# Chaque étape est une liste d'opérations élémentaires (seules les cases et murs modifiés) :
+#   ("add_item", x, y, index_pile, item) / ("remove_item", x, y, index_pile, item)
+#   ("add_wall", index, mur) / ("remove_wall", index, mur)
+
+def estimate_history_bytes(ops):
+    total = sys.getsizeof(ops)
+    for op in ops:
+        total += sys.getsizeof(op) + sys.getsizeof(op[-1])
+    return total
+
+
+def record_history(grid, action, ops, now, merge=False):
+    """Ajoute une étape à l'historique de l'étage.
+
+    Fusionne avec l'étape précédente si c'est la même action à moins de HISTORY_COALESCE_MS
+    (ou si `merge` est demandé, ex: déposer une tuile qu'on vient de ramasser).
+    """
+    if not ops: return
+    history = grid["history"]
+    for entry in history["redo"]:
+        history["bytes"] -= entry["bytes"]
+    history["redo"].clear()
+
+    size = estimate_history_bytes(ops)
+    undo = history["undo"]
+    if undo and (merge or (undo[-1]["action"] == action and now - undo[-1]["time"] <= HISTORY_COALESCE_MS)):
+        undo[-1]["ops"].extend(ops)
+        undo[-1]["time"] = now
+        undo[-1]["bytes"] += size
+    else:
+        undo.append({"action": action, "ops": list(ops), "time": now, "bytes": size})
+    history["bytes"] += size
+
+    # Budget mémoire : on oublie les étapes les plus anciennes
+    while history["bytes"] > HISTORY_MAX_BYTES and len(undo) > 1:
+        history["bytes"] -= undo.pop(0)["bytes"]
+
+
+def apply_history_ops(grid, walls, ops, asset_sizes, undo):
+    """Rejoue les opérations (ou les annule si `undo`) ; renvoie les zones de cellules modifiées."""
+    dirty = []
+    for op in (reversed(ops) if undo else ops):
+        kind = op[0]
+        if kind in ("add_item", "remove_item"):
+            _, x, y, stack_idx, item = op
+            if (kind == "add_item") != undo:
+                grid_add_item(grid, x, y, item, asset_sizes, stack_idx)
+            else:
+                grid_remove_item(grid, x, y, stack_idx, asset_sizes)
+            dirty.append(get_item_footprint(x, y, asset_sizes.get(item['key'], 1)))
+        else:
+            _, wall_idx, wall = op
+            if (kind == "add_wall") != undo:
+                wall_set_insert(walls, wall_idx, wall)
+            else:
+                wall_set_pop(walls, wall_idx)
+            dirty.append(get_wall_cells(wall))
+    return dirty
 
 
-def perform_undo(curr_grid, curr_walls):
-    global undo_stack, redo_stack
-    if len(undo_stack) > 0:
-        state_redo = {"grid": copy.deepcopy(curr_grid), "walls": copy.deepcopy(curr_walls)}
-        redo_stack.append(state_redo)
-        prev_state = undo_stack.pop()
-        return prev_state["grid"], prev_state["walls"]
-    return curr_grid, curr_walls
+def perform_undo(grid, walls, asset_sizes):
+    history = grid["history"]
+    if not history["undo"]: return []
+    entry = history["undo"].pop()
+    history["redo"].append(entry)
+    return apply_history_ops(grid, walls, entry["ops"], asset_sizes, undo=True)
 
 
-def perform_redo(curr_grid, curr_walls):
-    global undo_stack, redo_stack
-    if len(redo_stack) > 0:
-        state_undo = {"grid": copy.deepcopy(curr_grid), "walls": copy.deepcopy(curr_walls)}
-        undo_stack.append(state_undo)
-        next_state = redo_stack.pop()
-        return next_state["grid"], next_state["walls"]
-    return curr_grid, curr_walls
+def perform_redo(grid, walls, asset_sizes):
+    history = grid["history"]
+    if not history["redo"]: return []
+    entry = history["redo"].pop()
+    history["undo"].append(entry)
+    return apply_history_ops(grid, walls, entry["ops"], asset_sizes, undo=False)
 
 
 # --- FICHIERS ---
@@ -285,150 +1710,553 @@ def get_local_path(filename):
 
 
 def list_json_files():
+    """Projets sauvegardés (JSON ou binaire .mdmap) à côté du script."""
     base_dir = os.path.dirname(os.path.abspath(__file__))
     files = []
     try:
         for f in os.listdir(base_dir):
-            if f.endswith(".json"): files.append(f)
+            if f.endswith((".json", PROJECT_BINARY_EXT)): files.append(f)
     except:
         pass
     files.sort()
     return files
 
 
-def save_project_named(levels_data, walls_data, custom_name):
-    """Sauvegarde avec un nom choisi par l'utilisateur."""
-    if not custom_name.endswith(".json"):
-        custom_name += ".json"
-
-    file_path = get_local_path(custom_name)
-
-    save_data = {}
+# Un projet se lit et s'écrit sous forme neutre, quel que soit le format :
+#   records : {étage: [(x, y, clé, angle, couche), ...]} dans l'ordre des piles (bas -> haut)
+#   walls   : {"étage": [mur, ...]} (clés texte, comme dans le JSON)
+def encode_level_block(records, segments, asset_ids):
+    """Répertoire des blocs de grille, éléments groupés par bloc (un seul pack par bloc), puis murs.
+
+    Au chargement, chaque bloc reste empaqueté jusqu'à sa première lecture (grid_chunk)."""
+    chunks = {}
+    for x, y, key, angle, layer in records:
+        chunk_key = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+        flat = chunks.get(chunk_key)
+        if flat is None: flat = chunks[chunk_key] = []
+        flat += (x, y, asset_ids[key], angle, layer)
+    item_format = PROJECT_ITEM.format[1:]
+    parts = [struct.pack("<I", len(chunks))]
+    parts += [PROJECT_CHUNK.pack(cx, cy, len(flat) // len(item_format)) for (cx, cy), flat in chunks.items()]
+    parts += [struct.pack("<" + item_format * (len(flat) // len(item_format)), *flat) for flat in chunks.values()]
+    packed = bytearray(PROJECT_WALL.size * len(segments))
+    for i, w in enumerate(segments):
+        PROJECT_WALL.pack_into(packed, i * PROJECT_WALL.size, w['x1'], w['y1'], w['x2'], w['y2'])
+    return b"".join(parts) + bytes(packed)
+
+
+def encode_project_binary(levels_records, walls, compress=PROJECT_BINARY_COMPRESS):
+    """Sérialise un projet au format .mdmap (chaque clé d'asset n'est écrite qu'une fois).
+
+    Chaque étage est un bloc indépendant (compressé à part) repéré par l'index : il peut être
+    lu seul, sans décompresser le reste du projet."""
+    asset_ids = {}
+    for records in levels_records.values():
+        for record in records:
+            if record[2] not in asset_ids: asset_ids[record[2]] = len(asset_ids)
+
+    parts = [struct.pack("<I", len(asset_ids))]
+    for key in asset_ids:
+        raw_key = key.encode("utf-8")
+        parts.append(struct.pack("<H", len(raw_key)))
+        parts.append(raw_key)
+    table = b"".join(parts)
+    if compress: table = zlib.compress(table, 6)
+
+    level_ids = list(levels_records)
+    for level_idx in walls:
+        if int(level_idx) not in levels_records: level_ids.append(int(level_idx))
+    blocks = []
+    for level_idx in level_ids:
+        records = levels_records.get(level_idx, ())
+        segments = walls.get(str(level_idx))
+        presence = (1 if level_idx in levels_records else 0) | (2 if segments is not None else 0)
+        block = encode_level_block(records, segments or (), asset_ids)
+        if compress: block = zlib.compress(block, 6)
+        blocks.append((level_idx, presence, len(records), len(segments or ()), block))
+
+    header = (PROJECT_HEADER.pack(PROJECT_BINARY_MAGIC, PROJECT_BINARY_VERSION, 1 if compress else 0)
+              + struct.pack("<I", len(table)) + table + struct.pack("<I", len(blocks)))
+    offset = len(header) + PROJECT_LEVEL_ENTRY.size * len(blocks)
+    index = []
+    for level_idx, presence, item_count, wall_count, block in blocks:
+        index.append(PROJECT_LEVEL_ENTRY.pack(level_idx, presence, item_count, wall_count, offset, len(block)))
+        offset += len(block)
+    return b"".join([header] + index + [block[-1] for block in blocks])
+
+
+def decode_project_v1(data, flags):
+    """Ancien format (version 1) : tout le projet dans un seul bloc."""
+    payload = memoryview(data)[PROJECT_HEADER.size:]
+    if flags & 1: payload = memoryview(zlib.decompress(payload))
+
+    pos = 0
+    def read(fmt):
+        nonlocal pos
+        values = struct.unpack_from(fmt, payload, pos)
+        pos += struct.calcsize(fmt)
+        return values
+
+    (asset_count,) = read("<I")
+    asset_keys = []
+    for _ in range(asset_count):
+        (length,) = read("<H")
+        asset_keys.append(bytes(payload[pos:pos + length]).decode("utf-8"))
+        pos += length
+
+    levels_records = {}
+    (level_count,) = read("<I")
+    for _ in range(level_count):
+        level_idx, count = read("<iI")
+        end = pos + count * PROJECT_ITEM.size
+        levels_records[level_idx] = [(x, y, asset_keys[a], angle, layer)
+                                     for x, y, a, angle, layer in PROJECT_ITEM.iter_unpack(payload[pos:end])]
+        pos = end
+
+    walls = {}
+    (wall_level_count,) = read("<I")
+    for _ in range(wall_level_count):
+        level_idx, count = read("<iI")
+        end = pos + count * PROJECT_WALL.size
+        walls[str(level_idx)] = [{'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2}
+                                 for x1, y1, x2, y2 in PROJECT_WALL.iter_unpack(payload[pos:end])]
+        pos = end
+    return levels_records, walls
+
+
+def decode_project_source(data):
+    """En-tête .mdmap -> source de projet. Depuis la version 2, seuls la table des assets et l'index sont lus."""
+    magic, version, flags = PROJECT_HEADER.unpack_from(data)
+    if magic != PROJECT_BINARY_MAGIC: raise ValueError("pas un projet .mdmap")
+    if version == 1: return project_source_from_records(*decode_project_v1(data, flags))
+    if version not in (2, PROJECT_BINARY_VERSION): raise ValueError(f"version .mdmap inconnue : {version}")
+
+    pos = PROJECT_HEADER.size
+    (table_len,) = struct.unpack_from("<I", data, pos)
+    pos += 4
+    table = data[pos:pos + table_len]
+    if flags & 1: table = zlib.decompress(table)
+    pos += table_len
+
+    (asset_count,) = struct.unpack_from("<I", table)
+    asset_keys = []
+    key_pos = 4
+    for _ in range(asset_count):
+        (length,) = struct.unpack_from("<H", table, key_pos)
+        asset_keys.append(bytes(table[key_pos + 2:key_pos + 2 + length]).decode("utf-8"))
+        key_pos += 2 + length
+
+    (level_count,) = struct.unpack_from("<I", data, pos)
+    pos += 4
+    index = {}
+    for level_idx, presence, item_count, wall_count, offset, length in \
+            PROJECT_LEVEL_ENTRY.iter_unpack(data[pos:pos + level_count * PROJECT_LEVEL_ENTRY.size]):
+        index[level_idx] = (presence, item_count, wall_count, offset, length)
+    return {"index": index, "data": data, "version": version, "compressed": bool(flags & 1),
+            "asset_keys": asset_keys, "visits": {}, "clock": 0}
+
+
+def decode_project_binary(data):
+    """Inverse de encode_project_binary : lectures en bloc (iter_unpack), pas de dict par élément."""
+    return project_source_records(decode_project_source(data))
+
+
+# Une source de projet garde le fichier ouvert en mémoire (compressé) pour construire les étages à la demande :
+#   index : {étage: (présence, nb éléments, nb murs, position, longueur)}, dans l'ordre du fichier
+#   data / version / asset_keys : octets .mdmap et clés d'asset (versions 2 et 3), ou records / walls déjà décodés
+#   visits / clock : dernière visite de chaque étage (ordre de déchargement)
+def project_source_from_records(levels_records, walls):
+    """Source sur un projet déjà décodé (JSON ou .mdmap version 1)."""
+    index = {level_idx: (1, len(records), 0, None, None) for level_idx, records in levels_records.items()}
+    for level_idx, segments in walls.items():
+        presence, item_count, _, _, _ = index.get(int(level_idx), (0, 0, 0, None, None))
+        index[int(level_idx)] = (presence | 2, item_count, len(segments), None, None)
+    return {"index": index, "records": levels_records, "walls": walls, "visits": {}, "clock": 0}
+
+
+def source_level_records(source, level_idx):
+    """(records, murs) d'un étage de la source ; None pour la partie absente du fichier."""
+    presence, item_count, _, offset, length = source["index"][level_idx]
+    if "records" in source:
+        return source["records"].get(level_idx), source["walls"].get(str(level_idx))
+
+    block = source_level_block(source, offset, length)
+    start = 0
+    if source["version"] >= 3:
+        (chunk_count,) = struct.unpack_from("<I", block)
+        start = 4 + chunk_count * PROJECT_CHUNK.size  # Les éléments groupés par bloc se suivent
+    end = start + item_count * PROJECT_ITEM.size
+    asset_keys = source["asset_keys"]
+    records = [(x, y, asset_keys[a], angle, layer)
+               for x, y, a, angle, layer in PROJECT_ITEM.iter_unpack(block[start:end])]
+    # Groupés par bloc dans le fichier : retour à l'ordre ligne par ligne (tri stable, piles conservées)
+    if start: records.sort(key=lambda record: (record[1], record[0]))
+    segments = [{'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2} for x1, y1, x2, y2 in PROJECT_WALL.iter_unpack(block[end:])]
+    return (records if presence & 1 else None), (segments if presence & 2 else None)
+
+
+def source_level_block(source, offset, length):
+    """Bloc d'un étage dans le fichier, décompressé si besoin."""
+    block = source["data"][offset:offset + length]
+    if source["compressed"]: block = zlib.decompress(block)
+    return memoryview(block)
+
+
+def source_level_grid(source, level_idx):
+    """(grille, murs) d'un étage de la source ; None pour la partie absente du fichier.
+
+    En version 3, seul le répertoire des blocs est lu : chaque bloc de grille reste empaqueté
+    dans "pending" jusqu'à sa première lecture."""
+    if "records" in source or source["version"] < 3:
+        records, segments = source_level_records(source, level_idx)
+        return (grid_from_records(records) if records is not None else None), segments
+
+    presence, _, _, offset, length = source["index"][level_idx]
+    block = source_level_block(source, offset, length)
+    (chunk_count,) = struct.unpack_from("<I", block)
+    pos = 4 + chunk_count * PROJECT_CHUNK.size
+    grid = create_grid()
+    asset_keys = source["asset_keys"]
+    for cx, cy, count in PROJECT_CHUNK.iter_unpack(block[4:pos]):
+        end = pos + count * PROJECT_ITEM.size
+        grid["pending"][(cx, cy)] = (block[pos:end], asset_keys)
+        pos = end
+    segments = [{'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2} for x1, y1, x2, y2 in PROJECT_WALL.iter_unpack(block[pos:])]
+    return (grid if presence & 1 else None), (segments if presence & 2 else None)
+
+
+def project_source_records(source):
+    """Tous les étages de la source sous forme neutre."""
+    if "records" in source: return source["records"], source["walls"]
+    levels_records, walls = {}, {}
+    for level_idx in source["index"]:
+        records, segments = source_level_records(source, level_idx)
+        if records is not None: levels_records[level_idx] = records
+        if segments is not None: walls[str(level_idx)] = segments
+    return levels_records, walls
+
+
+def project_json_to_records(save_data):
+    """Contenu d'un projet JSON (ancien format sans "levels" compris) -> forme neutre."""
+    if "levels" not in save_data:
+        raw_levels = save_data
+        walls = {}
+    else:
+        raw_levels = save_data["levels"]
+        walls = save_data.get("walls", {})
+
+    levels_records = {}
+    for lvl_idx_str, cells in raw_levels.items():
+        records = []
+        for cell_data in cells:
+            x, y = cell_data['x'], cell_data['y']
+            for item in cell_data.get("stack", ()):
+                records.append((x, y, item['key'], item['angle'], item.get('layer', 0)))
+        levels_records[int(lvl_idx_str)] = records
+    return levels_records, {str(k): v for k, v in walls.items()}
+
+
+def project_records_to_json(levels_records, walls):
+    """Forme neutre -> contenu d'un projet JSON (une entrée par case non vide)."""
     levels_export = {}
-    for level_idx, grid in levels_data.items():
+    for level_idx, records in levels_records.items():
         level_cells = []
-        rows = len(grid)
-        cols = len(grid[0]) if rows > 0 else 0
-        for y in range(rows):
-            for x in range(cols):
-                if len(grid[y][x]) > 0:
-                    stack_data = []
-                    for item in grid[y][x]:
-                        stack_data.append({
-                            "key": item['key'],
-                            "angle": item['angle'],
-                            "layer": item.get('layer', 0)
-                        })
-                    level_cells.append({"x": x, "y": y, "stack": stack_data})
+        for x, y, key, angle, layer in records:
+            # Les éléments d'une même case sont consécutifs
+            if not level_cells or (level_cells[-1]["x"], level_cells[-1]["y"]) != (x, y):
+                level_cells.append({"x": x, "y": y, "stack": []})
+            level_cells[-1]["stack"].append({"key": key, "angle": angle, "layer": layer})
         levels_export[str(level_idx)] = level_cells
+    return {"levels": levels_export, "walls": walls}
 
-    save_data["levels"] = levels_export
-    save_data["walls"] = walls_data
 
-    try:
+def read_project_source(file_path):
+    """Ouvre un projet JSON ou .mdmap (reconnu à son en-tête) sans construire ses étages."""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if data[:len(PROJECT_BINARY_MAGIC)] == PROJECT_BINARY_MAGIC:
+        return decode_project_source(data)
+    return project_source_from_records(*project_json_to_records(json.loads(data)))
+
+
+def read_project_records(file_path):
+    """Lit un projet JSON ou .mdmap (reconnu à son en-tête) sous forme neutre."""
+    return project_source_records(read_project_source(file_path))
+
+
+def write_project_records(file_path, levels_records, walls):
+    """Écrit un projet : binaire si le nom finit par .mdmap, JSON sinon."""
+    if file_path.endswith(PROJECT_BINARY_EXT):
+        with open(file_path, 'wb') as f:
+            f.write(encode_project_binary(levels_records, walls))
+    else:
         with open(file_path, 'w') as f:
-            json.dump(save_data, f)
+            json.dump(project_records_to_json(levels_records, walls), f)
+
+
+def convert_project_file(src_name, dst_name):
+    """Conversion JSON <-> .mdmap (le format de sortie suit l'extension de `dst_name`)."""
+    try:
+        levels_records, walls = read_project_records(get_local_path(src_name))
+        write_project_records(get_local_path(dst_name), levels_records, walls)
+        return f"Converti: {dst_name}"
+    except Exception as e:
+        return f"Err: {e}"
+
+
+def snapshot_level_records(grid):
+    """Copie figée d'un étage : [(x, y, clé, angle, couche), ...] dans l'ordre des piles."""
+    records = []
+    for x, y, cell_stack in grid_iter_cells(grid):
+        for item in cell_stack:
+            records.append((x, y, item['key'], item['angle'], item.get('layer', 0)))
+    return records
+
+
+def snapshot_project(levels_data, walls_data, source=None):
+    """Copie figée (records, walls) du projet : l'éditeur peut continuer à le modifier ensuite.
+
+    Les étages pas encore construits (ou déchargés) sont repris tels quels de la source."""
+    levels_records = {level_idx: snapshot_level_records(grid) for level_idx, grid in levels_data.items()}
+    walls = {str(level_idx): list(wall_set["segments"]) for level_idx, wall_set in walls_data.items()}
+    if source is not None:
+        for level_idx in source["index"]:
+            if level_idx in levels_data: continue
+            records, segments = source_level_records(source, level_idx)
+            if records is not None: levels_records[level_idx] = records
+            if segments is not None and str(level_idx) not in walls: walls[str(level_idx)] = segments
+    return levels_records, walls
+
+
+def save_project_snapshot(snapshot, custom_name):
+    """Écrit une copie figée du projet (utilisable depuis un thread)."""
+    if not custom_name.endswith((".json", PROJECT_BINARY_EXT)):
+        custom_name += ".json"
+
+    try:
+        write_project_records(get_local_path(custom_name), *snapshot)
         return f"Sauvé: {custom_name}"
     except Exception as e:
         return f"Err: {e}"
 
 
-def load_project_file(filename, current_w, current_h_map):
+def save_project_named(levels_data, walls_data, custom_name, source=None):
+    """Sauvegarde avec un nom choisi par l'utilisateur (JSON, ou binaire si le nom finit par .mdmap)."""
+    return save_project_snapshot(snapshot_project(levels_data, walls_data, source), custom_name)
+
+
+def load_project_file(filename):
     file_path = get_local_path(filename)
+    # Le chargement crée des centaines de milliers de petits objets : le GC les rescannerait sans fin
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
     try:
-        with open(file_path, 'r') as f:
-            save_data = json.load(f)
+        source = read_project_source(file_path)
 
-        if "levels" not in save_data:
-            raw_levels = save_data
-            loaded_walls = {}
-        else:
-            raw_levels = save_data["levels"]
-            loaded_walls = save_data.get("walls", {})
-
-        new_levels_data = {}
-        for lvl_idx_str, cells in raw_levels.items():
-            lvl_idx = int(lvl_idx_str)
-            grid = resize_grid(None, current_w, current_h_map)
-            rows = len(grid)
-            cols = len(grid[0]) if rows > 0 else 0
-            for cell_data in cells:
-                x, y = cell_data['x'], cell_data['y']
-                if 0 <= y < rows and 0 <= x < cols:
-                    grid[y][x] = []
-                    if "stack" in cell_data:
-                        for item in cell_data["stack"]:
-                            grid[y][x].append({
-                                'key': item['key'],
-                                'angle': item['angle'],
-                                'layer': item.get('layer', 0)
-                            })
-            new_levels_data[lvl_idx] = grid
+        new_levels_data, loaded_walls = {}, {}
+        for lvl_idx in source["index"]:
+            grid, segments = source_level_grid(source, lvl_idx)
+            if grid is not None: new_levels_data[lvl_idx] = grid
+            if segments is not None: loaded_walls[str(lvl_idx)] = segments
 
         return new_levels_data, loaded_walls, f"Chargé: {filename}"
     except Exception as e:
         return None, {}, f"Err: {e}"
+    finally:
+        if gc_was_enabled: gc.enable()
+
+
+# --- CHARGEMENT PARESSEUX DES ÉTAGES ---
+def level_is_modified(grid):
+    """Un étage édité depuis son chargement (historique non vide) ne peut pas être relu depuis la source."""
+    return bool(grid["history"]["undo"] or grid["history"]["redo"])
+
+
+def build_source_level(source, level_idx):
+    """Construit (grille, murs) d'un étage de la source."""
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        grid, segments = source_level_grid(source, level_idx)
+        return (grid if grid is not None else create_grid()), create_wall_set(segments or [])
+    finally:
+        if gc_was_enabled: gc.enable()
+
+
+def stream_levels(levels_data, walls_data, source, level_idx):
+    """Rend l'étage `level_idx` actif : lui et ses voisins (ETAGE +/-) sont construits s'ils manquent,
+    puis les étages inactifs non modifiés sont déchargés (les moins récemment visités d'abord)
+    tant que le total des éléments construits dépasse LEVEL_STREAM_MAX_ITEMS."""
+    window = (level_idx - 1, level_idx, level_idx + 1)
+    for lvl in window:
+        if lvl in levels_data: continue
+        if source is not None and lvl in source["index"]:
+            levels_data[lvl], walls_data[lvl] = build_source_level(source, lvl)
+        elif lvl == level_idx:
+            levels_data[lvl] = create_grid()
+    if level_idx not in walls_data: walls_data[level_idx] = create_wall_set()
+    if source is None: return
+
+    source["clock"] += 1
+    source["visits"][level_idx] = source["clock"]
+    index = source["index"]
+    resident = sum(index[lvl][1] for lvl in levels_data if lvl in index)
+    # Les voisins préchargés mais jamais visités partent en premier
+    for lvl in sorted(levels_data, key=lambda lvl: source["visits"].get(lvl, 0)):
+        if resident <= LEVEL_STREAM_MAX_ITEMS: break
+        if lvl in window or lvl not in index or level_is_modified(levels_data[lvl]): continue
+        del levels_data[lvl]
+        walls_data.pop(lvl, None)
+        resident -= index[lvl][1]
+
+
+def open_project_file(filename):
+    """Ouvre un projet dans l'éditeur : seuls l'étage 0 et ses voisins sont construits, les autres
+    le seront à la première visite. Retourne (levels_data, walls_data, source, message)."""
+    try:
+        source = read_project_source(get_local_path(filename))
+        levels_data, walls_data = {}, {}
+        stream_levels(levels_data, walls_data, source, 0)
+        return levels_data, walls_data, source, f"Chargé: {filename}"
+    except Exception as e:
+        return None, None, None, f"Err: {e}"
 
 
 # --- EXPORT UNIVERSAL VTT (.dd2vtt) ---
-def export_universal_vtt_named(grid, walls, assets_full, asset_sizes, level_id, custom_name):
-    """Export VTT avec un nom choisi par l'utilisateur."""
+class Base64StreamWriter:
+    """Fichier minimal en écriture seule : encode en base64 au fil de l'eau vers `raw_file`."""
+
+    def __init__(self, raw_file):
+        self.raw_file = raw_file
+        self.pending = b""  # Octets en attente (le base64 travaille par groupes de 3)
+
+    def write(self, data):
+        size = len(data)
+        data = self.pending + bytes(data)
+        cut = len(data) - len(data) % 3
+        self.pending = data[cut:]
+        if cut: self.raw_file.write(base64.b64encode(data[:cut]))
+        return size
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Écrit le reste (avec le padding '=') ; le fichier sous-jacent reste ouvert."""
+        if self.pending: self.raw_file.write(base64.b64encode(self.pending))
+        self.pending = b""
+
+
+class PngStreamWriter:
+    """Encodeur PNG minimal (RVB 8 bits, lignes sans filtre) : l'image arrive bande par bande et part
+    compressée au fil de l'eau vers `raw_file` (fichier ou Base64StreamWriter)."""
+
+    def __init__(self, raw_file, width, height):
+        self.raw_file = raw_file
+        self.width = width
+        self.compressor = zlib.compressobj(EXPORT_PNG_COMPRESSION)
+        raw_file.write(b"\x89PNG\r\n\x1a\n")
+        self.write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def write_chunk(self, chunk_type, data):
+        self.raw_file.write(struct.pack(">I", len(data)) + chunk_type + data
+                            + struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+    def write_rows(self, surface):
+        """Ajoute les lignes de `surface` (de la largeur de l'image) sous celles déjà écrites."""
+        data = pygame.image.tobytes(surface, "RGB")
+        stride = self.width * 3
+        compressed = []
+        for start in range(0, len(data), stride):
+            compressed.append(self.compressor.compress(b"\x00" + data[start:start + stride]))  # Filtre 0
+        compressed = b"".join(compressed)
+        if compressed: self.write_chunk(b"IDAT", compressed)
+
+    def close(self):
+        self.write_chunk(b"IDAT", self.compressor.flush())
+        self.write_chunk(b"IEND", b"")
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def get_export_strip_rows(width_px, max_bytes=EXPORT_STRIP_MAX_BYTES):
+    """Lignes de cases par bande pour rester sous `max_bytes` (au moins une, même pour une carte très large)."""
+    return max(1, max_bytes // (width_px * TILE_SIZE * 7))
+
+
+def iter_level_strips(grid, assets_full, asset_sizes, bounds, strip_rows):
+    """Rendu d'un étage (sans grille, sans UI) par bandes de `strip_rows` lignes de cases, de haut en bas.
+
+    Une seule surface de bande est allouée et réutilisée. Un asset à cheval sur deux bandes est dessiné
+    (clippé) dans chacune : draw_map_region reprend les voisins qui débordent, dans l'ordre du rendu complet.
+    """
+    min_x, min_y, max_x, max_y = bounds
+    width_px = (max_x - min_x + 1) * TILE_SIZE
+    strip = pygame.Surface((width_px, min(strip_rows, max_y - min_y + 1) * TILE_SIZE))
+    for y0 in range(min_y, max_y + 1, strip_rows):
+        y1 = min(y0 + strip_rows - 1, max_y)
+        draw_map_region(strip, grid, assets_full, asset_sizes, (min_x, y0, max_x, y1),
+                        origin=(-min_x * TILE_SIZE, -y0 * TILE_SIZE))
+        yield strip.subsurface((0, 0, width_px, (y1 - y0 + 1) * TILE_SIZE))
+
+
+def write_level_png(raw_file, grid, assets_full, asset_sizes, bounds, progress=None):
+    """Rendu + encodage PNG d'un étage bande par bande : la mémoire ne dépend plus de la hauteur de la carte."""
+    min_x, min_y, max_x, max_y = bounds
+    width_px = (max_x - min_x + 1) * TILE_SIZE
+    height_cells = max_y - min_y + 1
+    strip_rows = get_export_strip_rows(width_px)
+    strip_count = -(-height_cells // strip_rows)
+    png = PngStreamWriter(raw_file, width_px, height_cells * TILE_SIZE)
+    for i, strip in enumerate(iter_level_strips(grid, assets_full, asset_sizes, bounds, strip_rows), 1):
+        png.write_rows(strip)
+        if progress and i < strip_count: progress(f"bande {i + 1}/{strip_count}")
+    png.close()
+
+
+def export_png_named(grid, assets_full, asset_sizes, level_id, custom_name, walls=()):
+    """Export de l'image seule (PNG), même rendu que l'export VTT (`walls` : mêmes bornes que lui)."""
+    if not custom_name.endswith(".png"):
+        custom_name += ".png"
+
+    bounds = get_map_bounds(grid) or get_walls_bounds(walls)
+    if not bounds: return "Carte vide"
+    try:
+        with open(get_local_path(custom_name), 'wb') as f:
+            write_level_png(f, grid, assets_full, asset_sizes, bounds)
+        return f"Export OK: {custom_name}"
+    except Exception as e:
+        return f"Err: {e}"
+
+
+def export_universal_vtt_named(grid, walls, assets_full, asset_sizes, level_id, custom_name, progress=None):
+    """Export VTT avec un nom choisi par l'utilisateur.
+
+    `progress(étape)` est appelé au début de chaque étape longue (export en arrière-plan).
+    """
     if not custom_name.endswith(".dd2vtt"):
         custom_name += ".dd2vtt"
 
-    # 1. Calcul des bornes de la map
-    bounds = get_map_bounds(grid)
+    # 1-3. Bornes de la map et dimensions réelles de l'image exportée (un étage fait uniquement
+    # de murs est exporté sur le fond, à la taille de ses murs)
+    bounds = get_map_bounds(grid) or get_walls_bounds(walls)
     if not bounds: return "Carte vide"
     min_x, min_y, max_x, max_y = bounds
-
-    # 2. Dimensions réelles de l'image exportée
     width_px = (max_x - min_x + 1) * TILE_SIZE
     height_px = (max_y - min_y + 1) * TILE_SIZE
-
-    # 3. Rendu de la map sur une Surface Pygame (sans grille, sans UI)
-    surf = pygame.Surface((width_px, height_px))
-    surf.fill(COLOR_VIEW_BG)  # Fond sombre
-
     # Offsets pour décaler les dessins (car l'image commence à 0,0, pas à min_x, min_y)
     offset_grid_x = min_x * TILE_SIZE
     offset_grid_y = min_y * TILE_SIZE
 
-    # Boucle de dessin standard (reprise de la boucle main)
-    for layer_pass in [LAYER_GROUND, LAYER_OBJECTS, LAYER_TOKENS]:
-        for y in range(min_y, max_y + 1):
-            for x in range(min_x, max_x + 1):
-                if 0 <= y < len(grid) and 0 <= x < len(grid[0]):
-                    cell_stack = grid[y][x]
-                    for item in cell_stack:
-                        if item.get('layer', 0) == layer_pass:
-                            key = item['key']
-                            original = assets_full.get(key)
-                            if original:
-                                # Position relative à l'image exportée
-                                draw_x = (x * TILE_SIZE) - offset_grid_x
-                                draw_y = (y * TILE_SIZE) - offset_grid_y
-
-                                size = asset_sizes.get(key, 1)
-                                offset_draw = get_draw_offset(size)
-                                angle = item['angle']
-
-                                if angle != 0:
-                                    img = pygame.transform.rotate(original, angle)
-                                    rect = img.get_rect(center=(draw_x + offset_draw, draw_y + offset_draw))
-                                    surf.blit(img, rect)
-                                else:
-                                    rect = original.get_rect(center=(draw_x + offset_draw, draw_y + offset_draw))
-                                    surf.blit(original, rect)
-
-    # 4. Conversion de l'image en Base64 (PNG)
-    image_buffer = BytesIO()
-    pygame.image.save(surf, image_buffer, "PNG")
-    b64_image_str = base64.b64encode(image_buffer.getvalue()).decode("utf-8")
-
-    # 5. Conversion des MURS (Walls) pour le format VTT
+    # 4. (Le rendu par bandes et l'encodage PNG -> base64 se font directement dans le fichier à l'étape 7)
+
+    # 5. Conversion des MURS (Walls) pour le format VTT, normalisés (moins de segments à importer et à tester)
     # Le format attend des coordonnées en pixels relatifs à l'image.
+    segments = normalize_wall_segments(walls)
     vtt_walls = []
-    for w in walls:
+    for w in segments:
         # Conversion coordonnées globales -> locales image
         p1 = {
             "x": w['x1'] - offset_grid_x,
@@ -452,19 +2280,342 @@ def export_universal_vtt_named(grid, walls, assets_full, asset_sizes, level_id,
         "line_of_sight": vtt_walls,
         "portals": [],
         "lights": [],
-        "image": f"data:image/png;base64,{b64_image_str}"
+        "image": ""
     }
 
-    # 7. Sauvegarde
+    # 7. Sauvegarde en flux : enveloppe JSON, puis bandes -> PNG -> base64 -> fichier sans image complète
+    # (mêmes octets que json.dump : "image" est la dernière clé et le base64 n'a rien à échapper)
+    envelope = json.dumps(vtt_data)
     path = get_local_path(custom_name)
+    if progress: progress("rendu")
     try:
-        with open(path, 'w') as f:
-            json.dump(vtt_data, f)
+        with open(path, 'wb') as f:
+            f.write(envelope[:-2].encode("utf-8"))
+            f.write(b"data:image/png;base64,")
+            b64_stream = Base64StreamWriter(f)
+            write_level_png(b64_stream, grid, assets_full, asset_sizes, bounds, progress)
+            b64_stream.close()
+            f.write(b'"}')
+        if walls: return f"Export OK: {custom_name} (murs : {len(walls)} -> {len(segments)})"
         return f"Export OK: {custom_name}"
+    except ExportCancelled:
+        os.remove(path)  # Pas de fichier tronqué
+        raise
     except Exception as e:
         return f"Err: {e}"
 
 
+# --- PROFILEUR DE FRAME ---
+# Dict {"samples": {phase: deque}, "frame": {phase: ms}, ...} : main() pose une marque à la fin de
+# chaque phase de la boucle ; le temps écoulé depuis la marque précédente est attribué à cette phase.
+
+def create_frame_profiler():
+    return {"samples": {phase: deque(maxlen=PROFILER_WINDOW) for phase in PROFILER_PHASES},
+            "frame_ms": deque(maxlen=PROFILER_WINDOW), "blits": deque(maxlen=PROFILER_WINDOW),
+            "frame": {}, "frame_start": 0.0, "last_mark": 0.0, "frame_idx": 0, "visible": False,
+            "csv_file": None, "csv_writer": None, "cprofile": None, "lines": [], "lines_time": 0.0,
+            # Consommation CPU : totaux depuis le lancement et fenêtre glissante d'environ une seconde
+            "cpu_start": time.process_time(), "wall_start": time.perf_counter(), "wait_total": 0.0,
+            "cpu_mark": (time.perf_counter(), time.process_time(), 0.0), "cpu_percent": 0.0, "wait_percent": 0.0}
+
+
+def profiler_begin_frame(prof):
+    prof["frame_start"] = prof["last_mark"] = time.perf_counter()
+    prof["frame"] = {}
+    render_stats["map_blits"] = 0
+
+
+def profiler_mark(prof, phase):
+    now = time.perf_counter()
+    prof["frame"][phase] = prof["frame"].get(phase, 0.0) + (now - prof["last_mark"]) * 1000
+    prof["last_mark"] = now
+
+
+def profiler_end_frame(prof, display_rects):
+    """Clôt la frame ; `display_rects` = nombre de zones poussées (0 pour un flip complet)."""
+    frame_ms = (time.perf_counter() - prof["frame_start"]) * 1000
+    phases = [prof["frame"].get(phase, 0.0) for phase in PROFILER_PHASES]
+    for phase, ms in zip(PROFILER_PHASES, phases):
+        prof["samples"][phase].append(ms)
+    prof["frame_ms"].append(frame_ms)
+    prof["blits"].append(render_stats["map_blits"])
+    if prof["csv_writer"]:
+        prof["csv_writer"].writerow([prof["frame_idx"], f"{frame_ms:.3f}"] + [f"{ms:.3f}" for ms in phases]
+                                    + [render_stats["map_blits"], display_rects])
+    prof["frame_idx"] += 1
+
+    now, cpu = time.perf_counter(), time.process_time()
+    mark_wall, mark_cpu, mark_wait = prof["cpu_mark"]
+    if now - mark_wall >= 1.0:
+        prof["cpu_percent"] = (cpu - mark_cpu) / (now - mark_wall) * 100
+        prof["wait_percent"] = (prof["wait_total"] - mark_wait) / (now - mark_wall) * 100
+        prof["cpu_mark"] = (now, cpu, prof["wait_total"])
+
+
+def profiler_add_wait(prof, seconds):
+    """Temps passé bloqué dans l'attente d'un événement (boucle au repos)."""
+    prof["wait_total"] += seconds
+
+
+def profiler_cpu_report(prof):
+    """Bilan de la session : CPU moyen (% d'un cœur) et part du temps passée en attente."""
+    wall = time.perf_counter() - prof["wall_start"]
+    if wall <= 0: return "CPU : -"
+    cpu = (time.process_time() - prof["cpu_start"]) / wall * 100
+    return f"CPU : {cpu:.1f} % d'un cœur en moyenne sur {wall:.0f} s, {prof['wait_total'] / wall * 100:.0f} % en attente"
+
+
+def profiler_summary(values):
+    """(moyenne, p95, max) d'une fenêtre de mesures."""
+    if not values: return 0.0, 0.0, 0.0
+    ordered = sorted(values)
+    return sum(ordered) / len(ordered), ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], ordered[-1]
+
+
+def profiler_toggle_csv(prof):
+    """Démarre / arrête l'enregistrement des temps de chaque frame dans un CSV ; renvoie un message."""
+    if prof["csv_file"]:
+        name = prof["csv_file"].name
+        prof["csv_file"].close()
+        prof["csv_file"] = prof["csv_writer"] = None
+        return f"CSV fermé: {os.path.basename(name)}"
+    name = time.strftime("frames_%Y%m%d_%H%M%S.csv")
+    try:
+        prof["csv_file"] = open(get_local_path(name), 'w', newline='')
+    except Exception as e:
+        return f"Err: {e}"
+    prof["csv_writer"] = csv.writer(prof["csv_file"])
+    prof["csv_writer"].writerow(["frame", "total_ms"] + [f"{phase}_ms" for phase in PROFILER_PHASES]
+                                + ["map_blits", "display_rects"])
+    return f"CSV: {name}"
+
+
+def profiler_toggle_cprofile(prof):
+    """Démarre / arrête une capture cProfile (.prof + top 25 en console) ; renvoie un message."""
+    if prof["cprofile"]:
+        profile = prof["cprofile"]
+        profile.disable()
+        prof["cprofile"] = None
+        name = time.strftime("capture_%Y%m%d_%H%M%S.prof")
+        try:
+            profile.dump_stats(get_local_path(name))
+        except Exception as e:
+            return f"Err: {e}"
+        pstats.Stats(profile).sort_stats("cumulative").print_stats(25)
+        return f"Capture: {name}"
+    prof["cprofile"] = cProfile.Profile()
+    prof["cprofile"].enable()
+    return "Capture cProfile..."
+
+
+def profiler_close(prof):
+    if prof["cprofile"]: profiler_toggle_cprofile(prof)
+    if prof["csv_file"]: profiler_toggle_csv(prof)
+
+
+def draw_profiler_overlay(surface, prof, font, topright):
+    """Tableau des phases (moyenne / p95 / max en ms), FPS, blits et cache ; renvoie son Rect."""
+    now = time.perf_counter()
+    # Le texte n'est recalculé que 4 fois par seconde : l'overlay ne doit pas fausser la mesure
+    if now - prof["lines_time"] > 0.25 or not prof["lines"]:
+        prof["lines_time"] = now
+        mean_frame = profiler_summary(prof["frame_ms"])
+        fps = 1000 / mean_frame[0] if mean_frame[0] else 0
+        texts = [f"{fps:5.1f} FPS   frame {mean_frame[0]:5.1f} / {mean_frame[1]:5.1f} / {mean_frame[2]:5.1f} ms",
+                 "phase        moy     p95     max"]
+        for phase in PROFILER_PHASES:
+            mean, p95, worst = profiler_summary(prof["samples"][phase])
+            texts.append(f"{phase:<10} {mean:6.2f}  {p95:6.2f}  {worst:6.2f}")
+        blits = profiler_summary(prof["blits"])
+        cache = get_rotation_cache_stats()
+        texts.append(f"blits carte {blits[0]:.0f} (max {blits[2]:.0f})")
+        texts.append(f"CPU {prof['cpu_percent']:.0f} %   attente {prof['wait_percent']:.0f} %")
+        texts.append(f"cache rot. {cache['entries']} ({cache['bytes'] // 1024} Ko, {cache['hit_rate'] * 100:.0f} %)")
+        full = get_full_asset_stats()
+        texts.append(f"assets {full['entries']} ({full['bytes'] // 1048576} / {full['budget'] // 1048576} Mo, "
+                     f"{full['evictions']} évictions)")
+        if OPAQUE_ASSETS_24BIT: texts.append(f"opaques 24 bits {full['opaque']} (-{full['opaque_saved'] // 1024} Ko)")
+        if prof["csv_file"]: texts.append("CSV en cours (F4)")
+        if prof["cprofile"]: texts.append("cProfile en cours (F5)")
+        prof["lines"] = [font.render(text, True, COLOR_TEXT) for text in texts]
+
+    lines = prof["lines"]
+    line_h = font.get_linesize()
+    width = max(line.get_width() for line in lines) + 20
+    rect = pygame.Rect(0, 0, width, line_h * len(lines) + 20)
+    rect.topright = topright
+    bg = pygame.Surface(rect.size)
+    bg.set_alpha(210)
+    bg.fill((0, 0, 0))
+    surface.blit(bg, rect)
+    for i, line in enumerate(lines):
+        surface.blit(line, (rect.x + 10, rect.y + 10 + i * line_h))
+    return rect
+
+
+# --- TÂCHES EN ARRIÈRE-PLAN (SAUVEGARDE / EXPORT) ---
+# Une tâche est un dict {"label", "stage", "start", "cancel", "future"}. Un seul thread les exécute dans
+# l'ordre : le travail part d'une copie figée prise dans la boucle principale, qui continue sans attendre.
+# L'export de tous les étages répartit ensuite ses étages sur un pool de processus (export_executor) : le
+# rendu pygame garde le GIL, des threads ne rendraient pas deux étages à la fois. Chaque processus charge
+# les assets une fois (display "dummy") et reste prêt pour l'export suivant.
+background_executor = None
+export_executor = None
+export_cancel = None  # multiprocessing.Event partagé avec les processus du pool
+
+# --- ÉTAT D'UN PROCESSUS DU POOL D'EXPORT ---
+export_worker_assets = None  # (assets_full, asset_sizes), chargés une fois par processus
+export_worker_cancel = None
+
+
+def start_background_job(label, func, *args, cancellable=False):
+    """Soumet `func(job, *args)` au thread de fond ; le résultat (message) est lu via job["future"].
+
+    Une tâche annulable reçoit un threading.Event dans job["cancel"], à consulter entre deux étapes."""
+    global background_executor
+    if background_executor is None:
+        background_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mapdungeon-io")
+    job = {"label": label, "stage": "en attente", "start": time.perf_counter(),
+           "cancel": threading.Event() if cancellable else None}
+    job["future"] = background_executor.submit(func, job, *args)
+    return job
+
+
+def save_project_job(job, snapshot, custom_name):
+    job["stage"] = "écriture"
+    return save_project_snapshot(snapshot, custom_name)
+
+
+def export_vtt_job(job, records, segments, assets_full, asset_sizes, level_id, custom_name):
+    job["stage"] = "préparation"
+    grid = grid_from_records(records)
+    return export_universal_vtt_named(grid, segments, assets_full, asset_sizes, level_id, custom_name,
+                                      progress=lambda stage: job.update(stage=stage))
+
+
+def init_export_worker(cancel_event):
+    """Prépare pygame (un display est requis par convert_alpha) et charge les assets."""
+    global export_worker_assets, export_worker_cancel
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+    assets_full, assets_thumb, asset_sizes, libraries = load_all_assets_from_folder(ASSET_ROOT)
+    export_worker_assets = (assets_full, asset_sizes)
+    export_worker_cancel = cancel_event
+
+
+def export_level_task(records, segments, level_id, custom_name):
+    """Un étage de l'export complet (processus du pool) ; None s'il est annulé (fichier commencé supprimé)."""
+    def check_cancel(stage):
+        if export_worker_cancel.is_set(): raise ExportCancelled()
+
+    assets_full, asset_sizes = export_worker_assets
+    try:
+        check_cancel("préparation")
+        grid = grid_from_records(records)
+        return export_universal_vtt_named(grid, segments, assets_full, asset_sizes, level_id, custom_name,
+                                          progress=check_cancel)
+    except ExportCancelled:
+        return None
+
+
+def get_export_floor(future, level_id, file_name):
+    """Entrée du manifeste pour un étage terminé (ou abandonné avant son départ)."""
+    if future.cancelled(): return {"level": level_id, "status": "annulé"}
+    try:
+        msg = future.result()
+    except Exception as e:
+        msg = f"Err: {e}"
+    if msg is None: return {"level": level_id, "status": "annulé"}
+    if msg.startswith("Export OK"): return {"level": level_id, "status": "ok", "file": file_name}
+    if msg == "Carte vide": return {"level": level_id, "status": "vide"}
+    return {"level": level_id, "status": "erreur", "message": msg}
+
+
+def export_all_levels_job(job, snapshot, base_name):
+    """Exporte chaque étage dans `base_name`_etageN.dd2vtt, puis écrit `base_name`_manifest.json."""
+    global export_executor, export_cancel
+    if export_executor is None:
+        # "spawn" : un fork copierait la fenêtre SDL et les threads de l'éditeur
+        context = multiprocessing.get_context("spawn")
+        export_cancel = context.Event()
+        export_executor = ProcessPoolExecutor(max_workers=EXPORT_WORKERS, mp_context=context,
+                                              initializer=init_export_worker, initargs=(export_cancel,))
+    export_cancel.clear()  # Une seule tâche de fond à la fois : l'Event sert à chaque export
+    levels_records, walls = snapshot
+    levels = sorted(levels_records)
+    job["stage"] = f"0/{len(levels)} étages"
+
+    futures = {}
+    for level_id in levels:
+        file_name = f"{base_name}_etage{level_id}.dd2vtt"
+        future = export_executor.submit(export_level_task, levels_records[level_id], walls.get(str(level_id), []),
+                                        level_id, file_name)
+        futures[future] = (level_id, file_name)
+
+    floors = []
+    pending = set(futures)
+    while pending:
+        finished, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+        if job["cancel"].is_set() and not export_cancel.is_set():
+            # Les étages pas encore partis sont abandonnés, ceux en cours s'arrêtent à leur prochaine étape
+            export_cancel.set()
+            for future in pending: future.cancel()
+        for future in finished:
+            floors.append(get_export_floor(future, *futures[future]))
+            job["stage"] = f"{len(floors)}/{len(levels)} étages"
+
+    # Le manifeste est écrit même après une annulation : il dit quels fichiers sont complets
+    floors.sort(key=lambda floor: floor["level"])
+    exported = sum(1 for floor in floors if floor["status"] == "ok")
+    manifest_name = f"{base_name}_manifest.json"
+    manifest = {"format": "dd2vtt", "pixels_per_grid": TILE_SIZE, "cancelled": job["cancel"].is_set(),
+                "floors": floors}
+    try:
+        with open(get_local_path(manifest_name), 'w') as f:
+            json.dump(manifest, f, indent=2)
+    except Exception as e:
+        return f"Err: {e}"
+    if job["cancel"].is_set(): return f"Export annulé : {exported}/{len(levels)} étages ({manifest_name})"
+    return f"Export OK: {exported}/{len(levels)} étages ({manifest_name})"
+
+
+def collect_export_assets(assets_full, keys):
+    """Pleines tailles des assets à exporter, chargées dans le thread principal avant le départ. L'export
+    garde ses références : une éviction pendant l'export ne libère la surface qu'à la fin de celui-ci."""
+    export_assets = {}
+    for key in keys:
+        surf = get_full_asset(assets_full, key)
+        if surf is not None: export_assets[key] = surf
+    return export_assets
+
+
+def start_save_job(levels_data, walls_data, custom_name, source=None):
+    return start_background_job("Sauvegarde", save_project_job, snapshot_project(levels_data, walls_data, source),
+                                custom_name)
+
+
+def start_export_job(grid, segments, assets_full, asset_sizes, level_id, custom_name):
+    records = snapshot_level_records(grid)
+    export_assets = collect_export_assets(assets_full, {record[2] for record in records})
+    return start_background_job("Export", export_vtt_job, records, list(segments), export_assets, asset_sizes,
+                                level_id, custom_name)
+
+
+def start_export_all_job(levels_data, walls_data, source, base_name):
+    """Export de tous les étages (y compris ceux pas encore construits), annulable. Les processus du pool
+    dessinent avec leurs propres assets : seule la copie figée du projet leur est envoyée."""
+    if base_name.endswith(".dd2vtt"): base_name = base_name[:-len(".dd2vtt")]
+    return start_background_job("Export des étages", export_all_levels_job,
+                                snapshot_project(levels_data, walls_data, source), base_name, cancellable=True)
+
+
+def wait_background_jobs():
+    """Attend la fin des tâches en cours (à la fermeture : une sauvegarde ne doit pas être coupée)."""
+    if background_executor is not None: background_executor.shutdown(wait=True)
+    if export_executor is not None: export_executor.shutdown(wait=True)
+
+
 # --- MAIN LOOP ---
 
 def main():
@@ -490,11 +2641,12 @@ def main():
 
     # Outils Murs
     wall_start_point = None
+    wall_band_start = None
 
     # --- VARIABLES POUR LA SAISIE DE TEXTE ---
     input_active = False
     input_text = ""
-    input_action = None  # "SAVE" ou "EXPORT"
+    input_action = None  # "SAVE", "EXPORT" ou "EXPORT_ALL"
 
     # CURSEUR
     cursor_pos = 0
@@ -511,7 +2663,8 @@ def main():
 
     input_font = pygame.font.SysFont(fantasy_font_str, 24, bold=True)
 
-    assets_full, assets_thumb, asset_sizes, libraries = load_all_assets_from_folder(ASSET_ROOT)
+    assets_full, assets_thumb, asset_sizes, libraries = load_all_assets_from_folder(
+        ASSET_ROOT, progress_callback=lambda done, total: draw_loading_screen(screen, title_font, done, total))
 
     if not libraries:
         libraries = {"Vide": []}
@@ -522,24 +2675,25 @@ def main():
         current_lib_name = lib_names[0]
 
     levels_data = {}
+    project_source = None  # Projet ouvert : étages construits à la demande
     current_level_idx = 0
-    edit_map_h = current_h - MENU_HEIGHT
-    edit_map_w = current_w - UI_WIDTH
-    levels_data[0] = resize_grid(None, edit_map_w, edit_map_h)
+    levels_data[0] = create_grid()
     grid = levels_data[0]
 
-    walls_data[0] = []
+    walls_data[0] = create_wall_set()
 
     tool_angles = {}
     for key in assets_full.keys(): tool_angles[key] = 0
 
     dragging_texture_key = None
     is_dragging = False
+    picked_from_map = False
     drag_angle = 0
     scroll_y = 0
 
     system_msg = ""
     system_msg_timer = 0
+    background_jobs = []  # Sauvegardes / exports en cours, dans l'ordre de soumission
 
     # Modes Outils
     TOOL_MODE_PLACE = 0
@@ -551,10 +2705,40 @@ def main():
     COLS_PER_ROW = 4
     available_width = UI_WIDTH - 20
     col_step = available_width // COLS_PER_ROW
+    palette_sheets = {}  # Catégorie -> planche prérendue (voir PALETTE)
+
+    # Composite hors-écran de la carte (tuiles + grille), redessiné uniquement là où ça change
+    map_surface = None
+    map_surface_state = None
+    map_full_redraw = True
+    dirty_cells = []
+    prev_transient_rects = []
+    prev_overlay_open = False
+
+    # Caméra (glisser clic milieu, molette sur la carte) ; position de la vue lors du dernier dessin
+    camera = create_camera()
+    map_surface_camera = None
+    pan_last = None
+
+    # Mini-carte (touche M), mise à jour avec les mêmes cellules modifiées que le composite
+    minimap = create_minimap()
+    show_minimap = True
+
+    # Interface retenue : Rects recalculés au changement de layout, widgets redessinés au changement d'état
+    current_layout_key = None
+    ui_drawn_states = {}
+    ui_drawn_layout = None
+
+    profiler = create_frame_profiler()
+    profiler_font = pygame.font.SysFont("consolas, dejavusansmono, monospace", 12)
+
+    # Événement qui a réveillé la boucle au repos (traité en tête de la frame suivante)
+    woken_event = None
 
     running = True
 
     while running:
+        profiler_begin_frame(profiler)
         mx, my = pygame.mouse.get_pos()
         current_time = pygame.time.get_ticks()
 
@@ -573,79 +2757,80 @@ def main():
             map_view_height = current_h - MENU_HEIGHT
             ui_offset_x = 0
             ui_offset_y = MENU_HEIGHT
+        view_origin = (ui_offset_x, ui_offset_y)
 
         # --- CALCUL AUTOMATIQUE DU LAYOUT (AVANT L'EVENT LOOP) ---
         # NOTE IMPORTANTE : Tout calcul de Rect se fait ICI pour être sûr que
         # le dessin et le clic utilisent EXACTEMENT les mêmes coordonnées.
+        # Les Rects ne changent qu'avec la taille de la fenêtre ou le mode immersion.
+        layout_key = (current_w, current_h, is_immersion_mode)
+        if layout_key != current_layout_key:
+            current_layout_key = layout_key
+
+            # 1. MENU HAUT
+            nb_btns = 7
+            spacing = 5
+            btn_w = (current_w - 20 - (spacing * (nb_btns - 1))) // nb_btns
+
+            btns_top = []
+            for i in range(nb_btns):
+                btns_top.append(pygame.Rect(10 + i * (btn_w + spacing), 5, btn_w, MENU_HEIGHT - 10))
+
+            btn_save, btn_load, btn_export, btn_undo, btn_redo, btn_immersion, btn_quit = btns_top
+
+            # BOUTON DE SORTIE IMMERSION
+            btn_exit_immersion = pygame.Rect(current_w - 40, 10, 30, 30)
+
+            # 2. UI LATERALE
+            work_width = UI_WIDTH - (UI_MARGIN * 2)
+            ui_x = map_view_width
+            current_y_ui = MENU_HEIGHT + UI_GAP_Y
+
+            # Ligne 1 : NIVEAUX
+            lvl_text_width = (work_width - 2 * UI_GAP_X) // 3
+            btn_lvl_w = lvl_text_width
+
+            btn_lvl_down = pygame.Rect(ui_x + UI_MARGIN, current_y_ui, btn_lvl_w, BTN_HEIGHT)
+            lvl_text_rect = pygame.Rect(btn_lvl_down.right + UI_GAP_X, current_y_ui, lvl_text_width, BTN_HEIGHT)
+            btn_lvl_up = pygame.Rect(lvl_text_rect.right + UI_GAP_X, current_y_ui, btn_lvl_w, BTN_HEIGHT)
+
+            current_y_ui += BTN_HEIGHT + UI_GAP_Y
+
+            # Ligne 2 : Couches
+            btn_layer_w = (work_width - 2 * UI_GAP_X) // 3
+            btn_layer_ground = pygame.Rect(ui_x + UI_MARGIN, current_y_ui, btn_layer_w, BTN_HEIGHT)
+            btn_layer_obj = pygame.Rect(ui_x + UI_MARGIN + btn_layer_w + UI_GAP_X, current_y_ui, btn_layer_w, BTN_HEIGHT)
+            btn_layer_token = pygame.Rect(ui_x + UI_MARGIN + 2 * (btn_layer_w + UI_GAP_X), current_y_ui, btn_layer_w,
+                                          BTN_HEIGHT)
+            current_y_ui += BTN_HEIGHT + UI_GAP_Y
+
+            # Ligne 3 : Outils 1
+            btn_tool_w = (work_width - 2 * UI_GAP_X) // 3
+            btn_mode_place = pygame.Rect(ui_x + UI_MARGIN, current_y_ui, btn_tool_w, BTN_HEIGHT)
+            btn_mode_erase = pygame.Rect(ui_x + UI_MARGIN + btn_tool_w + UI_GAP_X, current_y_ui, btn_tool_w, BTN_HEIGHT)
+            btn_tool_rotate = pygame.Rect(ui_x + UI_MARGIN + 2 * (btn_tool_w + UI_GAP_X), current_y_ui, btn_tool_w,
+                                          BTN_HEIGHT)
+            current_y_ui += BTN_HEIGHT + UI_GAP_Y
+
+            # Ligne 4 : Outils 2
+            btn_tool_wall = pygame.Rect(ui_x + UI_MARGIN, current_y_ui, work_width, BTN_HEIGHT)
+            current_y_ui += BTN_HEIGHT + UI_GAP_Y
+
+            # Ligne 5 : Dropdown
+            btn_category_dropdown = pygame.Rect(ui_x + UI_MARGIN, current_y_ui, work_width, BTN_HEIGHT)
+            current_y_ui += BTN_HEIGHT + UI_GAP_Y
 
-        # 1. MENU HAUT
-        nb_btns = 7
-        spacing = 5
-        btn_w = (current_w - 20 - (spacing * (nb_btns - 1))) // nb_btns
-
-        btns_top = []
-        for i in range(nb_btns):
-            btns_top.append(pygame.Rect(10 + i * (btn_w + spacing), 5, btn_w, MENU_HEIGHT - 10))
-
-        btn_save, btn_load, btn_export, btn_undo, btn_redo, btn_immersion, btn_quit = btns_top
-
-        # BOUTON DE SORTIE IMMERSION
-        btn_exit_immersion = pygame.Rect(current_w - 40, 10, 30, 30)
-
-        # 2. UI LATERALE
-        work_width = UI_WIDTH - (UI_MARGIN * 2)
-        ui_x = map_view_width
-        current_y_ui = MENU_HEIGHT + UI_GAP_Y
-
-        # Ligne 1 : NIVEAUX
-        lvl_text_width = (work_width - 2 * UI_GAP_X) // 3
-        btn_lvl_w = lvl_text_width
-
-        btn_lvl_down = pygame.Rect(ui_x + UI_MARGIN, current_y_ui, btn_lvl_w, BTN_HEIGHT)
-        lvl_text_rect = pygame.Rect(btn_lvl_down.right + UI_GAP_X, current_y_ui, lvl_text_width, BTN_HEIGHT)
-        btn_lvl_up = pygame.Rect(lvl_text_rect.right + UI_GAP_X, current_y_ui, btn_lvl_w, BTN_HEIGHT)
-
-        current_y_ui += BTN_HEIGHT + UI_GAP_Y
-
-        # Ligne 2 : Couches
-        btn_layer_w = (work_width - 2 * UI_GAP_X) // 3
-        btn_layer_ground = pygame.Rect(ui_x + UI_MARGIN, current_y_ui, btn_layer_w, BTN_HEIGHT)
-        btn_layer_obj = pygame.Rect(ui_x + UI_MARGIN + btn_layer_w + UI_GAP_X, current_y_ui, btn_layer_w, BTN_HEIGHT)
-        btn_layer_token = pygame.Rect(ui_x + UI_MARGIN + 2 * (btn_layer_w + UI_GAP_X), current_y_ui, btn_layer_w,
-                                      BTN_HEIGHT)
-        current_y_ui += BTN_HEIGHT + UI_GAP_Y
-
-        # Ligne 3 : Outils 1
-        btn_tool_w = (work_width - 2 * UI_GAP_X) // 3
-        btn_mode_place = pygame.Rect(ui_x + UI_MARGIN, current_y_ui, btn_tool_w, BTN_HEIGHT)
-        btn_mode_erase = pygame.Rect(ui_x + UI_MARGIN + btn_tool_w + UI_GAP_X, current_y_ui, btn_tool_w, BTN_HEIGHT)
-        btn_tool_rotate = pygame.Rect(ui_x + UI_MARGIN + 2 * (btn_tool_w + UI_GAP_X), current_y_ui, btn_tool_w,
-                                      BTN_HEIGHT)
-        current_y_ui += BTN_HEIGHT + UI_GAP_Y
-
-        # Ligne 4 : Outils 2
-        btn_tool_wall = pygame.Rect(ui_x + UI_MARGIN, current_y_ui, work_width, BTN_HEIGHT)
-        current_y_ui += BTN_HEIGHT + UI_GAP_Y
-
-        # Ligne 5 : Dropdown
-        btn_category_dropdown = pygame.Rect(ui_x + UI_MARGIN, current_y_ui, work_width, BTN_HEIGHT)
-        current_y_ui += BTN_HEIGHT + UI_GAP_Y
-
-        # TEXTURES
-        start_y_tex = current_y_ui
-
-        # 3. MODAL INPUT
-        modal_w, modal_h = 400, 200
-        modal_x = (current_w - modal_w) // 2
-        modal_y = (current_h - modal_h) // 2
+            # TEXTURES
+            start_y_tex = current_y_ui
 
-        input_box_rect = pygame.Rect(modal_x + 40, modal_y + 80, modal_w - 80, 40)
-        btn_cancel_rect = pygame.Rect(modal_x + 20, modal_y + 140, 170, 40)
-        btn_ok_rect = pygame.Rect(modal_x + 210, modal_y + 140, 170, 40)
+            # 3. MODAL INPUT
+            modal_w, modal_h = 400, 200
+            modal_x = (current_w - modal_w) // 2
+            modal_y = (current_h - modal_h) // 2
 
-        # 4. GRID DATA
-        grid_h = len(grid)
-        grid_w = len(grid[0]) if grid_h > 0 else 0
+            input_box_rect = pygame.Rect(modal_x + 40, modal_y + 80, modal_w - 80, 40)
+            btn_cancel_rect = pygame.Rect(modal_x + 20, modal_y + 140, 170, 40)
+            btn_ok_rect = pygame.Rect(modal_x + 210, modal_y + 140, 170, 40)
 
         options_to_show = [n for n in lib_names if n != current_lib_name]
         current_textures = libraries.get(current_lib_name, [])
@@ -655,17 +2840,42 @@ def main():
         nb_rows = (len(current_textures) + COLS_PER_ROW - 1) // COLS_PER_ROW
         content_h_px = nb_rows * 74
         max_scroll_val = max(0, content_h_px - view_h_px + 20)
+        profiler_mark(profiler, "layout")
 
-        for event in pygame.event.get():
+        events = pygame.event.get()
+        if woken_event:
+            events.insert(0, woken_event)
+            woken_event = None
+        for event in events:
             if event.type == pygame.QUIT:
                 running = False
 
             elif event.type == pygame.VIDEORESIZE:
                 current_w, current_h = event.w, event.h
                 screen = pygame.display.set_mode((current_w, current_h), pygame.RESIZABLE)
-                if not is_immersion_mode:
-                    grid = resize_grid(grid, current_w - UI_WIDTH, current_h - MENU_HEIGHT)
-                    levels_data[current_level_idx] = grid
+
+            # PROFILEUR : F3 affichage, F4 enregistrement CSV, F5 capture cProfile
+            elif event.type == pygame.KEYDOWN and not input_active and event.key in (pygame.K_F3, pygame.K_F4,
+                                                                                     pygame.K_F5):
+                if event.key == pygame.K_F3:
+                    profiler["visible"] = not profiler["visible"]
+                    map_full_redraw = True
+                else:
+                    toggle = profiler_toggle_csv if event.key == pygame.K_F4 else profiler_toggle_cprofile
+                    system_msg = toggle(profiler)
+                    system_msg_timer = current_time + 3000
+
+            # Échap (hors saisie) : annule les exports de tous les étages en cours ou en attente
+            elif event.type == pygame.KEYDOWN and not input_active and event.key == pygame.K_ESCAPE:
+                cancelled = [job for job in background_jobs if job["cancel"] and not job["cancel"].is_set()]
+                for job in cancelled: job["cancel"].set()
+                if cancelled:
+                    system_msg = "Annulation de l'export..."
+                    system_msg_timer = current_time + 1000
+
+            elif event.type == pygame.KEYDOWN and not input_active and event.key == pygame.K_m:
+                show_minimap = not show_minimap
+                minimap["stale"] = True  # Les modifications faites pendant qu'elle était cachée
 
             # --- GESTION SAISIE TEXTE ---
             elif event.type == pygame.KEYDOWN and input_active:
@@ -674,13 +2884,16 @@ def main():
                     if input_text.strip() != "":
                         if input_action == "SAVE":
                             levels_data[current_level_idx] = grid
-                            system_msg = save_project_named(levels_data, walls_data, input_text)
+                            background_jobs.append(start_save_job(levels_data, walls_data, input_text, project_source))
                         elif input_action == "EXPORT":
                             levels_data[current_level_idx] = grid
-                            system_msg = export_universal_vtt_named(grid, walls_data.get(current_level_idx, []),
+                            background_jobs.append(start_export_job(grid, walls_data[current_level_idx]["segments"],
                                                                     assets_full, asset_sizes, current_level_idx,
-                                                                    input_text)
-                        system_msg_timer = current_time + 3000
+                                                                    input_text))
+                        elif input_action == "EXPORT_ALL":
+                            levels_data[current_level_idx] = grid
+                            background_jobs.append(start_export_all_job(levels_data, walls_data, project_source,
+                                                                        input_text))
                     input_active = False
                     input_text = ""
                     input_action = None
@@ -728,13 +2941,17 @@ def main():
                             if input_text.strip() != "":
                                 if input_action == "SAVE":
                                     levels_data[current_level_idx] = grid
-                                    system_msg = save_project_named(levels_data, walls_data, input_text)
+                                    background_jobs.append(start_save_job(levels_data, walls_data, input_text, project_source))
                                 elif input_action == "EXPORT":
                                     levels_data[current_level_idx] = grid
-                                    system_msg = export_universal_vtt_named(grid, walls_data.get(current_level_idx, []),
+                                    background_jobs.append(start_export_job(grid,
+                                                                            walls_data[current_level_idx]["segments"],
                                                                             assets_full, asset_sizes, current_level_idx,
-                                                                            input_text)
-                                system_msg_timer = current_time + 3000
+                                                                            input_text))
+                                elif input_action == "EXPORT_ALL":
+                                    levels_data[current_level_idx] = grid
+                                    background_jobs.append(start_export_all_job(levels_data, walls_data,
+                                                                                project_source, input_text))
                             input_active = False
                             input_text = ""
                             input_action = None
@@ -766,21 +2983,18 @@ def main():
                         for i, f_name in enumerate(file_list_cache):
                             f_rect = pygame.Rect(menu_x + 20, start_y_files + i * 50, menu_w - 40, 40)
                             if f_rect.collidepoint(mx, my):
-                                loaded_lvls, loaded_walls, msg = load_project_file(f_name, current_w - UI_WIDTH,
-                                                                                   current_h - MENU_HEIGHT)
+                                loaded_lvls, loaded_walls, loaded_source, msg = open_project_file(f_name)
                                 system_msg = msg
                                 system_msg_timer = current_time + 3000
-                                if loaded_lvls:
+                                if loaded_lvls is not None:
                                     levels_data = loaded_lvls
+                                    walls_data = loaded_walls
+                                    project_source = loaded_source
                                     current_level_idx = 0
-                                    walls_data = {}
-                                    for k, v in loaded_walls.items(): walls_data[int(k)] = v
-                                    if 0 not in levels_data: levels_data[0] = resize_grid(None, current_w - UI_WIDTH,
-                                                                                          current_h - MENU_HEIGHT)
-                                    if 0 not in walls_data: walls_data[0] = []
                                     grid = levels_data[current_level_idx]
-                                    undo_stack.clear();
-                                    redo_stack.clear()
+                                    camera = create_camera()
+                                    minimap["stale"] = True
+                                    map_full_redraw = True
                                 is_file_menu_open = False
                         continue
 
@@ -820,22 +3034,20 @@ def main():
                             is_file_menu_open = True
 
                         elif btn_export.collidepoint(mx, my):
-                            # ACTIVER INPUT MODE POUR EXPORT
+                            # ACTIVER INPUT MODE POUR EXPORT (Maj + clic : tous les étages)
                             input_active = True
-                            input_action = "EXPORT"
+                            input_action = "EXPORT_ALL" if pygame.key.get_mods() & pygame.KMOD_SHIFT else "EXPORT"
                             input_text = "map_export"
                             cursor_pos = len(input_text)
 
                         elif btn_undo.collidepoint(mx, my):
-                            grid, walls_data[current_level_idx] = perform_undo(grid,
-                                                                               walls_data.get(current_level_idx, []))
-                            levels_data[current_level_idx] = grid
+                            dirty_cells.extend(perform_undo(grid, walls_data[current_level_idx],
+                                                            asset_sizes))
                             system_msg = "Annulé";
                             system_msg_timer = current_time + 1000
                         elif btn_redo.collidepoint(mx, my):
-                            grid, walls_data[current_level_idx] = perform_redo(grid,
-                                                                               walls_data.get(current_level_idx, []))
-                            levels_data[current_level_idx] = grid
+                            dirty_cells.extend(perform_redo(grid, walls_data[current_level_idx],
+                                                            asset_sizes))
                             system_msg = "Rétabli";
                             system_msg_timer = current_time + 1000
                         elif btn_immersion.collidepoint(mx, my):
@@ -843,44 +3055,56 @@ def main():
                         elif btn_quit.collidepoint(mx, my):
                             running = False
 
+                    # MINI-CARTE : centre la vue sur le point cliqué
+                    elif show_minimap and not is_immersion_mode and minimap["screen_rect"] \
+                            and minimap["screen_rect"].collidepoint(mx, my):
+                        camera_center_on(camera, *minimap_to_world(minimap, mx, my), map_view_width, map_view_height)
+
                     # MAP AREA
                     elif mx < map_view_width and not is_immersion_mode:
+                        # Tout passe par la caméra : pixel carte sous la souris
+                        world_x, world_y = camera_screen_to_world(camera, mx, my, view_origin)
+                        pick_x, pick_y = math.floor(world_x), math.floor(world_y)
 
                         if current_tool_mode == TOOL_MODE_WALL:
-                            grid_x = round((mx - ui_offset_x) / TILE_SIZE) * TILE_SIZE + ui_offset_x
-                            grid_y = round((my - ui_offset_y) / TILE_SIZE) * TILE_SIZE + ui_offset_y
-                            wall_start_point = (grid_x, grid_y)
+                            # Accroche au coin de cellule le plus proche (coordonnées carte)
+                            wall_start_point = (round(world_x / TILE_SIZE) * TILE_SIZE,
+                                                round(world_y / TILE_SIZE) * TILE_SIZE)
 
                         elif current_tool_mode == TOOL_MODE_ERASE:
-                            save_history(grid, walls_data.get(current_level_idx, []))
                             something_deleted = False
-                            curr_walls = walls_data.get(current_level_idx, [])
-                            for i in range(len(curr_walls) - 1, -1, -1):
-                                w = curr_walls[i]
-                                dist = distance_point_to_segment(mx, my - ui_offset_y, w['x1'], w['y1'], w['x2'],
-                                                                 w['y2'])
-                                if dist < 10:
-                                    curr_walls.pop(i)
-                                    something_deleted = True
-                                    break
+                            curr_walls = walls_data[current_level_idx]
+                            w = find_nearest_wall(curr_walls, world_x, world_y, WALL_PICK_DISTANCE / camera["zoom"])
+                            if w:
+                                ((i, _),) = wall_set_indices(curr_walls, [w])
+                                wall_set_pop(curr_walls, i)
+                                record_history(grid, "erase", [("remove_wall", i, w)], current_time)
+                                dirty_cells.append(get_wall_cells(w))
+                                something_deleted = True
                             if not something_deleted:
-                                hit = get_tile_at_pixel(grid, mx, my, assets_full, asset_sizes, offset_y_ui=ui_offset_y,
+                                hit = get_tile_at_pixel(grid, pick_x, pick_y, assets_full, asset_sizes,
                                                         target_layer=current_layer)
                                 if hit:
-                                    tx, ty, _, idx = hit
-                                    if grid[ty][tx][idx].get('layer', 0) == current_layer:
-                                        grid[ty][tx].pop(idx)
+                                    tx, ty, item, idx = hit
+                                    if item.get('layer', 0) == current_layer:
+                                        grid_remove_item(grid, tx, ty, idx, asset_sizes)
+                                        record_history(grid, "erase", [("remove_item", tx, ty, idx, item)],
+                                                       current_time)
+                                        dirty_cells.append(
+                                            get_item_footprint(tx, ty, asset_sizes.get(item['key'], 1)))
 
                         elif current_tool_mode == TOOL_MODE_PLACE:
-                            hit = get_tile_at_pixel(grid, mx, my, assets_full, asset_sizes, offset_y_ui=ui_offset_y,
+                            hit = get_tile_at_pixel(grid, pick_x, pick_y, assets_full, asset_sizes,
                                                     target_layer=current_layer)
                             if hit:
-                                save_history(grid, walls_data.get(current_level_idx, []))
                                 tx, ty, item, idx = hit
                                 dragging_texture_key = item['key']
                                 drag_angle = item['angle']
                                 is_dragging = True
-                                grid[ty][tx].pop(idx)
+                                grid_remove_item(grid, tx, ty, idx, asset_sizes)
+                                record_history(grid, "pickup", [("remove_item", tx, ty, idx, item)], current_time)
+                                picked_from_map = True
+                                dirty_cells.append(get_item_footprint(tx, ty, asset_sizes.get(item['key'], 1)))
                             elif dragging_texture_key is not None:
                                 is_dragging = True
 
@@ -890,24 +3114,18 @@ def main():
                             new_level = current_level_idx + 1
                             levels_data[current_level_idx] = grid
                             current_level_idx = new_level
-                            if current_level_idx not in levels_data: levels_data[current_level_idx] = resize_grid(None,
-                                                                                                                  map_view_width,
-                                                                                                                  map_view_height)
-                            if current_level_idx not in walls_data: walls_data[current_level_idx] = []
+                            stream_levels(levels_data, walls_data, project_source, current_level_idx)
                             grid = levels_data[current_level_idx]
-                            undo_stack.clear();
-                            redo_stack.clear()
+                            minimap["stale"] = True
+                            map_full_redraw = True
                         elif btn_lvl_down.collidepoint(mx, my):
                             new_level = current_level_idx - 1
                             levels_data[current_level_idx] = grid
                             current_level_idx = new_level
-                            if current_level_idx not in levels_data: levels_data[current_level_idx] = resize_grid(None,
-                                                                                                                  map_view_width,
-                                                                                                                  map_view_height)
-                            if current_level_idx not in walls_data: walls_data[current_level_idx] = []
+                            stream_levels(levels_data, walls_data, project_source, current_level_idx)
                             grid = levels_data[current_level_idx]
-                            undo_stack.clear();
-                            redo_stack.clear()
+                            minimap["stale"] = True
+                            map_full_redraw = True
 
                         elif btn_layer_ground.collidepoint(mx, my):
                             current_layer = LAYER_GROUND
@@ -925,27 +3143,28 @@ def main():
                                 drag_angle = (drag_angle - 90) % 360
                                 tool_angles[dragging_texture_key] = (tool_angles.get(dragging_texture_key,
                                                                                      0) - 90) % 360
+                                palette_sheets_invalidate(palette_sheets, dragging_texture_key)
                         elif btn_tool_wall.collidepoint(mx, my):
                             current_tool_mode = TOOL_MODE_WALL
 
                         elif btn_category_dropdown.collidepoint(mx, my):
                             is_category_menu_open = not is_category_menu_open
 
-                        col, row = 0, 0
-                        for tex_key in current_textures:
-                            bx = ui_x + 10 + col * col_step + (col_step - 64) // 2
-                            by = start_y_tex + row * 74 + scroll_y
-                            if start_y_tex <= by < current_h:
-                                icon_rect = pygame.Rect(bx, by, 64, 64)
-                                if icon_rect.collidepoint(mx, my):
-                                    dragging_texture_key = tex_key
-                                    current_tool_mode = TOOL_MODE_PLACE
-                                    drag_angle = tool_angles.get(tex_key, 0)
-                                    is_dragging = True
-                            col += 1
-                            if col >= COLS_PER_ROW:
-                                col = 0;
-                                row += 1
+                        # Icône sous la souris, par calcul (seules les icônes entièrement sous l'en-tête)
+                        sheet = get_palette_sheet(palette_sheets, current_lib_name, current_textures, COLS_PER_ROW,
+                                                  col_step)
+                        tex_index = palette_index_at(sheet, mx - ui_x, my - start_y_tex - scroll_y)
+                        if tex_index is not None and palette_icon_pos(sheet, tex_index)[1] + scroll_y >= 0:
+                            tex_key = current_textures[tex_index]
+                            dragging_texture_key = tex_key
+                            current_tool_mode = TOOL_MODE_PLACE
+                            drag_angle = tool_angles.get(tex_key, 0)
+                            is_dragging = True
+
+                # SELECTION DE MURS A L'ELASTIQUE (Gomme + clic droit glissé)
+                elif event.button == 3 and current_tool_mode == TOOL_MODE_ERASE and mx < map_view_width \
+                        and my > MENU_HEIGHT and not input_active and not is_immersion_mode:
+                    wall_band_start = (mx, my)
 
                 # SCROLL UP
                 elif event.button == 4 and mx > map_view_width and not input_active:
@@ -955,42 +3174,87 @@ def main():
                 elif event.button == 5 and mx > map_view_width and not input_active:
                     scroll_y = max(-max_scroll_val, scroll_y - 30)
 
+                # CAMERA : glisser au clic milieu, zoom à la molette (sur la carte)
+                elif event.button in (2, 4, 5) and mx < map_view_width and my >= ui_offset_y \
+                        and not input_active and not is_file_menu_open:
+                    if event.button == 2:
+                        pan_last = (mx, my)
+                    else:
+                        camera_zoom_at(camera, 1 if event.button == 4 else -1, mx, my, view_origin)
+
+            elif event.type == pygame.MOUSEMOTION and pan_last:
+                camera_pan(camera, event.pos[0] - pan_last[0], event.pos[1] - pan_last[1])
+                pan_last = event.pos
+
             elif event.type == pygame.MOUSEBUTTONUP:
-                if event.button == 1:
+                if event.button == 2:
+                    pan_last = None
+
+                elif event.button == 3 and wall_band_start:
+                    band_x0, band_y0 = camera_screen_to_world(camera, min(wall_band_start[0], mx),
+                                                              min(wall_band_start[1], my), view_origin)
+                    band_x1, band_y1 = camera_screen_to_world(camera, max(wall_band_start[0], mx),
+                                                              max(wall_band_start[1], my), view_origin)
+                    band = pygame.Rect(math.floor(band_x0), math.floor(band_y0),
+                                       math.ceil(band_x1) - math.floor(band_x0), math.ceil(band_y1) - math.floor(band_y0))
+                    curr_walls = walls_data[current_level_idx]
+                    # Suppression des plus grands index d'abord : l'annulation les réinsère dans l'ordre
+                    selected = wall_set_indices(curr_walls, walls_inside_rect(curr_walls, band))
+                    ops = []
+                    for i, w in reversed(selected):
+                        wall_set_pop(curr_walls, i)
+                        ops.append(("remove_wall", i, w))
+                        dirty_cells.append(get_wall_cells(w))
+                    record_history(grid, "erase_walls", ops, current_time)
+                    if ops:
+                        system_msg = f"{len(ops)} murs supprimés"
+                        system_msg_timer = current_time + 1500
+                    wall_band_start = None
+
+                elif event.button == 1:
                     is_dragging = False
+                    # Déposer une tuile ramassée sur la carte = un seul déplacement dans l'historique
+                    merge_with_pickup = picked_from_map
+                    picked_from_map = False
 
                     if input_active:
                         continue
 
                     if current_tool_mode == TOOL_MODE_WALL and wall_start_point:
                         if not is_immersion_mode and mx < map_view_width:
-                            save_history(grid, walls_data.get(current_level_idx, []))
-                            end_x = round((mx - ui_offset_x) / TILE_SIZE) * TILE_SIZE + ui_offset_x
-                            end_y = round((my - ui_offset_y) / TILE_SIZE) * TILE_SIZE + ui_offset_y
-
-                            if current_level_idx not in walls_data: walls_data[current_level_idx] = []
-                            walls_data[current_level_idx].append({
-                                'x1': wall_start_point[0], 'y1': wall_start_point[1] - ui_offset_y,
-                                'x2': end_x, 'y2': end_y - ui_offset_y
-                            })
+                            world_x, world_y = camera_screen_to_world(camera, mx, my, view_origin)
+                            end_x = round(world_x / TILE_SIZE) * TILE_SIZE
+                            end_y = round(world_y / TILE_SIZE) * TILE_SIZE
+
+                            curr_walls = walls_data[current_level_idx]
+                            new_wall = {
+                                'x1': wall_start_point[0], 'y1': wall_start_point[1],
+                                'x2': end_x, 'y2': end_y
+                            }
+                            # Fusion avec les murs colinéaires voisins (un seul pas d'historique)
+                            ops = wall_set_add_normalized(curr_walls, new_wall)
+                            record_history(grid, "wall", ops, current_time)
+                            for op in ops: dirty_cells.append(get_wall_cells(op[2]))
                         wall_start_point = None
 
                     elif current_tool_mode == TOOL_MODE_PLACE and dragging_texture_key:
                         if not is_immersion_mode:
                             if mx < map_view_width and my > MENU_HEIGHT:
-                                grid_my = my - MENU_HEIGHT
-                                gx, gy = mx // TILE_SIZE, grid_my // TILE_SIZE
-                                if 0 <= gx < grid_w and 0 <= gy < grid_h:
-                                    save_history(grid, walls_data.get(current_level_idx, []))
-                                    grid[gy][gx].append({
-                                        'key': dragging_texture_key,
-                                        'angle': drag_angle,
-                                        'layer': current_layer
-                                    })
+                                gx, gy = camera_screen_to_cell(camera, mx, my, view_origin)
+                                new_item = {
+                                    'key': dragging_texture_key,
+                                    'angle': drag_angle,
+                                    'layer': current_layer
+                                }
+                                record_history(grid, "place",
+                                               [("add_item", gx, gy, len(grid_get_stack(grid, gx, gy)), new_item)],
+                                               current_time, merge=merge_with_pickup)
+                                grid_add_item(grid, gx, gy, new_item, asset_sizes)
+                                dirty_cells.append(get_item_footprint(gx, gy, asset_sizes.get(dragging_texture_key, 1)))
+
+        profiler_mark(profiler, "events")
 
         # --- DESSIN ---
-        screen.fill(COLOR_BG)
-
         if is_immersion_mode:
             map_view_width = current_w
             map_view_height = current_h
@@ -1001,71 +3265,139 @@ def main():
             map_view_height = current_h - MENU_HEIGHT
             ui_offset_x = 0
             ui_offset_y = MENU_HEIGHT
-
-        # 1. MAP
-        for layer_pass in [LAYER_GROUND, LAYER_OBJECTS, LAYER_TOKENS]:
-            for y in range(grid_h):
-                for x in range(grid_w):
-                    px, py = x * TILE_SIZE, y * TILE_SIZE + ui_offset_y
-                    if px < map_view_width and py < current_h:
-                        if layer_pass == LAYER_GROUND and not is_immersion_mode:
-                            pygame.draw.rect(screen, COLOR_GRID, (px, py, TILE_SIZE, TILE_SIZE), 1)
-
-                        if y < len(grid) and x < len(grid[0]):
-                            for item in grid[y][x]:
-                                if item.get('layer', 0) == layer_pass:
-                                    key = item['key']
-                                    original = assets_full.get(key)
-                                    if original:
-                                        size = asset_sizes.get(key, 1)
-                                        offset_draw = get_draw_offset(size)
-                                        angle = item['angle']
-                                        if angle != 0:
-                                            img = pygame.transform.rotate(original, angle)
-                                            rect = img.get_rect(center=(px + offset_draw, py + offset_draw))
-                                            screen.blit(img, rect)
-                                        else:
-                                            rect = original.get_rect(center=(px + offset_draw, py + offset_draw))
-                                            screen.blit(original, rect)
-
-        # 2. MURS
-        current_walls = walls_data.get(current_level_idx, [])
-        for w in current_walls:
-            wx1, wy1 = w['x1'], w['y1'] + ui_offset_y
-            wx2, wy2 = w['x2'], w['y2'] + ui_offset_y
+        view_origin = (ui_offset_x, ui_offset_y)
+
+        # Zones de l'écran à pousser avec display.update (le reste n'a pas changé)
+        update_rects = []
+        transient_rects = []
+        full_display_update = False
+
+        # 1. MAP (composite hors-écran de la taille de la vue : seules les cellules modifiées sont redessinées)
+        wanted_state = (map_view_width, map_view_height, is_immersion_mode, camera["zoom"])
+        if map_surface is None or map_surface_state != wanted_state:
+            map_surface = pygame.Surface((map_view_width, map_view_height))
+            map_surface_state = wanted_state
+            map_full_redraw = True
+
+        map_origin = (-camera["x"], -camera["y"])
+        map_rect = pygame.Rect(ui_offset_x, ui_offset_y, map_view_width, map_view_height)
+        if not map_full_redraw and map_surface_camera != (camera["x"], camera["y"]):
+            # Déplacement : on fait glisser le composite et on ne redessine que les bandes découvertes
+            dx = camera["x"] - map_surface_camera[0]
+            dy = camera["y"] - map_surface_camera[1]
+            if abs(dx) >= map_view_width or abs(dy) >= map_view_height:
+                map_full_redraw = True
+            else:
+                map_surface.scroll(-dx, -dy)
+                strips = []
+                if dx > 0: strips.append(pygame.Rect(map_view_width - dx, 0, dx, map_view_height))
+                if dx < 0: strips.append(pygame.Rect(0, 0, -dx, map_view_height))
+                if dy > 0: strips.append(pygame.Rect(0, map_view_height - dy, map_view_width, dy))
+                if dy < 0: strips.append(pygame.Rect(0, 0, map_view_width, -dy))
+                for strip in strips:
+                    draw_map_region(map_surface, grid, assets_full, asset_sizes, camera_cells_in_rect(camera, strip),
+                                    map_origin, show_grid=not is_immersion_mode, bg_color=COLOR_BG,
+                                    zoom=camera["zoom"])
+                update_rects.append(map_rect)
+        map_surface_camera = (camera["x"], camera["y"])
+
+        if map_full_redraw:
+            view_cells = camera_cells_in_rect(camera, map_surface.get_rect())
+            draw_map_region(map_surface, grid, assets_full, asset_sizes, view_cells, map_origin,
+                            show_grid=not is_immersion_mode, bg_color=COLOR_BG, zoom=camera["zoom"])
+            map_full_redraw = False
+            full_display_update = True
+        else:
+            for cell_rect in dirty_cells:
+                area = draw_map_region(map_surface, grid, assets_full, asset_sizes, cell_rect, map_origin,
+                                       show_grid=not is_immersion_mode, bg_color=COLOR_BG, zoom=camera["zoom"])
+                if area: update_rects.append(area.move(ui_offset_x, ui_offset_y))
+        if show_minimap and not is_immersion_mode:
+            minimap_update(minimap, grid, assets_full, asset_sizes, dirty_cells)
+        dirty_cells.clear()
+
+        screen.blit(map_surface, (ui_offset_x, ui_offset_y))
+
+        profiler_mark(profiler, "map")
+
+        # 2. MURS (seuls ceux dont un seau touche la vue)
+        screen.set_clip(map_rect)
+        view_rect = camera_world_rect(camera, map_view_width, map_view_height).inflate(10, 10)
+        for w in walls_in_rect(walls_data[current_level_idx], view_rect):
+            wx1, wy1 = camera_world_to_screen(camera, w['x1'], w['y1'], view_origin)
+            wx2, wy2 = camera_world_to_screen(camera, w['x2'], w['y2'], view_origin)
             pygame.draw.line(screen, COLOR_WALL_FIXED, (wx1, wy1), (wx2, wy2), 5)
             pygame.draw.circle(screen, COLOR_WALL_FIXED, (wx1, wy1), 5)
             pygame.draw.circle(screen, COLOR_WALL_FIXED, (wx2, wy2), 5)
 
+        if wall_band_start and not input_active:
+            band = pygame.Rect(wall_band_start, (0, 0)).union(pygame.Rect((mx, my), (0, 0)))
+            pygame.draw.rect(screen, COLOR_WALL_PREVIEW, band, 1)
+            transient_rects.append(band.inflate(2, 2))
+
         if current_tool_mode == TOOL_MODE_WALL and wall_start_point and not input_active:
-            snap_x = round((mx - ui_offset_x) / TILE_SIZE) * TILE_SIZE + ui_offset_x
-            snap_y = round((my - ui_offset_y) / TILE_SIZE) * TILE_SIZE + ui_offset_y
-            pygame.draw.line(screen, COLOR_WALL_PREVIEW, wall_start_point, (snap_x, snap_y), 3)
+            world_x, world_y = camera_screen_to_world(camera, mx, my, view_origin)
+            snap = camera_world_to_screen(camera, round(world_x / TILE_SIZE) * TILE_SIZE,
+                                          round(world_y / TILE_SIZE) * TILE_SIZE, view_origin)
+            start = camera_world_to_screen(camera, wall_start_point[0], wall_start_point[1], view_origin)
+            preview_rect = pygame.draw.line(screen, COLOR_WALL_PREVIEW, start, snap, 3)
+            transient_rects.append(preview_rect.inflate(4, 4))
+        screen.set_clip(None)
+
+        # MINI-CARTE (coin bas-gauche de la vue ; petite, repoussée à chaque frame)
+        if show_minimap and not is_immersion_mode:
+            minimap_box = pygame.Rect(ui_offset_x + 10, ui_offset_y + map_view_height - MINIMAP_SIZE - 10,
+                                      MINIMAP_SIZE, MINIMAP_SIZE)
+            transient_rects.append(draw_minimap(screen, minimap, minimap_box, camera, map_view_width,
+                                                map_view_height))
+        else:
+            minimap["screen_rect"] = None
 
         # BOUTON SORTIE IMMERSION
         if is_immersion_mode:
             hover_exit = btn_exit_immersion.collidepoint(mx, my) and not input_active
             draw_fantasy_button(screen, btn_exit_immersion, "X", font, COLOR_TEXT, COLOR_BTN_DANGER, COLOR_BORDER_GOLD,
                                 hover_exit)
+            transient_rects.append(btn_exit_immersion)
+        profiler_mark(profiler, "walls")
 
         if not is_immersion_mode:
-            # UI BACKGROUND
-            pygame.draw.rect(screen, COLOR_UI_BG, (map_view_width, MENU_HEIGHT, UI_WIDTH, current_h))
-            pygame.draw.line(screen, COLOR_UI_BORDER, (map_view_width, MENU_HEIGHT), (map_view_width, current_h), 2)
+            # Panneau latéral et menu retenus : seuls les widgets dont l'état a changé sont redessinés.
+            # Tout est repeint au changement de layout, sous un voile modal, ou si un élément transitoire
+            # de la frame précédente (tuile glissée, message) les recouvrait.
+            panel_rect = pygame.Rect(map_view_width, MENU_HEIGHT, UI_WIDTH, current_h - MENU_HEIGHT)
+            menu_rect = pygame.Rect(0, 0, current_w, MENU_HEIGHT)
+            overlay_open = input_active or is_file_menu_open
+            if (ui_drawn_layout != current_layout_key or overlay_open or prev_overlay_open
+                    or panel_rect.collidelist(prev_transient_rects) != -1
+                    or menu_rect.collidelist(prev_transient_rects) != -1):
+                ui_drawn_layout = current_layout_key
+                ui_drawn_states.clear()
+                # UI BACKGROUND
+                pygame.draw.rect(screen, COLOR_UI_BG, (map_view_width, MENU_HEIGHT, UI_WIDTH, current_h))
+                pygame.draw.line(screen, COLOR_UI_BORDER, (map_view_width, MENU_HEIGHT), (map_view_width, current_h),
+                                 2)
+                pygame.draw.rect(screen, COLOR_MENU_BAR, menu_rect)
+                update_rects.append(panel_rect)
+                update_rects.append(menu_rect)
 
             allow_hover = not input_active
 
+            def panel_button(name, rect, text, btn_font, base_color, border_color, is_hovered, bg_color=COLOR_UI_BG):
+                area = draw_retained_button(screen, ui_drawn_states, name, rect, text, btn_font, COLOR_TEXT,
+                                            base_color, border_color, is_hovered, bg_color)
+                if area: update_rects.append(area)
+
             # --- DESSIN NIVEAUX ---
             hover_lvl_down = btn_lvl_down.collidepoint(mx, my) and allow_hover
-            draw_fantasy_button(screen, btn_lvl_down, "ETAGE -", menu_font, COLOR_TEXT, COLOR_LEVEL_BTN,
-                                COLOR_BORDER_GOLD, hover_lvl_down)
+            panel_button("lvl_down", btn_lvl_down, "ETAGE -", menu_font, COLOR_LEVEL_BTN, COLOR_BORDER_GOLD,
+                         hover_lvl_down)
 
-            draw_fantasy_button(screen, lvl_text_rect, f"Niv: {current_level_idx}", font, COLOR_TEXT, COLOR_PANEL_DARK,
-                                COLOR_BORDER_GOLD, False)
+            panel_button("lvl_text", lvl_text_rect, f"Niv: {current_level_idx}", font, COLOR_PANEL_DARK,
+                         COLOR_BORDER_GOLD, False)
 
             hover_lvl_up = btn_lvl_up.collidepoint(mx, my) and allow_hover
-            draw_fantasy_button(screen, btn_lvl_up, "ETAGE +", menu_font, COLOR_TEXT, COLOR_LEVEL_BTN,
-                                COLOR_BORDER_GOLD, hover_lvl_up)
+            panel_button("lvl_up", btn_lvl_up, "ETAGE +", menu_font, COLOR_LEVEL_BTN, COLOR_BORDER_GOLD, hover_lvl_up)
 
             # COUCHES
             c_g = COLOR_BTN_LAYER_ACTIVE if current_layer == LAYER_GROUND else COLOR_BTN_NORMAL
@@ -1076,12 +3408,12 @@ def main():
             b_o = COLOR_BORDER_ACTIVE if current_layer == LAYER_OBJECTS else COLOR_BORDER_GOLD
             b_t = COLOR_BORDER_ACTIVE if current_layer == LAYER_TOKENS else COLOR_BORDER_GOLD
 
-            draw_fantasy_button(screen, btn_layer_ground, "SOL", font, COLOR_TEXT, c_g, b_g,
-                                btn_layer_ground.collidepoint(mx, my) and allow_hover)
-            draw_fantasy_button(screen, btn_layer_obj, "OBJETS", font, COLOR_TEXT, c_o, b_o,
-                                btn_layer_obj.collidepoint(mx, my) and allow_hover)
-            draw_fantasy_button(screen, btn_layer_token, "PIONS", font, COLOR_TEXT, c_t, b_t,
-                                btn_layer_token.collidepoint(mx, my) and allow_hover)
+            panel_button("layer_ground", btn_layer_ground, "SOL", font, c_g, b_g,
+                         btn_layer_ground.collidepoint(mx, my) and allow_hover)
+            panel_button("layer_obj", btn_layer_obj, "OBJETS", font, c_o, b_o,
+                         btn_layer_obj.collidepoint(mx, my) and allow_hover)
+            panel_button("layer_token", btn_layer_token, "PIONS", font, c_t, b_t,
+                         btn_layer_token.collidepoint(mx, my) and allow_hover)
 
             # TOOLS
             c_place = COLOR_BTN_ACTIVE if current_tool_mode == TOOL_MODE_PLACE else COLOR_BTN_NORMAL
@@ -1092,129 +3424,140 @@ def main():
             b_erase = COLOR_BORDER_ACTIVE if current_tool_mode == TOOL_MODE_ERASE else COLOR_BORDER_GOLD
             b_wall = COLOR_BORDER_ACTIVE if current_tool_mode == TOOL_MODE_WALL else COLOR_BORDER_GOLD
 
-            draw_fantasy_button(screen, btn_mode_place, "POSER", font, COLOR_TEXT, c_place, b_place,
-                                btn_mode_place.collidepoint(mx, my) and allow_hover)
+            panel_button("mode_place", btn_mode_place, "POSER", font, c_place, b_place,
+                         btn_mode_place.collidepoint(mx, my) and allow_hover)
 
             erase_txt = "GOMME (S)"
             if current_layer == LAYER_OBJECTS:
                 erase_txt = "GOMME (O)"
             elif current_layer == LAYER_TOKENS:
                 erase_txt = "GOMME (P)"
-            draw_fantasy_button(screen, btn_mode_erase, erase_txt, font, COLOR_TEXT, c_erase, b_erase,
-                                btn_mode_erase.collidepoint(mx, my) and allow_hover)
+            panel_button("mode_erase", btn_mode_erase, erase_txt, font, c_erase, b_erase,
+                         btn_mode_erase.collidepoint(mx, my) and allow_hover)
 
-            draw_fantasy_button(screen, btn_tool_rotate, "PIVOTER", font, COLOR_TEXT, COLOR_BTN_NORMAL,
-                                COLOR_BORDER_GOLD, btn_tool_rotate.collidepoint(mx, my) and allow_hover)
-            draw_fantasy_button(screen, btn_tool_wall, "TRACER MUR", font, COLOR_TEXT, c_wall, b_wall,
-                                btn_tool_wall.collidepoint(mx, my) and allow_hover)
+            panel_button("tool_rotate", btn_tool_rotate, "PIVOTER", font, COLOR_BTN_NORMAL, COLOR_BORDER_GOLD,
+                         btn_tool_rotate.collidepoint(mx, my) and allow_hover)
+            panel_button("tool_wall", btn_tool_wall, "TRACER MUR", font, c_wall, b_wall,
+                         btn_tool_wall.collidepoint(mx, my) and allow_hover)
 
             # DROPDOWN HEADER
-            pygame.draw.rect(screen, COLOR_BTN_NORMAL, btn_category_dropdown, border_radius=5)
-            text_cat = font.render(current_lib_name, True, COLOR_TEXT)
-            screen.blit(text_cat, (btn_category_dropdown.x + 10, btn_category_dropdown.y + 10))
-
-            # Triangle vectoriel
-            center_x = btn_category_dropdown.right - 20
-            center_y = btn_category_dropdown.centery
-            if is_category_menu_open:
-                points = [(center_x, center_y - 5), (center_x - 5, center_y + 5), (center_x + 5, center_y + 5)]
-            else:
-                points = [(center_x - 5, center_y - 5), (center_x + 5, center_y - 5), (center_x, center_y + 5)]
-            pygame.draw.polygon(screen, COLOR_TEXT, points)
-
-            # TEXTURES
-            clip_rect = pygame.Rect(ui_x, start_y_tex, UI_WIDTH, current_h - start_y_tex)
-            screen.set_clip(clip_rect)
-            col, row = 0, 0
-            for tex_key in current_textures:
-                bx = ui_x + 10 + col * col_step + (col_step - 64) // 2
-                by = start_y_tex + row * 74 + scroll_y
-                if start_y_tex - 70 < by < current_h:
-                    if tex_key == dragging_texture_key:
-                        pygame.draw.rect(screen, COLOR_BTN_ACTIVE, (bx, by, 64, 64), 2, border_radius=3)
-                    thumb = assets_thumb.get(tex_key)
-                    if thumb:
-                        rot = tool_angles.get(tex_key, 0)
-                        if rot != 0:
-                            img = pygame.transform.rotate(thumb, rot)
-                            r = img.get_rect(center=(bx + 32, by + 32))
-                            screen.blit(img, r)
-                        else:
-                            screen.blit(thumb, (bx, by))
-                col += 1
-                if col >= COLS_PER_ROW: col = 0; row += 1
-            screen.set_clip(None)
-
-            # --- SCROLLBAR VERTICALE ---
-            if content_h_px > view_h_px:
-                scrollbar_w = 10
-                track_x = current_w - scrollbar_w - 5
-                track_y = start_y_tex
-
-                track_rect = pygame.Rect(track_x, track_y, scrollbar_w, view_h_px)
-                pygame.draw.rect(screen, (30, 30, 35), track_rect, border_radius=5)
-
-                ratio = view_h_px / content_h_px
-                thumb_h = max(30, view_h_px * ratio)
-
-                max_scroll_draw = content_h_px - view_h_px
-                scroll_pct = abs(scroll_y) / max_scroll_draw if max_scroll_draw > 0 else 0
-
-                track_scrollable_h = view_h_px - thumb_h
-                thumb_y = track_y + (scroll_pct * track_scrollable_h)
-
-                thumb_rect = pygame.Rect(track_x, thumb_y, scrollbar_w, thumb_h)
-                pygame.draw.rect(screen, COLOR_BORDER_GOLD, thumb_rect, border_radius=5)
+            dropdown_state = (current_lib_name, is_category_menu_open)
+            if ui_drawn_states.get("dropdown") != dropdown_state:
+                ui_drawn_states["dropdown"] = dropdown_state
+                screen.fill(COLOR_UI_BG, btn_category_dropdown)
+                pygame.draw.rect(screen, COLOR_BTN_NORMAL, btn_category_dropdown, border_radius=5)
+                text_cat = font.render(current_lib_name, True, COLOR_TEXT)
+                screen.blit(text_cat, (btn_category_dropdown.x + 10, btn_category_dropdown.y + 10))
+
+                # Triangle vectoriel
+                center_x = btn_category_dropdown.right - 20
+                center_y = btn_category_dropdown.centery
+                if is_category_menu_open:
+                    points = [(center_x, center_y - 5), (center_x - 5, center_y + 5), (center_x + 5, center_y + 5)]
+                else:
+                    points = [(center_x - 5, center_y - 5), (center_x + 5, center_y - 5), (center_x, center_y + 5)]
+                pygame.draw.polygon(screen, COLOR_TEXT, points)
+                update_rects.append(btn_category_dropdown)
 
-            # DROPDOWN LIST
+            # TEXTURES, SCROLLBAR ET LISTE DES CATÉGORIES (qui recouvre les textures)
+            hovered_option = -1
             if is_category_menu_open:
-                list_h = len(options_to_show) * 40
-                bg_rect = pygame.Rect(ui_x + UI_MARGIN, btn_category_dropdown.bottom, work_width, list_h)
-                pygame.draw.rect(screen, COLOR_DROPDOWN_BG, bg_rect)
-                pygame.draw.rect(screen, COLOR_UI_BORDER, bg_rect, 1)
-                for i, name in enumerate(options_to_show):
-                    opt_rect = pygame.Rect(ui_x + UI_MARGIN, btn_category_dropdown.bottom + i * 40, work_width, 40)
-                    if opt_rect.collidepoint(mx, my): pygame.draw.rect(screen, COLOR_BTN_ACTIVE, opt_rect)
-                    name_surf = font.render(name, True, COLOR_TEXT)
-                    screen.blit(name_surf, (opt_rect.x + 10, opt_rect.y + 10))
+                for i in range(len(options_to_show)):
+                    if pygame.Rect(ui_x + UI_MARGIN, btn_category_dropdown.bottom + i * 40, work_width,
+                                   40).collidepoint(mx, my):
+                        hovered_option = i
+            sheet = get_palette_sheet(palette_sheets, current_lib_name, current_textures, COLS_PER_ROW, col_step)
+            palette_sheet_refresh(sheet, assets_thumb, asset_sizes, tool_angles)
+            palette_state = (current_lib_name, scroll_y, dragging_texture_key, is_category_menu_open, hovered_option,
+                             sheet["version"])
+            if ui_drawn_states.get("palette") != palette_state:
+                ui_drawn_states["palette"] = palette_state
+                palette_rect = pygame.Rect(ui_x, btn_category_dropdown.bottom, UI_WIDTH,
+                                           current_h - btn_category_dropdown.bottom)
+                screen.fill(COLOR_UI_BG, palette_rect)
+                update_rects.append(palette_rect)
+
+                # Tranche visible de la planche, puis l'icône sélectionnée avec son cadre (sous l'icône)
+                clip_rect = pygame.Rect(ui_x, start_y_tex, UI_WIDTH, current_h - start_y_tex)
+                screen.blit(sheet["surface"], clip_rect.topleft, pygame.Rect(0, -scroll_y, UI_WIDTH, clip_rect.height))
+                selected = sheet["index"].get(dragging_texture_key)
+                if selected is not None:
+                    screen.set_clip(clip_rect)
+                    icon_x, icon_y = palette_icon_pos(sheet, selected)
+                    bx, by = ui_x + icon_x, start_y_tex + icon_y + scroll_y
+                    screen.fill(COLOR_UI_BG, (bx, by, PALETTE_ICON_SIZE, PALETTE_ICON_SIZE))
+                    pygame.draw.rect(screen, COLOR_BTN_ACTIVE, (bx, by, PALETTE_ICON_SIZE, PALETTE_ICON_SIZE), 2,
+                                     border_radius=3)
+                    draw_palette_icon(screen, bx, by, dragging_texture_key, assets_thumb, asset_sizes,
+                                      tool_angles.get(dragging_texture_key, 0))
+                    screen.set_clip(None)
+
+                # --- SCROLLBAR VERTICALE ---
+                if content_h_px > view_h_px:
+                    scrollbar_w = 10
+                    track_x = current_w - scrollbar_w - 5
+                    track_y = start_y_tex
+
+                    track_rect = pygame.Rect(track_x, track_y, scrollbar_w, view_h_px)
+                    pygame.draw.rect(screen, (30, 30, 35), track_rect, border_radius=5)
+
+                    ratio = view_h_px / content_h_px
+                    thumb_h = max(30, view_h_px * ratio)
+
+                    max_scroll_draw = content_h_px - view_h_px
+                    scroll_pct = abs(scroll_y) / max_scroll_draw if max_scroll_draw > 0 else 0
+
+                    track_scrollable_h = view_h_px - thumb_h
+                    thumb_y = track_y + (scroll_pct * track_scrollable_h)
+
+                    thumb_rect = pygame.Rect(track_x, thumb_y, scrollbar_w, thumb_h)
+                    pygame.draw.rect(screen, COLOR_BORDER_GOLD, thumb_rect, border_radius=5)
+
+                # DROPDOWN LIST
+                if is_category_menu_open:
+                    list_h = len(options_to_show) * 40
+                    bg_rect = pygame.Rect(ui_x + UI_MARGIN, btn_category_dropdown.bottom, work_width, list_h)
+                    pygame.draw.rect(screen, COLOR_DROPDOWN_BG, bg_rect)
+                    pygame.draw.rect(screen, COLOR_UI_BORDER, bg_rect, 1)
+                    for i, name in enumerate(options_to_show):
+                        opt_rect = pygame.Rect(ui_x + UI_MARGIN, btn_category_dropdown.bottom + i * 40, work_width, 40)
+                        if i == hovered_option: pygame.draw.rect(screen, COLOR_BTN_ACTIVE, opt_rect)
+                        name_surf = font.render(name, True, COLOR_TEXT)
+                        screen.blit(name_surf, (opt_rect.x + 10, opt_rect.y + 10))
 
             # MENU HAUT (FANTASY BUTTONS)
-            pygame.draw.rect(screen, COLOR_MENU_BAR, (0, 0, current_w, MENU_HEIGHT))
-
-            draw_fantasy_button(screen, btn_save, "SAUVER", menu_font, COLOR_TEXT, COLOR_BTN_SUCCESS, COLOR_BORDER_GOLD,
-                                btn_save.collidepoint(mx, my) and allow_hover)
-            draw_fantasy_button(screen, btn_load, "CHARGER", menu_font, COLOR_TEXT, COLOR_BTN_NORMAL, COLOR_BORDER_GOLD,
-                                btn_load.collidepoint(mx, my) and allow_hover)
-            draw_fantasy_button(screen, btn_export, "EXPORT", menu_font, COLOR_TEXT, COLOR_BTN_NORMAL,
-                                COLOR_BORDER_GOLD, btn_export.collidepoint(mx, my) and allow_hover)
-            draw_fantasy_button(screen, btn_undo, "ANNULER", menu_font, COLOR_TEXT, COLOR_BTN_WARNING,
-                                COLOR_BORDER_GOLD, btn_undo.collidepoint(mx, my) and allow_hover)
-            draw_fantasy_button(screen, btn_redo, "RETABLIR", menu_font, COLOR_TEXT, COLOR_BTN_WARNING,
-                                COLOR_BORDER_GOLD, btn_redo.collidepoint(mx, my) and allow_hover)
-            draw_fantasy_button(screen, btn_immersion, "IMMERSION", menu_font, COLOR_TEXT, (50, 50, 150),
-                                COLOR_BORDER_GOLD, btn_immersion.collidepoint(mx, my) and allow_hover)
-            draw_fantasy_button(screen, btn_quit, "QUITTER", menu_font, COLOR_TEXT, COLOR_BTN_DANGER, COLOR_BORDER_GOLD,
-                                btn_quit.collidepoint(mx, my) and allow_hover)
+            for name, rect, text, base_color in (("save", btn_save, "SAUVER", COLOR_BTN_SUCCESS),
+                                                 ("load", btn_load, "CHARGER", COLOR_BTN_NORMAL),
+                                                 ("export", btn_export, "EXPORT", COLOR_BTN_NORMAL),
+                                                 ("undo", btn_undo, "ANNULER", COLOR_BTN_WARNING),
+                                                 ("redo", btn_redo, "RETABLIR", COLOR_BTN_WARNING),
+                                                 ("immersion", btn_immersion, "IMMERSION", (50, 50, 150)),
+                                                 ("quit", btn_quit, "QUITTER", COLOR_BTN_DANGER)):
+                panel_button(name, rect, text, menu_font, base_color, COLOR_BORDER_GOLD,
+                             rect.collidepoint(mx, my) and allow_hover, COLOR_MENU_BAR)
 
             if is_dragging and dragging_texture_key and not input_active:
-                original_drag = assets_full.get(dragging_texture_key)
+                original_drag = get_full_asset(assets_full, dragging_texture_key)
                 if original_drag:
                     size = asset_sizes.get(dragging_texture_key, 1)
-                    offset_drag = get_draw_offset(size)
-                    if drag_angle != 0:
-                        drag_img = pygame.transform.rotate(original_drag, drag_angle)
-                    else:
-                        drag_img = original_drag.copy()
+                    zoom = camera["zoom"]
+                    offset_drag = get_draw_offset(size) * camera_tile_px(camera) // TILE_SIZE
+                    # Copie : la transparence ne doit pas toucher la surface partagée du cache
+                    drag_scaled = get_scaled_surface(assets_full, dragging_texture_key, original_drag, zoom)
+                    drag_img = get_rotated_surface(dragging_texture_key, drag_scaled, drag_angle, zoom).copy()
                     alpha = 150
                     if current_layer == LAYER_OBJECTS: alpha = 200
                     if current_layer == LAYER_TOKENS: alpha = 255
                     drag_img.set_alpha(alpha)
 
                     if size % 2 == 0:
-                        rect = drag_img.get_rect(center=(mx + offset_drag - 32, my + offset_drag - 32))
+                        half_tile = camera_tile_px(camera) // 2
+                        rect = drag_img.get_rect(center=(mx + offset_drag - half_tile, my + offset_drag - half_tile))
                     else:
                         rect = drag_img.get_rect(center=(mx, my))
                     screen.blit(drag_img, rect)
+                    transient_rects.append(rect)
+        profiler_mark(profiler, "ui")
 
         if is_file_menu_open:
             overlay = pygame.Surface((current_w, current_h), pygame.SRCALPHA)
@@ -1252,7 +3595,8 @@ def main():
             pygame.draw.rect(screen, COLOR_BORDER_GOLD, modal_rect, 2, border_radius=10)
 
             # Titre
-            prompt_text = "NOM DE LA SAUVEGARDE :" if input_action == "SAVE" else "NOM DU FICHIER EXPORT :"
+            prompt_text = {"SAVE": "NOM DE LA SAUVEGARDE :", "EXPORT": "NOM DU FICHIER EXPORT :",
+                           "EXPORT_ALL": "EXPORT DE TOUS LES ÉTAGES :"}[input_action]
             title_surf = title_font.render(prompt_text, True, COLOR_TEXT)
             screen.blit(title_surf, (modal_rect.centerx - title_surf.get_width() // 2, modal_rect.y + 40))
 
@@ -1282,6 +3626,22 @@ def main():
             draw_fantasy_button(screen, btn_ok_rect, "ENREGISTRER", font, COLOR_TEXT, COLOR_BTN_SUCCESS,
                                 COLOR_BORDER_GOLD, hover_ok)
 
+        # Progression / résultat des sauvegardes et exports en arrière-plan
+        if background_jobs:
+            job = background_jobs[0]
+            if job["future"].done():
+                background_jobs.pop(0)
+                try:
+                    system_msg = job["future"].result()
+                except Exception as e:
+                    system_msg = f"Err: {e}"
+                system_msg_timer = current_time + 3000
+            else:
+                elapsed = time.perf_counter() - job["start"]
+                system_msg = f"{job['label']} : {job['stage']}... ({elapsed:.1f} s)"
+                if job["cancel"] and not job["cancel"].is_set(): system_msg += " - Échap : annuler"
+                system_msg_timer = current_time + 100
+
         if current_time < system_msg_timer:
             msg_surf = title_font.render(system_msg, True, (255, 255, 255))
             msg_bg = pygame.Rect(current_w // 2 - msg_surf.get_width() // 2 - 20, current_h // 2 - 30,
@@ -1292,13 +3652,56 @@ def main():
             screen.blit(s, (msg_bg.x, msg_bg.y))
             screen.blit(msg_surf,
                         (msg_bg.centerx - msg_surf.get_width() // 2, msg_bg.centery - msg_surf.get_height() // 2))
-
-        pygame.display.flip()
+            transient_rects.append(msg_bg)
+
+        if profiler["visible"]:
+            transient_rects.append(draw_profiler_overlay(screen, profiler, profiler_font,
+                                                         (ui_offset_x + map_view_width - 10, ui_offset_y + 10)))
+        profiler_mark(profiler, "overlays")
+
+        # Les fenêtres modales assombrissent tout l'écran : mise à jour complète à l'ouverture/fermeture
+        overlay_open = input_active or is_file_menu_open
+        display_rects = []
+        if full_display_update or overlay_open or prev_overlay_open:
+            pygame.display.flip()
+        else:
+            # Les zones transitoires de la frame précédente doivent être effacées
+            display_rects = update_rects + transient_rects + prev_transient_rects
+            pygame.display.update(display_rects)
+        prev_transient_rects = transient_rects
+        prev_overlay_open = overlay_open
+        profiler_mark(profiler, "display")
+
+        # CADENCE ADAPTATIVE : pleine vitesse pendant un glisser, un tracé de mur ou un déplacement de
+        # caméra ; sinon la boucle dort jusqu'au prochain événement ou à la prochaine échéance visible
+        if not (is_dragging or wall_start_point or wall_band_start or pan_last):
+            now_ticks = pygame.time.get_ticks()
+            timeout = IDLE_MAX_WAIT_MS
+            if input_active: timeout = min(timeout, cursor_timer + 501 - now_ticks)  # Clignotement
+            if now_ticks < system_msg_timer: timeout = min(timeout, system_msg_timer - now_ticks)
+            if profiler["visible"]: timeout = min(timeout, 250)  # Rafraîchissement de l'overlay
+            if timeout > 0:
+                wait_start = time.perf_counter()
+                event = pygame.event.wait(timeout)
+                if event.type != pygame.NOEVENT: woken_event = event
+                profiler_add_wait(profiler, time.perf_counter() - wait_start)
+        # Plafond de 60 FPS, y compris quand un flot d'événements (souris) réveille la boucle
         clock.tick(60)
-
+        profiler_mark(profiler, "idle")
+        profiler_end_frame(profiler, len(display_rects))
+
+    profiler_close(profiler)
+    print(profiler_cpu_report(profiler))
+    if background_jobs:
+        print("Attente de la fin des sauvegardes / exports en cours...")
+    wait_background_jobs()
     pygame.quit()
     sys.exit()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if len(sys.argv) == 4 and sys.argv[1] == "--convert":
+        # python MapDungeon.py --convert projet.json projet.mdmap (ou l'inverse)
+        print(convert_project_file(sys.argv[2], sys.argv[3]))
+    else:
+        main()
\ No newline at end of file
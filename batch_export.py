@@ -0,0 +1,127 @@
+"""Export en lot, sans fenêtre : python batch_export.py campagne.json [autre.json ...] [options]
+
+Chaque étage de chaque projet est rendu par un pool de processus (pilote vidéo SDL "dummy"),
+avec le même rendu que l'export de l'éditeur. Exemple :
+
+    python batch_export.py donjon.json crypte.json --format dd2vtt png --levels 0 1 --out exports
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Avant l'import de pygame (aussi dans les processus du pool, qui réimportent ce module)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+import MapDungeon as md
+
+# --- ÉTAT D'UN PROCESSUS DU POOL ---
+worker_assets = None   # (assets_full, asset_sizes), chargés une fois par processus
+worker_projects = {}   # chemin -> (levels_data, walls) déjà chargés par ce processus
+
+
+def init_worker():
+    """Prépare pygame (un display est requis par convert_alpha) et charge les assets."""
+    global worker_assets
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+    assets_full, assets_thumb, asset_sizes, libraries = md.load_all_assets_from_folder(md.ASSET_ROOT)
+    worker_assets = (assets_full, asset_sizes)
+
+
+def get_project(project_path):
+    if project_path not in worker_projects:
+        levels_data, walls, msg = md.load_project_file(project_path)
+        if levels_data is None: raise RuntimeError(msg)
+        worker_projects[project_path] = (levels_data, walls)
+    return worker_projects[project_path]
+
+
+def export_level(project_path, level_idx, formats, out_base):
+    """Exporte un étage dans chaque format demandé : [(format, message, durée en ms), ...]."""
+    assets_full, asset_sizes = worker_assets
+    levels_data, walls = get_project(project_path)
+    grid = levels_data.get(level_idx) or md.create_grid()  # Étage fait uniquement de murs
+    results = []
+    for fmt in formats:
+        start = time.perf_counter()
+        # Les murs du JSON sont déjà une liste de segments, indexée par étage en texte
+        segments = walls.get(str(level_idx), [])
+        if fmt == "dd2vtt":
+            msg = md.export_universal_vtt_named(grid, segments, assets_full, asset_sizes, level_idx, out_base)
+        else:
+            msg = md.export_png_named(grid, assets_full, asset_sizes, level_idx, out_base, segments)
+        results.append((fmt, msg, (time.perf_counter() - start) * 1000))
+    return results
+
+
+def list_levels(project_path):
+    """Étages présents dans un projet sauvegardé (JSON ou .mdmap : index seul, sans les assets), y compris
+    ceux qui n'ont que des murs."""
+    source = md.read_project_source(project_path)
+    return sorted(lvl for lvl, (presence, item_count, wall_count, _, _) in source["index"].items()
+                  if presence & 1 or wall_count)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export en lot des projets MapDungeon (.dd2vtt / .png).")
+    parser.add_argument("projects", nargs="+", help="Fichiers projet (.json ou .mdmap)")
+    parser.add_argument("--levels", type=int, nargs="+", help="Étages à exporter (par défaut : tous)")
+    parser.add_argument("--format", dest="formats", nargs="+", choices=["dd2vtt", "png"], default=["dd2vtt"])
+    parser.add_argument("--out", help="Dossier de sortie (par défaut : celui de chaque projet)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="Nombre de processus")
+    args = parser.parse_args(argv)
+
+    # 1. Une tâche par (projet, étage). Deux projets de même nom (donjon.json et donjon.mdmap, ou deux
+    # dossiers avec --out) écriraient les mêmes fichiers : le second prend son extension dans le nom
+    tasks = []
+    used_bases = set()
+    for project in args.projects:
+        project_path = os.path.abspath(project)
+        try:
+            levels = list_levels(project_path)
+        except Exception as e:
+            print(f"ERREUR {project} : {e}")
+            continue
+        if args.levels is not None: levels = [lvl for lvl in levels if lvl in args.levels]
+        out_dir = os.path.abspath(args.out) if args.out else os.path.dirname(project_path)
+        stem, ext = os.path.splitext(os.path.basename(project_path))
+        base = stem
+        if os.path.join(out_dir, base) in used_bases: base = f"{stem}_{ext.lstrip('.')}"
+        n = 2
+        while os.path.join(out_dir, base) in used_bases:
+            base = f"{stem}_{ext.lstrip('.')}{n}"
+            n += 1
+        used_bases.add(os.path.join(out_dir, base))
+        for lvl in levels:
+            tasks.append((project_path, lvl, args.formats, os.path.join(out_dir, f"{base}_etage{lvl}")))
+
+    if not tasks:
+        print("Rien à exporter.")
+        return 1
+    if args.out: os.makedirs(os.path.abspath(args.out), exist_ok=True)
+
+    # 2. Répartition sur le pool
+    start = time.perf_counter()
+    failures = 0
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(tasks))), initializer=init_worker) as pool:
+        futures = {pool.submit(export_level, *task): task for task in tasks}
+        for future in as_completed(futures):
+            project_path, lvl = futures[future][:2]
+            name = f"{os.path.basename(project_path)} étage {lvl}"
+            try:
+                for fmt, msg, ms in future.result():
+                    if not msg.startswith("Export OK"): failures += 1
+                    print(f"{name:<40} {fmt:<7} {ms:8.0f} ms  {msg}")
+            except Exception as e:
+                failures += 1
+                print(f"{name:<40} ERREUR {e}")
+
+    print(f"{len(tasks)} étage(s) en {(time.perf_counter() - start) * 1000:.0f} ms, {failures} échec(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
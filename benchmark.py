@@ -0,0 +1,337 @@
+"""Banc d'essai sans fenêtre : python benchmark.py [options]
+
+Génère des donjons synthétiques à partir des assets fournis (Neutral Stone), en faisant varier
+la taille de la grille, la hauteur des piles, la part de tuiles pivotées, le nombre de murs et
+d'étages, puis chronomètre les opérations coûteuses de l'éditeur. Les résultats sont écrits en
+JSON pour comparer deux commits :
+
+    python benchmark.py --out avant.json
+    python benchmark.py --out apres.json --compare avant.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Avant l'import de pygame
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+import MapDungeon as md
+
+BENCH_FORMAT_VERSION = 1
+
+# Scénarios prédéfinis : côté de la grille (cases), piles, part pivotée, murs, étages
+SCENARIOS = {
+    "petit": {"size": 32, "depth": 1, "rotated": 0.0, "walls": 50, "levels": 1},
+    "moyen": {"size": 96, "depth": 2, "rotated": 0.25, "walls": 500, "levels": 2},
+    "grand": {"size": 160, "depth": 3, "rotated": 0.5, "walls": 2000, "levels": 3},
+}
+
+
+# --- GÉNÉRATION ---
+def generate_level_records(rng, keys_1x1, keys_all, size, depth, rotated):
+    """Étage plein de `size` x `size` cases : un sol 1x1 par case, puis `depth - 1` objets empilés."""
+    records = []
+    for y in range(size):
+        for x in range(size):
+            for level in range(depth):
+                key = rng.choice(keys_1x1 if level == 0 else keys_all)
+                angle = rng.choice((90, 180, 270)) if rng.random() < rotated else 0
+                layer = md.LAYER_GROUND if level == 0 else md.LAYER_OBJECTS
+                records.append((x, y, key, angle, layer))
+    return records
+
+
+def generate_walls(rng, size, count):
+    """Murs horizontaux / verticaux accrochés à la grille, dans les bornes de l'étage."""
+    walls = []
+    for _ in range(count):
+        x1 = rng.randrange(size + 1) * md.TILE_SIZE
+        y1 = rng.randrange(size + 1) * md.TILE_SIZE
+        length = rng.randint(1, 8) * md.TILE_SIZE
+        if rng.random() < 0.5:
+            walls.append({"x1": x1, "y1": y1, "x2": min(x1 + length, size * md.TILE_SIZE), "y2": y1})
+        else:
+            walls.append({"x1": x1, "y1": y1, "x2": x1, "y2": min(y1 + length, size * md.TILE_SIZE)})
+    return walls
+
+
+# --- MESURES ---
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def summary(samples_ms):
+    mean, p95, worst = md.profiler_summary(samples_ms)
+    return {"mean_ms": round(mean, 4), "p95_ms": round(p95, 4), "max_ms": round(worst, 4), "runs": len(samples_ms)}
+
+
+def reset_render_caches():
+    """Vide les caches de rendu (rotation, pyramides) pour mesurer une première frame à froid."""
+    with md.rotation_cache_lock:
+        md.rotation_cache.clear()
+        md.rotation_cache_stats.update({"hits": 0, "misses": 0, "evictions": 0, "bytes": 0})
+    md.clear_asset_mips()
+
+
+def bench_render(grid, assets_full, asset_sizes, repeat):
+    """Frame complète de la vue (taille de fenêtre par défaut), à froid puis à chaud, à plusieurs zooms."""
+    view_w, view_h = md.WINDOW_WIDTH - md.UI_WIDTH, md.WINDOW_HEIGHT - md.MENU_HEIGHT
+    surface = pygame.Surface((view_w, view_h))
+    results = {}
+    for zoom in (1.0, 0.25):
+        camera = {"x": 0, "y": 0, "zoom": zoom}
+        cell_rect = md.camera_cells_in_rect(camera, pygame.Rect(0, 0, view_w, view_h))
+        reset_render_caches()
+        md.render_stats["map_blits"] = 0
+        cold_ms, _ = timed(md.draw_map_region, surface, grid, assets_full, asset_sizes, cell_rect, (0, 0), False,
+                           md.COLOR_VIEW_BG, zoom)
+        blits = md.render_stats["map_blits"]
+        warm = [timed(md.draw_map_region, surface, grid, assets_full, asset_sizes, cell_rect, (0, 0), False,
+                      md.COLOR_VIEW_BG, zoom)[0] for _ in range(repeat)]
+        results[f"zoom_{zoom}"] = {"cold_ms": round(cold_ms, 4), "warm": summary(warm), "blits": blits,
+                                   "rotation_cache": md.get_rotation_cache_stats()}
+    return results
+
+
+def bench_pick(rng, grid, assets_full, asset_sizes, size, count):
+    """Latence de get_tile_at_pixel sur des pixels tirés au hasard dans l'étage."""
+    samples = []
+    for _ in range(count):
+        mx, my = rng.randrange(size * md.TILE_SIZE), rng.randrange(size * md.TILE_SIZE)
+        samples.append(timed(md.get_tile_at_pixel, grid, mx, my, assets_full, asset_sizes)[0])
+    return summary(samples)
+
+
+def bench_history(rng, grid, walls, keys_all, asset_sizes, size, edits):
+    """Coût d'une édition enregistrée (record_history), puis de tout annuler / rétablir ; mémoire."""
+    tracemalloc.start()
+    edit_samples = []
+    now = 0
+    for _ in range(edits):
+        x, y = rng.randrange(size), rng.randrange(size)
+        item = {'key': rng.choice(keys_all), 'angle': 0, 'layer': md.LAYER_OBJECTS}
+        start = time.perf_counter()
+        stack_idx = len(md.grid_get_stack(grid, x, y))
+        md.grid_add_item(grid, x, y, item, asset_sizes)
+        md.record_history(grid, "add", [("add_item", x, y, stack_idx, item)], now)
+        edit_samples.append((time.perf_counter() - start) * 1000)
+        now += md.HISTORY_COALESCE_MS + 1  # Une étape par édition
+    steps = len(grid["history"]["undo"])
+    history_bytes = grid["history"]["bytes"]
+
+    undo_ms, _ = timed(lambda: [md.perform_undo(grid, walls, asset_sizes) for _ in range(steps)])
+    redo_ms, _ = timed(lambda: [md.perform_redo(grid, walls, asset_sizes) for _ in range(steps)])
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"edit": summary(edit_samples), "steps": steps, "history_bytes": history_bytes,
+            "undo_all_ms": round(undo_ms, 4), "redo_all_ms": round(redo_ms, 4), "traced_peak_bytes": traced_peak}
+
+
+def bench_project_io(levels_data, walls_data, asset_sizes, item_count, out_dir):
+    """Sauvegarde / chargement du projet complet, en JSON et en .mdmap."""
+    results = {}
+    for ext in (".json", md.PROJECT_BINARY_EXT):
+        path = os.path.join(out_dir, "bench_projet" + ext)
+        save_ms, msg = timed(md.save_project_named, levels_data, walls_data, path)
+        if not msg.startswith("Sauvé"): raise RuntimeError(msg)
+        load_ms, loaded = timed(md.load_project_file, path)
+        if loaded[0] is None: raise RuntimeError(loaded[2])
+        # Les blocs d'un .mdmap ne sont construits qu'à leur première lecture : premier parcours complet à part
+        first_pass_ms, _ = timed(lambda: [cell for grid in loaded[0].values() for cell in md.grid_iter_cells(grid)])
+        file_bytes = os.path.getsize(path)
+        results[ext.lstrip(".")] = {"save_ms": round(save_ms, 4), "load_ms": round(load_ms, 4), "bytes": file_bytes,
+                                    "first_pass_ms": round(first_pass_ms, 4),
+                                    "save_items_per_s": round(item_count / (save_ms / 1000)),
+                                    "load_items_per_s": round(item_count / (load_ms / 1000))}
+    return results
+
+
+def bench_export(grid, walls, assets_full, asset_sizes, out_dir):
+    path = os.path.join(out_dir, "bench_export.dd2vtt")
+    export_ms, msg = timed(md.export_universal_vtt_named, grid, walls, assets_full, asset_sizes, 0, path)
+    if not msg.startswith("Export OK"): raise RuntimeError(msg)
+    return {"ms": round(export_ms, 4), "bytes": os.path.getsize(path)}
+
+
+def bench_atlas(assets_thumb, repeat):
+    """Atlas des miniatures face à une surface par miniature : mémoire et débit de blit.
+
+    L'atlas étant désactivé par défaut (ATLAS_ENABLED), les miniatures sont recopiées dans un atlas neuf
+    le temps de la mesure. Les pleines tailles n'y vont jamais (LRU, voir ATLAS DE TEXTURES)."""
+    thumbs = [surf for surf in assets_thumb.values() if surf is not None]
+    saved = md.ATLAS_ENABLED, md.asset_atlases
+    md.ATLAS_ENABLED, md.asset_atlases = True, {"thumb": []}
+    try:
+        handles = [md.atlas_pack("thumb", surf.copy()) for surf in thumbs]
+        atlas_stats = md.get_atlas_stats()["thumb"]
+    finally:
+        md.ATLAS_ENABLED, md.asset_atlases = saved
+
+    standalone = [surf.copy() for surf in thumbs]
+    target = pygame.Surface((md.ATLAS_PAGE_SIZE, md.ATLAS_PAGE_SIZE)).convert()
+    positions = [((i * 97) % (md.ATLAS_PAGE_SIZE - 64), (i * 61) % (md.ATLAS_PAGE_SIZE - 64))
+                 for i in range(len(handles))]
+
+    def blit_all(surfaces):
+        for _ in range(repeat):
+            for surf, pos in zip(surfaces, positions):
+                target.blit(surf, pos)
+
+    atlas_ms, _ = timed(blit_all, handles)
+    standalone_ms, _ = timed(blit_all, standalone)
+    blits = len(handles) * repeat
+    return {"thumb": {
+        "assets": len(handles),
+        "atlas": dict(atlas_stats, blits_per_s=round(blits / (atlas_ms / 1000))),
+        "per_surface": {"surfaces": len(standalone),
+                        "bytes": sum(surf.get_bytesize() * surf.get_width() * surf.get_height()
+                                     for surf in standalone),
+                        "blits_per_s": round(blits / (standalone_ms / 1000))},
+    }}
+
+
+def run_scenario(name, params, assets_full, asset_sizes, keys_1x1, keys_all, args):
+    rng = random.Random(args.seed)
+    size, levels = params["size"], params["levels"]
+
+    # 1. Génération (les étages sont construits comme au chargement d'un projet)
+    levels_data, walls_data = {}, {}
+    build_ms = 0.0
+    for lvl in range(levels):
+        records = generate_level_records(rng, keys_1x1, keys_all, size, params["depth"], params["rotated"])
+        ms, levels_data[lvl] = timed(md.grid_from_records, records)
+        build_ms += ms
+        walls_data[lvl] = md.create_wall_set(generate_walls(rng, size, params["walls"]))
+    item_count = sum(len(stack) for grid in levels_data.values() for _, _, stack in md.grid_iter_cells(grid))
+    grid, walls = levels_data[0], walls_data[0]
+
+    result = {"scenario": name, "params": params, "items": item_count, "build_ms": round(build_ms, 4)}
+    result["render"] = bench_render(grid, assets_full, asset_sizes, args.repeat)
+    result["pick"] = bench_pick(rng, grid, assets_full, asset_sizes, size, args.picks)
+    result["map_bounds"] = summary([timed(md.get_map_bounds, grid)[0] for _ in range(args.repeat)])
+    with tempfile.TemporaryDirectory() as out_dir:
+        result["project_io"] = bench_project_io(levels_data, walls_data, asset_sizes, item_count, out_dir)
+        result["export_vtt"] = bench_export(grid, walls["segments"], assets_full, asset_sizes, out_dir)
+    # En dernier : les éditions modifient l'étage 0
+    result["history"] = bench_history(rng, grid, walls, keys_all, asset_sizes, size, args.edits)
+    return result
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare_results(previous, current):
+    """Affiche le rapport nouveau / ancien des temps moyens communs aux deux runs."""
+    def flatten(node, prefix=""):
+        if isinstance(node, dict):
+            for k, v in node.items():
+                yield from flatten(v, f"{prefix}.{k}" if prefix else k)
+        elif prefix.endswith("_ms") and isinstance(node, (int, float)):
+            yield prefix, node
+
+    old = {r["scenario"]: dict(flatten(r)) for r in previous["results"]}
+    print(f"\nComparaison avec {previous['meta'].get('commit')} (nouveau / ancien, < 1 = plus rapide)")
+    for r in current["results"]:
+        if r["scenario"] not in old: continue
+        for metric, value in flatten(r):
+            before = old[r["scenario"]].get(metric)
+            if before:
+                print(f"  {r['scenario']:<8} {metric:<45} {before:10.3f} -> {value:10.3f} ms  x{value / before:.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc d'essai MapDungeon (rendu, sélection, historique, E/S).")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--size", type=int, help="Scénario personnalisé : côté de la grille en cases")
+    parser.add_argument("--depth", type=int, default=2, help="Scénario personnalisé : éléments par case")
+    parser.add_argument("--rotated", type=float, default=0.25, help="Scénario personnalisé : part pivotée (0-1)")
+    parser.add_argument("--walls", type=int, default=500, help="Scénario personnalisé : murs par étage")
+    parser.add_argument("--levels", type=int, default=1, help="Scénario personnalisé : nombre d'étages")
+    parser.add_argument("--repeat", type=int, default=10, help="Répétitions des mesures à chaud")
+    parser.add_argument("--picks", type=int, default=2000, help="Appels à get_tile_at_pixel")
+    parser.add_argument("--edits", type=int, default=500, help="Éditions pour la mesure de l'historique")
+    parser.add_argument("--asset-budget", type=int, help="Budget du cache des pleines tailles, en Mo")
+    parser.add_argument("--opaque-24bit", action="store_true", help="Assets opaques stockés en 24 bits")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--out", default="benchmark.json", help="Fichier JSON des résultats")
+    parser.add_argument("--compare", help="JSON d'un run précédent à comparer")
+    args = parser.parse_args(argv)
+
+    if args.size:
+        scenarios = {"perso": {"size": args.size, "depth": args.depth, "rotated": args.rotated,
+                               "walls": args.walls, "levels": args.levels}}
+    else:
+        scenarios = {name: SCENARIOS[name] for name in args.scenarios}
+
+    if args.asset_budget: md.FULL_ASSET_CACHE_MAX_BYTES = args.asset_budget * 1024 * 1024
+    md.OPAQUE_ASSETS_24BIT = args.opaque_24bit
+
+    # 1. Assets (un display est requis par convert_alpha)
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+    load_ms, loaded = timed(md.load_all_assets_from_folder, md.ASSET_ROOT)
+    assets_full, assets_thumb, asset_sizes, libraries = loaded
+    keys_all = sorted(asset_sizes)
+    keys_1x1 = [key for key in keys_all if asset_sizes[key] == 1]
+    if not keys_1x1:
+        print("Aucun asset 1x1 trouvé.")
+        return 1
+
+    # Pleines tailles chargées d'avance : le rendu "à froid" mesure les caches de rendu, pas la lecture disque
+    for key in asset_sizes:
+        md.get_full_asset(assets_full, key)
+
+    # 2. Atlas des miniatures (indépendant des scénarios)
+    atlas = bench_atlas(assets_thumb, args.repeat * 10)
+    for kind, r in atlas.items():
+        print(f"atlas {kind:<6} {r['atlas']['pages']} page(s) {r['atlas']['bytes'] // 1024} Ko, "
+              f"{r['atlas']['blits_per_s']} blits/s  |  {r['per_surface']['surfaces']} surfaces "
+              f"{r['per_surface']['bytes'] // 1024} Ko, {r['per_surface']['blits_per_s']} blits/s")
+
+    # 3. Scénarios
+    results = []
+    for name, params in scenarios.items():
+        start = time.perf_counter()
+        results.append(run_scenario(name, params, assets_full, asset_sizes, keys_1x1, keys_all, args))
+        r = results[-1]
+        print(f"{name:<8} {r['items']:>8} éléments  rendu {r['render']['zoom_1.0']['warm']['mean_ms']:8.2f} ms  "
+              f"sélection {r['pick']['mean_ms'] * 1000:6.1f} µs  "
+              f"chargement {r['project_io'][md.PROJECT_BINARY_EXT.lstrip('.')]['load_ms']:8.0f} ms  "
+              f"export {r['export_vtt']['ms']:8.0f} ms  ({time.perf_counter() - start:.1f} s)")
+
+    report = {
+        "meta": {"format": BENCH_FORMAT_VERSION, "commit": get_commit(), "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "python": platform.python_version(), "pygame": pygame.version.ver, "platform": platform.platform(),
+                 "seed": args.seed, "repeat": args.repeat, "asset_load_ms": round(load_ms, 4),
+                 "assets": len(asset_sizes)},
+        "atlas": atlas,
+        "full_asset_cache": md.get_full_asset_stats(),
+        "results": results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Résultats : {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(json.load(f), report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())